@@ -0,0 +1,194 @@
+# agents/answer_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from agents.text import normalize_text
+from connectors.clickhouse import run_query
+
+# --- CONFIGURATION ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Optional SQLite file that keeps answers across restarts and shares them between processes.
+ANSWER_CACHE_DISK_PATH = os.getenv("ANSWER_CACHE_DISK_PATH")
+# Tables whose data the cached answers depend on; any new or merged part invalidates them.
+ANSWER_CACHE_TABLES = [t.strip() for t in os.getenv("ANSWER_CACHE_TABLES", "mortgage_events").split(",") if t.strip()]
+# How often (seconds) system.parts is re-read. Between checks hits never touch ClickHouse.
+ANSWER_CACHE_FRESHNESS_INTERVAL = float(os.getenv("ANSWER_CACHE_FRESHNESS_INTERVAL", "30"))
+
+MANIFEST_FILENAME = "analysis_manifest.json"
+
+# Answers that describe a failure are never cached.
+UNCACHEABLE_PREFIXES = ("Agent stopped", "An error occurred", "Error:")
+
+
+def fingerprint(text: str) -> str:
+    """Short, stable hash used for prompt versions and cache keys."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class _DiskBackend:
+    """A tiny SQLite key/value store for cache entries."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                "key TEXT PRIMARY KEY, answer TEXT, data_version TEXT, created_at REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str):
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT answer, data_version, created_at FROM answer_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"answer": json.loads(row[0]), "data_version": row[1], "created_at": row[2]}
+
+    def put(self, key: str, entry: dict):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, answer, data_version, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry["answer"]), entry["data_version"], entry["created_at"]),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+
+
+class AnswerCache:
+    """
+    Caches final agent answers so a repeated question returns in milliseconds.
+
+    Entries are keyed by the normalized question, the agent type, the agent's prompt version
+    and a hash of analysis_manifest.json, so changing a prompt or the manifest never serves a
+    stale answer. Every entry also records the data version of the ClickHouse tables it was
+    computed from (latest active part modification time and part count in system.parts);
+    an entry whose data version no longer matches is discarded. Eviction is LRU with a TTL,
+    optionally backed by an on-disk SQLite store.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL,
+                 disk_path: str = ANSWER_CACHE_DISK_PATH, tables: list = None, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tables = tables if tables is not None else ANSWER_CACHE_TABLES
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._disk = _DiskBackend(disk_path) if disk_path else None
+        self._data_version = None
+        self._data_version_checked_at = 0.0
+        self._manifest_hash = None
+        self._manifest_mtime = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- KEYS AND VERSIONS ---
+
+    def _get_manifest_hash(self) -> str:
+        try:
+            mtime = os.path.getmtime(MANIFEST_FILENAME)
+            if mtime != self._manifest_mtime:
+                with open(MANIFEST_FILENAME, 'rb') as f:
+                    self._manifest_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+                self._manifest_mtime = mtime
+        except OSError:
+            self._manifest_hash = "no-manifest"
+        return self._manifest_hash
+
+    def make_key(self, question: str, agent_type: str, prompt_version: str) -> str:
+        return fingerprint("|".join([normalize_text(question), agent_type, prompt_version, self._get_manifest_hash()]))
+
+    async def get_data_version(self, force: bool = False):
+        """
+        Returns a string that changes whenever any watched table gets new or merged parts.
+        Re-read at most every ANSWER_CACHE_FRESHNESS_INTERVAL seconds. None if ClickHouse is unreachable.
+        """
+        if not force and time.monotonic() - self._data_version_checked_at < ANSWER_CACHE_FRESHNESS_INTERVAL:
+            return self._data_version
+        try:
+            result = await run_query(
+                "SELECT toString(max(modification_time)), count() FROM system.parts "
+                "WHERE active AND database = 'default' AND table IN {tables:Array(String)}",
+                parameters={"tables": self.tables},
+            )
+            latest, part_count = result.result_rows[0]
+            self._data_version = f"{latest}/{part_count}"
+        except Exception as e:
+            print(f"  > Answer cache: could not read table freshness, bypassing cache. Error: {e}")
+            self._data_version = None
+        self._data_version_checked_at = time.monotonic()
+        return self._data_version
+
+    # --- GET / PUT ---
+
+    async def get(self, question: str, agent_type: str, prompt_version: str):
+        """Returns the cached answer, or None on a miss or if the underlying data changed."""
+        if not self.enabled:
+            return None
+        key = self.make_key(question, agent_type, prompt_version)
+        entry = self._memory.get(key)
+        if entry is None and self._disk:
+            entry = self._disk.get(key)
+
+        data_version = await self.get_data_version() if entry else None
+        if entry is None or data_version is None or not self._is_valid(entry, data_version):
+            if entry is not None:
+                self._evict(key)
+            self.misses += 1
+            return None
+
+        self._remember(key, entry)
+        self.hits += 1
+        print(f"--- 💾 ANSWER CACHE HIT for '{question[:50]}' ---")
+        return entry["answer"]
+
+    async def put(self, question: str, agent_type: str, prompt_version: str, answer):
+        if not self.enabled or not answer or str(answer).startswith(UNCACHEABLE_PREFIXES):
+            return
+        data_version = await self.get_data_version()
+        if data_version is None:
+            return
+        key = self.make_key(question, agent_type, prompt_version)
+        entry = {"answer": answer, "data_version": data_version, "created_at": time.time()}
+        self._remember(key, entry)
+        if self._disk:
+            self._disk.put(key, entry)
+
+    def _remember(self, key: str, entry: dict):
+        """Puts an entry in the memory tier as most recently used, evicting the oldest beyond max_entries."""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _is_valid(self, entry: dict, data_version: str) -> bool:
+        return time.time() - entry["created_at"] <= self.ttl and entry["data_version"] == data_version
+
+    def _evict(self, key: str):
+        self._memory.pop(key, None)
+        if self._disk:
+            self._disk.delete(key)
+
+    def clear(self):
+        self._memory.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._memory), "hits": self.hits, "misses": self.misses,
+                "data_version": self._data_version, "disk": bool(self._disk)}
+
+
+# The answer cache shared by '/ask' and the batch audit.
+answer_cache = AnswerCache()
@@ -0,0 +1,41 @@
+# agents/assets.py
+
+import time
+import threading
+
+
+class AssetRegistry:
+    """
+    Prompt and procedure files, read once per process and shared by every module and agent.
+
+    Texts are returned as (immutable) strings, so no caller can change what another one sees.
+    The analysis manifest is shared the same way through `agents.manifest.manifest_store`,
+    which additionally reloads it when processor.py syncs a new version.
+    """
+
+    def __init__(self):
+        self._texts = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def text(self, path: str) -> str:
+        """
+        Returns the file's content, reading it only on first use.
+
+        Raises:
+            OSError: If the file cannot be read (the failure is not cached).
+        """
+        with self._lock:
+            if path not in self._texts:
+                started = time.perf_counter()
+                with open(path, 'r') as f:
+                    self._texts[path] = f.read()
+                self._loaded[path] = round((time.perf_counter() - started) * 1000, 2)
+            return self._texts[path]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {path: {"chars": len(text), "load_ms": self._loaded[path]} for path, text in self._texts.items()}
+
+
+assets = AssetRegistry()
@@ -1,17 +1,19 @@
 import json
 import os
-from langchain_openai import AzureChatOpenAI
 from mcp_use import MCPAgent
 from connectors.mcp_client import create_client_to_running_server_clickhouse
 from langchain_core.messages import HumanMessage # Assuming HumanMessage is used in your graph state
+from agents.cache import agent_cache
+from agents.llm_router import create_routed_llm
+from agents.assets import assets
+from agents.prompt_builder import PARALLEL_TOOL_CALLS_HINT
 
 # --- STEP 1: DEFINE THE NEW, GENERIC SYSTEM PROMPT FOR THE AUDITOR AGENT ---
 
 # I've renamed the variable to AUDITOR_PROCEDURE for clarity.
 PROCEDURE_FILENAME = "prompts/auditor.txt" 
 try:
-    with open(PROCEDURE_FILENAME, 'r') as f:
-        AUDITOR_PROCEDURE = f.read()
+    AUDITOR_PROCEDURE = assets.text(PROCEDURE_FILENAME)
     print("Auditor's detailed procedure loaded successfully.")
 except Exception as e:
     print(f"FATAL ERROR loading auditor procedure: {e}")
@@ -29,6 +31,8 @@ Your general operational procedure is as follows:
 3.  Formulate precise and efficient SQL queries using `run_select_query` to gather evidence.
 4.  Provide a clear, concise, and factual summary of your findings.
 
+{PARALLEL_TOOL_CALLS_HINT}
+
 ---
 ### MANDATORY PROCEDURE FOR 'GAP ANALYSIS' TASKS
 
@@ -44,12 +48,7 @@ def create_llm_for_agent():
     Initializes and returns the LLM for the agent.
     This function remains generic as it only configures the language model.
     """
-    llm = AzureChatOpenAI(
-        azure_deployment="gpt-4.1-mini",       # your deployed model name on Azure
-        api_version="2023-06-01-preview",
-        temperature=0.7, 
-        max_tokens=4000
-    )
+    llm = create_routed_llm("auditor", primary="azure", temperature=0.7, max_tokens=4000)
     return llm
 
 def create_auditor_agent():
@@ -99,20 +98,15 @@ async def auditor_node(state: dict):
 
     print("--- 🛡️ AUDITOR NODE: Starting investigation... ---")
     
-    # 1. Create the specialist agent instance
-    agent = create_auditor_agent()
-
-    # 2. Get the user's query from the state
+    # 1. Get the user's query from the state
     user_query = state['messages'][-1].content
 
+    # 2. Run it on a warm agent from the process-wide cache (sessions are closed by agent_cache.close_all())
     try:
-        response = await agent.run(user_query)
+        response = await agent_cache.run("auditor", create_auditor_agent, user_query)
     except Exception as e:
         response = f"An error occurred while running the Auditor agent: {e}"
     
-    # Always close the client sessions after the node is done
-    await agent.client.close_all_sessions()
-    
     print(f"--- ✅ Auditor agent finished with response: {response} ---")
 
     # 4. Return the response in the correct format to update the state
@@ -0,0 +1,120 @@
+# agents/cache.py
+
+import os
+import time
+import asyncio
+import anyio
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+from agents.pool import AgentPool
+from agents.prompt_builder import apply_system_prompt
+from metrics import observe_agent_run
+
+# Agents kept warm per agent type (e.g. "clickhouse", "auditor", "clickhouse_audit").
+AGENT_CACHE_POOL_SIZE = int(os.getenv("AGENT_CACHE_POOL_SIZE", "2"))
+# A type that has not been used for this many seconds has its agents and sessions closed.
+AGENT_CACHE_IDLE_TTL = float(os.getenv("AGENT_CACHE_IDLE_TTL", "900"))
+
+# Raised by mcp_use when a run needs a session that is gone.
+SESSION_ERROR_MESSAGES = ("not connected", "not initialized", "connection was not established")
+
+
+def is_session_error(error: BaseException) -> bool:
+    """True when `error` (or what caused it) means an MCP session dropped, not that the run itself failed."""
+    while error is not None:
+        if isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)):
+            return True
+        if isinstance(error, McpError) and error.error.code == CONNECTION_CLOSED:
+            return True
+        if isinstance(error, RuntimeError) and any(m in str(error).lower() for m in SESSION_ERROR_MESSAGES):
+            return True
+        error = error.__cause__
+    return False
+
+
+class AgentCache:
+    """
+    Process-wide cache of built agents and their live MCP sessions, keyed by agent type.
+
+    The LangGraph nodes used to build an LLM client, an MCPClient and a fresh SSE session on
+    every invocation and tear all of it down again at the end. The cache keeps a small
+    AgentPool per agent type instead, so a node invocation borrows a warm agent, evicts
+    types that have been idle for longer than `idle_ttl`, rebuilds an agent and retries
+    once when a run fails on a dead session, and closes everything in `close_all()`. Any
+    other failure (the LLM provider, bad input) is raised at once: retrying a whole multi-step
+    run would only double its cost.
+    """
+
+    def __init__(self, pool_size: int = AGENT_CACHE_POOL_SIZE, idle_ttl: float = AGENT_CACHE_IDLE_TTL):
+        self.pool_size = pool_size
+        self.idle_ttl = idle_ttl
+        self._pools = {}
+        self._last_used = {}
+        self._locks = {}
+
+    async def _get_pool(self, agent_type: str, factory) -> AgentPool:
+        await self.evict_idle()
+        lock = self._locks.setdefault(agent_type, asyncio.Lock())
+        async with lock:
+            pool = self._pools.get(agent_type)
+            if pool is None:
+                print(f"--- 🧊 Agent cache miss for '{agent_type}', building a warm pool... ---")
+                pool = AgentPool(factory, size=self.pool_size, name=f"{agent_type} cache")
+                await pool.start()
+                self._pools[agent_type] = pool
+            self._last_used[agent_type] = time.monotonic()
+            return pool
+
+    async def run(self, agent_type: str, factory, query: str, retries: int = 1, prompt_builder=None):
+        """
+        Runs a query on a cached agent of the given type.
+
+        Args:
+            agent_type (str): Cache key, one per kind of agent.
+            factory (callable): Builds a new agent of that type (e.g. `create_clickhouse_agent`).
+            query (str): The user's query.
+            retries (int): How many times to rebuild the agent and retry after a dropped session.
+            prompt_builder (callable): Optional `prompt_builder(query)` for a request-specific system prompt.
+
+        Returns:
+            str: The agent's response.
+        """
+        pool = await self._get_pool(agent_type, factory)
+        try:
+            for attempt in range(retries + 1):
+                async with pool.checkout() as agent:
+                    try:
+                        if prompt_builder is not None:
+                            apply_system_prompt(agent, prompt_builder(query))
+                        return await observe_agent_run(agent, query, agent_type)
+                    except Exception as e:
+                        pool.mark_broken(agent)
+                        # Only a dropped session is worth a retry, on a rebuilt agent with fresh sessions.
+                        session_dropped = is_session_error(e) or not pool.is_healthy(agent)
+                        if attempt == retries or not session_dropped:
+                            raise
+                        print(f"  > Agent cache: '{agent_type}' run failed ({e}), reconnecting and retrying...")
+        finally:
+            self._last_used[agent_type] = time.monotonic()
+
+    async def evict_idle(self):
+        """Closes the agents and sessions of every type that has been idle for longer than the TTL."""
+        now = time.monotonic()
+        for agent_type, last_used in list(self._last_used.items()):
+            pool = self._pools.get(agent_type)
+            # Never close a pool while one of its agents is still in the middle of a run.
+            if pool and now - last_used > self.idle_ttl and pool.stats()["in_use"] == 0:
+                print(f"  > Agent cache: evicting idle '{agent_type}' agents.")
+                del self._pools[agent_type]
+                del self._last_used[agent_type]
+                await pool.close()
+
+    async def close_all(self):
+        """Shutdown hook: closes every cached agent and MCP session."""
+        for agent_type in reversed(list(self._pools)):
+            await self._pools.pop(agent_type).close()
+        self._last_used.clear()
+
+
+# The single cache shared by every LangGraph node in the process.
+agent_cache = AgentCache()
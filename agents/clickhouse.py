@@ -1,9 +1,6 @@
 import os
-from langchain_groq import ChatGroq
 from mcp_use import MCPAgent
 
-from langchain_openai import AzureChatOpenAI
-
 import json
 import os
 
@@ -78,29 +75,33 @@ import os
 
 import json
 import os
-from langchain_openai import AzureChatOpenAI
 from mcp_use import MCPAgent
 from connectors.mcp_client import create_client_to_running_server_clickhouse
 from langchain_core.messages import HumanMessage
+from agents.cache import agent_cache
+from agents.fast_path import try_fast_path
+from agents.prompt_builder import ManifestIndex, build_prompt, PARALLEL_TOOL_CALLS_HINT
+from agents.manifest import manifest_store
+from agents.llm_router import create_routed_llm
+from agents.assets import assets
 
-# --- STEP 1: LOAD ALL EXTERNAL KNOWLEDGE (Remains the same) ---
+# --- STEP 1: LOAD ALL EXTERNAL KNOWLEDGE ---
 
-MANIFEST_FILENAME = "analysis_manifest.json"
-try:
-    with open(MANIFEST_FILENAME, 'r') as f:
-        manifest_data = json.load(f)
-    raw_json_string = json.dumps(manifest_data, indent=4)
-    # Double curly braces are needed here because this JSON is part of a larger f-string prompt template.
-    ANALYSIS_MANIFEST_JSON = raw_json_string.replace("{", "{{").replace("}", "}}")
+manifest_data = manifest_store.get()
+if manifest_data:
     print("Analyst manifest loaded successfully.")
-except Exception as e:
-    print(f"FATAL ERROR loading manifest: {e}")
-    ANALYSIS_MANIFEST_JSON = "[]"
+else:
+    print(f"FATAL ERROR loading manifest: '{manifest_store.path}' is missing or empty.")
+
+# The manifest is kept as a compact, searchable index; only the entries relevant to a
+# request are put in the system prompt (see build_clickhouse_prompt). When processor.py
+# syncs the manifest, only the changed entries are re-indexed.
+MANIFEST_INDEX = ManifestIndex(manifest_data)
+manifest_store.on_change(lambda entries, changes: MANIFEST_INDEX.update(entries))
 
 PROCEDURE_FILENAME = "dynamic_doc_prompt.txt" # Assuming this is the architect's procedure
 try:
-    with open(PROCEDURE_FILENAME, 'r') as f:
-        ARCHITECT_PROCEDURE = f.read()
+    ARCHITECT_PROCEDURE = assets.text(PROCEDURE_FILENAME)
     print("Architect procedure loaded successfully.")
 except Exception as e:
     print(f"FATAL ERROR loading architect procedure: {e}")
@@ -108,7 +109,7 @@ except Exception as e:
 
 # --- STEP 2: UPDATE THE ANALYST'S PROCEDURE WITHIN THE SYSTEM PROMPT ---
 
-prompt = f"""
+PROMPT_HEADER = """
 You are a multi-talented ClickHouse data robot. You can act as either an Analyst to run queries for a user, or as an Architect to perform system maintenance. You MUST determine the user's intent and follow the correct procedure.
 
 --- PROCEDURE 1: ACTING AS AN ANALYST ---
@@ -128,15 +129,17 @@ You have the following tools. You MUST choose the correct one based on the proce
 
 --- ANALYSIS MANIFEST ---
 This is your internal knowledge base for analyses.
+"""
 
-{ANALYSIS_MANIFEST_JSON}
-
+PROMPT_PROCEDURE = """
 --- REQUIRED PROCEDURE ---
-1.  **IDENTIFY AND MATCH:** Find the JSON object in the manifest where the `analysis_type` matches the user's request. Identify the `sql_template_path` and a best-guess for the primary table being queried.
+1.  **IDENTIFY AND MATCH:** Find the entry in the manifest whose `analysis_type` matches the user's request. Identify the `sql_template_path` and a best-guess for the primary table being queried.
 2.  **VALIDATE (if necessary):** If `udf_required` is NOT `null`, call `list_user_defined_functions()` to verify the UDF exists. If not, STOP and report the error.
 3.  **RETRIEVE THE COMMAND:** Call `read_sql_query_file()` using the `sql_template_path` from the manifest.
+    Steps 2 and 3 are independent: when a UDF is required, call `list_user_defined_functions()` and `read_sql_query_file()` in the same turn.
 4.  **EXECUTE THE COMMAND:** Call `run_select_query()` with the `sql_query` returned by the previous tool.
 5.  **FORMAT THE OUTPUT:** After executing the query, summarize the results and present your entire response using the MANDATORY OUTPUT FORMAT below.
+""" + PARALLEL_TOOL_CALLS_HINT + """
 
 --- MANDATORY OUTPUT FORMAT (FOR ANALYST ROLE ONLY) ---
 Your final response MUST strictly follow the markdown structure below. Do not add any conversational text or pleasantries before or after this structure.
@@ -148,6 +151,20 @@ Your final response MUST strictly follow the markdown structure below. Do not ad
 **Provided Answer:** `[A concise, natural language summary of the key findings from the query results.]`
 --- """
 
+
+def build_clickhouse_prompt(user_query: str = "") -> str:
+    """Builds the analyst system prompt with only the manifest entries relevant to `user_query`."""
+    manifest_store.get()  # picks up a re-synced manifest without a restart
+    prompt, _ = build_prompt(
+        [("header", PROMPT_HEADER), ("manifest", None), ("procedure", PROMPT_PROCEDURE)],
+        "manifest", MANIFEST_INDEX.section, user_query, label="clickhouse",
+    )
+    return prompt
+
+
+# Default prompt (every manifest entry, compact) used until a request-specific one is applied.
+prompt = build_clickhouse_prompt()
+
 # --- STEP 3: INITIALIZE THE AGENT ---
 
 
@@ -161,11 +178,8 @@ def create_clickhouse_llm():
     #     # Temperature 0 makes the output more deterministic and predictable
     #     temperature=0
     # )
-    llm = AzureChatOpenAI(
-        azure_deployment="gpt-4.1-mini",       # your deployed model name on Azure
-        api_version="2023-06-01-preview",
-        temperature=0.7, max_tokens=4000
-    )
+    # Azure gpt-4.1-mini, routed together with the other configured providers (agents/llm_router.py).
+    llm = create_routed_llm("clickhouse", primary="azure", temperature=0.7, max_tokens=4000)
     # Note: If you need to bind tools, you can implement a bind_tools() method in the LLM class.
     # llm.bind_tools(tools)  # Uncomment if you have tools to bind.
     
@@ -243,20 +257,21 @@ async def clickhouse_node(state: dict):
 
     print("--- 📊 CLICKHOUSE ANALYST: Taking over... ---")
     
-    # 1. Create the specialist agent instance
-    agent = create_clickhouse_agent()
-
-    # 2. Get the user's query from the state
+    # 1. Get the user's query from the state
     user_query = state['messages'][-1].content
 
-    try:
-        response = await agent.run(user_query)
-    except Exception as e:
-        response = f"An error occurred while running the ClickHouse agent: {e}"
-    
-    # Always close the client sessions after the node is done.
-    # This is crucial for connecting to an existing server.
-    await agent.client.close_all_sessions()
+    # 2. Named analyses from the manifest are matched and executed directly, with a
+    # single LLM call for the summary. Anything else falls through to the agent.
+    response = await try_fast_path(user_query)
+
+    # 3. Otherwise run it on a warm agent from the process-wide cache. The cache owns the
+    # client sessions and closes them on eviction or shutdown (agent_cache.close_all()).
+    if response is None:
+        try:
+            response = await agent_cache.run("clickhouse", create_clickhouse_agent, user_query,
+                                         prompt_builder=build_clickhouse_prompt)
+        except Exception as e:
+            response = f"An error occurred while running the ClickHouse agent: {e}"
     
     print(f"--- ✅ ClickHouse agent finished with response: {response} ---")
 
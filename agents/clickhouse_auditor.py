@@ -2,17 +2,18 @@
 
 import json
 import os
-from langchain_openai import AzureChatOpenAI
-from mcp_use import MCPAgent
-from connectors.mcp_client import create_client_to_running_server_clickhouse
 from langchain_core.messages import HumanMessage
+from agents.cache import agent_cache
+from agents.answer_cache import fingerprint
+from agents.prompt_builder import SopIndex, build_prompt
+from agents.llm_router import create_routed_llm
+from agents.assets import assets
 
 # --- STEP 1: LOAD THE AUDITOR'S DETAILED PROCEDURE ---
 PROCEDURE_FILENAME = "prompts/clickhouse_audit.txt" 
 try:
     # This reads the entire content of the SOP file.
-    with open(PROCEDURE_FILENAME, 'r') as f:
-        AUDITOR_SOP = f.read()
+    AUDITOR_SOP = assets.text(PROCEDURE_FILENAME)
     print("Auditor's SOP loaded successfully.")
 except Exception as e:
     print(f"FATAL ERROR loading auditor SOP: {e}")
@@ -20,17 +21,34 @@ except Exception as e:
 
 # --- STEP 2: CREATE THE FINAL SYSTEM PROMPT BY WRAPPING THE SOP ---
 # This adds the high-level instructions and injects the detailed SOP.
-prompt = f"""
+PROMPT_PREAMBLE = """
 You are the ClickHouse Auditor Agent. Your identity and instructions are defined by the Standard Operating Procedure (SOP) provided below.
 
 Your primary role is to act as a secure and reliable interface to a set of predefined audit queries. You must follow the procedure outlined in the SOP with absolute precision. Do not deviate, infer tasks, or perform any action not explicitly described in the procedure.
 
 Your entire operational knowledge base and mandatory workflow are contained in the following SOP.
 
----
-{AUDITOR_SOP}
----
-"""
+---"""
+
+# The SOP is indexed once so each request only inlines the audits relevant to it.
+SOP_INDEX = SopIndex(AUDITOR_SOP)
+
+
+def build_audit_prompt(user_query: str = "") -> str:
+    """Builds the auditor system prompt with only the SOP audit entries relevant to `user_query`."""
+    prompt, _ = build_prompt(
+        [("preamble", PROMPT_PREAMBLE), ("sop_header", SOP_INDEX.header), ("sop_manifest", None),
+         ("sop_procedure", SOP_INDEX.footer), ("closing", "---")],
+        "sop_manifest", SOP_INDEX.section, user_query, label="clickhouse_audit",
+    )
+    return prompt
+
+
+# Default prompt (full SOP) used until a request-specific one is applied.
+prompt = build_audit_prompt()
+
+# Changes whenever the prompt or SOP changes, so cached answers from an older prompt are never reused.
+PROMPT_VERSION = fingerprint(PROMPT_PREAMBLE + AUDITOR_SOP)
 
 # --- AGENT CREATION LOGIC ---
 
@@ -48,16 +66,8 @@ def create_audit_llm(): # <-- RENAMED for clarity
     #     temperature=0.7, 
     #     max_tokens=4000
     # )
-    from langchain_google_genai import ChatGoogleGenerativeAI
-
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        # other params...
-    )
+    # Gemini 2.5 Flash, routed together with the other configured providers (agents/llm_router.py).
+    llm = create_routed_llm("clickhouse_audit", primary="gemini", temperature=0)
     return llm
 
 def create_clickhouse_audit_agent(): # <-- RENAMED to be more specific
@@ -65,6 +75,9 @@ def create_clickhouse_audit_agent(): # <-- RENAMED to be more specific
     Creates the complete ClickHouse Auditor specialist agent.
     """
     print("--- 🛡️ Building ClickHouse Auditor Agent ---")
+    # Imported here so the API process can start serving before mcp_use is loaded.
+    from mcp_use import MCPAgent
+    from connectors.mcp_client import create_client_to_running_server_clickhouse
     
     client = create_client_to_running_server_clickhouse()
     llm = create_audit_llm()
@@ -88,16 +101,14 @@ async def clickhouse_audit_node(state: dict): # <-- RENAMED to be more specific
     """
     print("--- 🛡️ CLICKHOUSE AUDITOR NODE: Starting investigation... ---")
     
-    agent = create_clickhouse_audit_agent()
     user_query = state['messages'][-1].content
 
     try:
-        response = await agent.run(user_query)
+        response = await agent_cache.run("clickhouse_audit", create_clickhouse_audit_agent, user_query,
+                                         prompt_builder=build_audit_prompt)
     except Exception as e:
         response = f"An error occurred while running the ClickHouse Auditor agent: {e}"
     
-    await agent.client.close_all_sessions()
-    
     print(f"--- ✅ ClickHouse Auditor agent finished with response: {response} ---")
     
     return {"messages": [HumanMessage(content=response)]}
\ No newline at end of file
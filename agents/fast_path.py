@@ -0,0 +1,220 @@
+# agents/fast_path.py
+
+import os
+import re
+import json
+import time
+from langchain_core.messages import SystemMessage, HumanMessage
+from agents.text import normalize_text, tokenize
+from connectors.clickhouse import run_query
+from connectors.digest import format_result_for_llm
+from agents.manifest import manifest_store
+from snapshot_refresher import snapshot_refresher, read_parquet_snapshot
+
+# --- CONFIGURATION ---
+MANIFEST_FILENAME = "analysis_manifest.json"
+SQL_DIRECTORY = "mortgage_sql_queries"
+# Below this match confidence the request is handed to the full LLM agent instead.
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.75"))
+# Confidence lost for every word of the request that the matched analysis does not account for.
+FAST_PATH_EXTRA_WORD_PENALTY = float(os.getenv("FAST_PATH_EXTRA_WORD_PENALTY", "0.15"))
+# How long the list of active UDFs is trusted before it is re-read from ClickHouse.
+FAST_PATH_UDF_CACHE_TTL = float(os.getenv("FAST_PATH_UDF_CACHE_TTL", "600"))
+
+# Requests with these words are Architect (documentation) tasks and always go to the agent.
+ARCHITECT_WORDS = {"generate", "create", "populate", "update", "document", "documentation", "catalog"}
+# Words that ask for something the stored analysis cannot answer as-is (a negation, a filter,
+# how it works); requests with any of them always go to the agent.
+MODIFIER_WORDS = {
+    "not", "no", "don", "dont", "never", "without", "except", "excluding", "exclude", "instead", "rather", "skip",
+    "where", "only", "filter", "filtered", "than", "greater", "less", "above", "below", "between", "over", "under",
+    "top", "limit", "before", "after", "since", "until", "count", "sum", "average", "avg", "per",
+    "explain", "how", "why", "computed", "calculated", "calculate", "defined", "definition", "logic", "mean", "means",
+}
+# Words that only ask for the analysis to be run or shown, on top of text.STOPWORDS.
+NEUTRAL_WORDS = {
+    "results", "result", "latest", "current", "report", "summary", "summarize", "summarise", "findings",
+    "execute", "see", "view", "let", "check", "look", "list", "display", "tell", "about", "us", "mortgage", "events",
+}
+
+SUMMARY_PROMPT = """You are a ClickHouse data analyst. A named analysis has already been executed for the user; its results (raw rows or a statistical digest) are below.
+Summarize the key findings (if a 'Data as of' time is given, state it in the answer) and present your entire response using EXACTLY this markdown structure, with no text before or after it:
+
+---
+**Dataset:** `[The name of the primary table that was queried]`
+**Question:** `[The user's original input query]`
+**Provided Answer:** `[A concise, natural language summary of the key findings from the query results.]`
+---"""
+
+_udf_cache = {"names": None, "fetched_at": 0.0}
+_summary_llm = None
+
+
+# --- STEP 1: MATCH THE REQUEST TO A MANIFEST ENTRY (no LLM) ---
+
+def load_manifest(manifest_filename: str = MANIFEST_FILENAME) -> list:
+    if manifest_filename == MANIFEST_FILENAME:
+        # Served from memory and reloaded only when processor.py re-syncs the file.
+        return manifest_store.get()
+    try:
+        with open(manifest_filename, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"  > Fast path: could not load manifest, disabling fast path. Error: {e}")
+        return []
+
+
+def _entry_phrases(entry: dict) -> list:
+    """All the ways a user is likely to name an analysis, normalized (e.g. 'case complexity')."""
+    analysis_type = normalize_text(entry.get("analysis_type", ""))
+    view_name = entry.get("view_name") or ""
+    view_stem = view_name.replace(f"_analyzer_{entry.get('dataset', '')}", "")
+    template_stem = os.path.splitext(entry.get("sql_template_path") or "")[0]
+    phrases = {
+        analysis_type,
+        re.sub(r"\s+analysis$", "", analysis_type),
+        view_name.replace("_", " "),
+        view_stem.replace("_", " "),
+        template_stem.replace("_", " "),
+    }
+    return sorted((p for p in phrases if p), key=len, reverse=True)
+
+
+def match_analysis(user_query: str, manifest: list):
+    """
+    Finds the manifest entry a request refers to without calling the LLM.
+
+    An exact mention of an analysis name, view name or template name scores 1.0; otherwise the
+    score is the share of the analysis name's keywords present in the query. A tie between the
+    two best entries makes the match ambiguous and drops the confidence to 0, and so does a
+    negation, filter or question about the analysis (MODIFIER_WORDS, numbers, comparisons).
+    Every other word the analysis does not account for costs FAST_PATH_EXTRA_WORD_PENALTY.
+
+    Returns:
+        tuple: (entry or None, confidence between 0 and 1)
+    """
+    query = normalize_text(user_query).replace("_", " ")
+    query_tokens = set(tokenize(user_query))
+    if not manifest or query_tokens & ARCHITECT_WORDS:
+        return None, 0.0
+
+    scored = []
+    for entry in manifest:
+        keywords = set(tokenize(entry.get("analysis_type", "")))
+        phrase = next((p for p in _entry_phrases(entry) if re.search(rf"\b{re.escape(p)}\b", query)), None)
+        if phrase:
+            score, specificity = 1.0, len(phrase)
+        else:
+            score = len(keywords & query_tokens) / len(keywords) if keywords else 0.0
+            specificity = 0
+        scored.append((score, specificity, entry))
+
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    best_score, best_specificity, best_entry = scored[0]
+    if len(scored) > 1 and scored[1][:2] == (best_score, best_specificity):
+        return best_entry, 0.0
+
+    # A request that names a different table than the analysis was built for is not ours to shortcut.
+    for table in re.findall(r"default\.([a-z0-9_]+)", normalize_text(user_query)):
+        if table not in (best_entry.get("dataset"), best_entry.get("view_name")):
+            return best_entry, 0.0
+
+    # Whatever the analysis does not cover means the request asks for more than its stored result.
+    names = [best_entry.get(key) or "" for key in ("dataset", "view_name", "sql_template_path")]
+    covered = set(tokenize(" ".join(_entry_phrases(best_entry) + names))) | NEUTRAL_WORDS
+    extra = query_tokens - covered
+    if extra & MODIFIER_WORDS or any(token.isdigit() for token in extra) or re.search(r"[<>=]", user_query):
+        return best_entry, 0.0
+    return best_entry, max(0.0, best_score - FAST_PATH_EXTRA_WORD_PENALTY * len(extra))
+
+
+# --- STEP 2: VALIDATE AND EXECUTE DIRECTLY AGAINST CLICKHOUSE ---
+
+async def get_available_udfs(refresh: bool = False) -> set:
+    """Returns the names of the SQL UDFs defined in ClickHouse, cached for FAST_PATH_UDF_CACHE_TTL seconds."""
+    expired = time.monotonic() - _udf_cache["fetched_at"] > FAST_PATH_UDF_CACHE_TTL
+    if refresh or expired or _udf_cache["names"] is None:
+        result = await run_query("SELECT name FROM system.functions WHERE origin = 'SQLUserDefined'")
+        _udf_cache["names"] = {row[0] for row in result.result_rows}
+        _udf_cache["fetched_at"] = time.monotonic()
+    return _udf_cache["names"]
+
+
+def read_sql_template(file_name: str, sql_directory: str = SQL_DIRECTORY) -> str:
+    with open(os.path.join(sql_directory, os.path.basename(file_name)), 'r') as f:
+        return f.read().strip().rstrip(";")
+
+
+async def execute_template(entry: dict):
+    """
+    Runs the entry's SQL template and returns (column_names, columns, snapshot) in columnar form.
+    When the analyzer view has a fresh snapshot it is read instead of the live view, and
+    `snapshot` carries its metadata (None when the live view was queried).
+    """
+    snapshot = snapshot_refresher.get_snapshot(entry.get("view_name", ""))
+    if snapshot and snapshot["backend"] == "parquet":
+        try:
+            column_names, columns = read_parquet_snapshot(snapshot["location"])
+            return column_names, columns, snapshot
+        except Exception as e:
+            print(f"  > Fast path: could not read snapshot '{snapshot['location']}', using the live view. Error: {e}")
+            snapshot = None
+    sql = f"SELECT * FROM {snapshot['location']}" if snapshot else read_sql_template(entry["sql_template_path"])
+    result = await run_query(sql)
+    return list(result.column_names), [list(column) for column in result.result_columns], snapshot
+
+
+# --- STEP 3: ONE LLM CALL FOR THE SUMMARY ---
+
+def _get_summary_llm():
+    global _summary_llm
+    if _summary_llm is None:
+        from agents.clickhouse import create_clickhouse_llm
+        _summary_llm = create_clickhouse_llm()
+    return _summary_llm
+
+
+async def summarize_results(user_query: str, entry: dict, column_names: list, columns: list, snapshot: dict = None) -> str:
+    # Beyond a handful of rows the LLM only sees the digest, so the prompt stays the same size as the tables grow.
+    as_of = ""
+    if snapshot:
+        as_of = f"Data as of: {time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(snapshot['refreshed_at']))} (analyzer snapshot)\n"
+    message = (
+        f"User question: {user_query}\n"
+        f"Analysis: {entry.get('analysis_type')} ({entry.get('description')})\n"
+        f"Primary table: default.{entry.get('dataset')}\n{as_of}\n"
+        f"Results:\n{format_result_for_llm(column_names, columns)}"
+    )
+    response = await _get_summary_llm().ainvoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=message)])
+    return response.content
+
+
+async def try_fast_path(user_query: str, manifest: list = None):
+    """
+    Answers a named-analysis request without the LLM tool loop.
+
+    Returns:
+        str: The formatted answer, or None if the request should go to the full agent.
+    """
+    manifest = manifest if manifest is not None else load_manifest()
+    entry, confidence = match_analysis(user_query, manifest)
+    if entry is None or confidence < FAST_PATH_MIN_CONFIDENCE:
+        print(f"--- 🐢 FAST PATH: no confident manifest match (confidence={confidence:.2f}), using the agent. ---")
+        return None
+
+    print(f"--- ⚡ FAST PATH: matched '{entry['analysis_type']}' (confidence={confidence:.2f}) ---")
+    try:
+        udf_required = entry.get("udf_required")
+        if udf_required and udf_required not in await get_available_udfs():
+            # Re-read once in case the UDF was created after the cache was filled.
+            if udf_required not in await get_available_udfs(refresh=True):
+                return (f"Error: the '{entry['analysis_type']}' requires the UDF `{udf_required}`, "
+                        f"which is not defined in ClickHouse. The analysis was not run.")
+
+        column_names, columns, snapshot = await execute_template(entry)
+        source = f"snapshot {snapshot['location']}" if snapshot else f"'{entry['sql_template_path']}'"
+        print(f"  > Fast path: {source} returned {len(columns[0]) if columns else 0} rows.")
+        return await summarize_results(user_query, entry, column_names, columns, snapshot)
+    except Exception as e:
+        print(f"  > Fast path failed, falling back to the agent. Error: {e}")
+        return None
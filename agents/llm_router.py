@@ -0,0 +1,304 @@
+# agents/llm_router.py
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Dict
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from metrics import MetricsCallbackHandler, LLM_PROVIDER_LATENCY, LLM_ROUTER_EVENTS
+
+# --- CONFIGURATION ---
+# Providers an agent may be routed to besides its own, e.g. "azure,gemini". Only providers whose
+# credentials are set take part; an agent's own provider always does. Empty (the default) =
+# routing is off and every agent stays on its own provider.
+LLM_ROUTER_PROVIDERS = [p.strip() for p in os.getenv("LLM_ROUTER_PROVIDERS", "").split(",") if p.strip()]
+# Fire a second provider when the first has not answered within its own p95 latency.
+LLM_ROUTER_HEDGE = os.getenv("LLM_ROUTER_HEDGE", "true").lower() == "true"
+LLM_ROUTER_HEDGE_MIN_DELAY = float(os.getenv("LLM_ROUTER_HEDGE_MIN_DELAY", "1.0"))
+LLM_ROUTER_HEDGE_MAX_DELAY = float(os.getenv("LLM_ROUTER_HEDGE_MAX_DELAY", "30"))
+# Hedge delay used until a provider has enough samples for a p95.
+LLM_ROUTER_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_ROUTER_HEDGE_DEFAULT_DELAY", "8"))
+# Rolling window of calls per provider used for latency and error rates.
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+# A provider with a higher error rate than this over the window is only used as a last resort.
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.3"))
+# Share of calls sent to a random healthy provider first, so every provider's numbers stay current.
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+
+MIN_SAMPLES = 5
+
+
+# --- PROVIDERS ---
+
+def _azure(**params):
+    from langchain_openai import AzureChatOpenAI
+    return AzureChatOpenAI(azure_deployment="gpt-4.1-mini", api_version="2023-06-01-preview", **params)
+
+
+def _gemini(**params):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.5-flash", timeout=None, max_retries=2, **params)
+
+
+def _groq(**params):
+    from langchain_groq import ChatGroq
+    return ChatGroq(model_name="llama3-70b-8192", groq_api_key=os.getenv("GROQ_API_KEY"), **params)
+
+
+PROVIDERS = {
+    "azure": (_azure, ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT")),
+    "gemini": (_gemini, ("GOOGLE_API_KEY",)),
+    "groq": (_groq, ("GROQ_API_KEY",)),
+}
+
+
+def available_providers(primary: str) -> list:
+    """The agent's own provider first, then every configured provider that has credentials."""
+    names = [primary]
+    for name in LLM_ROUTER_PROVIDERS:
+        if name in PROVIDERS and name not in names and all(os.getenv(var) for var in PROVIDERS[name][1]):
+            names.append(name)
+    return names
+
+
+# --- ROLLING PROVIDER STATS ---
+
+class ProviderStats:
+    """Rolling latency and error rate per provider, shared by every routed agent in the process."""
+
+    def __init__(self, window: int = LLM_ROUTER_WINDOW):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, latency: float, ok: bool):
+        with self._lock:
+            self._calls.setdefault(provider, deque(maxlen=self.window)).append((latency, ok))
+
+    def _summary(self, provider: str) -> dict:
+        with self._lock:
+            calls = list(self._calls.get(provider, ()))
+        latencies = sorted(latency for latency, ok in calls if ok)
+        errors = sum(1 for _, ok in calls if not ok)
+
+        def pick(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+        return {"calls": len(calls), "error_rate": errors / len(calls) if calls else 0.0,
+                "p50": pick(0.5), "p95": pick(0.95) if len(latencies) >= MIN_SAMPLES else None}
+
+    def healthy(self, provider: str) -> bool:
+        summary = self._summary(provider)
+        return summary["calls"] < MIN_SAMPLES or summary["error_rate"] <= LLM_ROUTER_MAX_ERROR_RATE
+
+    def rank(self, providers: list) -> list:
+        """
+        Healthy providers ordered by median latency, then unhealthy ones. Providers without
+        samples keep their configured position, so the agent's own provider is tried first.
+        """
+        def score(item):
+            position, name = item
+            summary = self._summary(name)
+            if summary["calls"] >= MIN_SAMPLES and summary["p50"] is not None:
+                latency = summary["p50"]
+            else:
+                latency = float("-inf") if position == 0 else float("inf")
+            return (not self.healthy(name), latency, position)
+
+        ranked = [name for _, name in sorted(enumerate(providers), key=score)]
+        healthy = [name for name in ranked if self.healthy(name)]
+        if len(healthy) > 1 and random.random() < LLM_ROUTER_EXPLORE:
+            first = random.choice(healthy[1:])
+            ranked.remove(first)
+            ranked.insert(0, first)
+        return ranked
+
+    def hedge_delay(self, provider: str) -> float:
+        p95 = self._summary(provider)["p95"]
+        delay = p95 if p95 is not None else LLM_ROUTER_HEDGE_DEFAULT_DELAY
+        return min(max(delay, LLM_ROUTER_HEDGE_MIN_DELAY), LLM_ROUTER_HEDGE_MAX_DELAY)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            names = list(self._calls)
+        return {name: {**self._summary(name), "healthy": self.healthy(name)} for name in names}
+
+
+provider_stats = ProviderStats()
+
+
+# --- ROUTED CHAT MODEL ---
+
+class RoutedChatModel(BaseChatModel):
+    """
+    A chat model that sends each call to the fastest healthy provider.
+
+    `candidates` maps provider name to a chat model (or, after bind_tools, to that model bound
+    to the same tools). Each call goes to the first provider in `provider_stats.rank`; if it
+    fails, the next one is tried. With hedging, a second provider is started when the first
+    has not answered within its p95 and the first answer wins, so a slow provider cannot set
+    the tail latency on its own.
+
+    Streaming calls go to the first provider in the ranking and fail over only while nothing
+    has been emitted yet; they are never hedged, since two providers' tokens cannot be merged.
+    """
+
+    agent_type: str
+    candidates: Dict[str, Any]
+    hedge: bool = LLM_ROUTER_HEDGE
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-router"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"agent_type": self.agent_type, "providers": list(self.candidates)}
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={
+            "candidates": {name: model.bind_tools(tools, **kwargs) for name, model in self.candidates.items()},
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        last_error = None
+        for provider in provider_stats.rank(list(self.candidates)):
+            started = time.perf_counter()
+            try:
+                message = self.candidates[provider].invoke(messages, stop=stop, **kwargs)
+                self._record(provider, started, True)
+                return ChatResult(generations=[ChatGeneration(message=message)])
+            except Exception as e:
+                self._record(provider, started, False)
+                last_error = e
+                self._failover(provider, e)
+        raise last_error
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        remaining = provider_stats.rank(list(self.candidates))
+        pending, launched_at = {}, {}
+        hedged = won = False
+        last_error = None
+
+        def launch():
+            provider = remaining.pop(0)
+            task = asyncio.create_task(self._acall(provider, messages, stop, kwargs))
+            pending[task], launched_at[task] = provider, time.perf_counter()
+            return provider
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and remaining:
+                    timeout = provider_stats.hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    LLM_ROUTER_EVENTS.labels(self.agent_type, "hedge").inc()
+                    print(f"  > LLM router [{self.agent_type}]: {list(pending.values())} slow after {timeout:.1f}s, "
+                          f"hedging with '{launch()}'.")
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        if hedged:
+                            LLM_ROUTER_EVENTS.labels(self.agent_type, f"won_by_{provider}").inc()
+                        won = True
+                        return ChatResult(generations=[ChatGeneration(message=task.result())])
+                    last_error = task.exception()
+                    self._failover(provider, last_error)
+                if not pending and remaining:
+                    launch()
+            raise last_error
+        finally:
+            for task, provider in pending.items():
+                if won:
+                    # The losing side of a hedge: not an error, but it took at least this long, and
+                    # without the sample a slow provider that always loses would never drop in the
+                    # ranking. A cancelled caller (timeout, disconnect) says nothing about a provider.
+                    provider_stats.record(provider, time.perf_counter() - launched_at[task], True)
+                task.cancel()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        last_error = None
+        for provider in provider_stats.rank(list(self.candidates)):
+            started, emitted = time.perf_counter(), False
+            try:
+                for chunk in self.candidates[provider].stream(messages, stop=stop, **kwargs):
+                    emitted = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._record(provider, started, False)
+                if emitted:
+                    raise
+                last_error = e
+                self._failover(provider, e)
+                continue
+            self._record(provider, started, True)
+            return
+        raise last_error
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        last_error = None
+        for provider in provider_stats.rank(list(self.candidates)):
+            started, emitted = time.perf_counter(), False
+            try:
+                async for chunk in self.candidates[provider].astream(messages, stop=stop, **kwargs):
+                    emitted = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._record(provider, started, False)
+                if emitted:
+                    raise
+                last_error = e
+                self._failover(provider, e)
+                continue
+            self._record(provider, started, True)
+            return
+        raise last_error
+
+    async def _acall(self, provider: str, messages, stop, kwargs):
+        started = time.perf_counter()
+        try:
+            message = await self.candidates[provider].ainvoke(messages, stop=stop, **kwargs)
+        except Exception:
+            self._record(provider, started, False)
+            raise
+        self._record(provider, started, True)
+        return message
+
+    def _record(self, provider: str, started: float, ok: bool):
+        latency = time.perf_counter() - started
+        provider_stats.record(provider, latency, ok)
+        LLM_PROVIDER_LATENCY.labels(provider, "ok" if ok else "error").observe(latency)
+
+    def _failover(self, provider: str, error: Exception):
+        LLM_ROUTER_EVENTS.labels(self.agent_type, "failover").inc()
+        print(f"  > LLM router [{self.agent_type}]: '{provider}' failed ({error}), trying the next provider.")
+
+
+def create_routed_llm(agent_type: str, primary: str, **params):
+    """
+    Builds the LLM for an agent: its own provider, routed together with the other configured
+    providers when any have credentials. Metrics are recorded once, on the outer model.
+
+    Args:
+        agent_type (str): Metrics label, e.g. "clickhouse_audit".
+        primary (str): The agent's own provider ("azure", "gemini" or "groq").
+        **params: Model parameters shared by every provider (temperature, max_tokens).
+    """
+    params = {key: value for key, value in params.items() if value is not None}
+    providers = available_providers(primary)
+    if len(providers) == 1:
+        return PROVIDERS[primary][0](**params, callbacks=[MetricsCallbackHandler(agent_type)])
+    print(f"--- 🔀 LLM router for '{agent_type}': {providers} (hedging {'on' if LLM_ROUTER_HEDGE else 'off'}) ---")
+    return RoutedChatModel(
+        agent_type=agent_type,
+        candidates={name: PROVIDERS[name][0](**params) for name in providers},
+        callbacks=[MetricsCallbackHandler(agent_type)],
+    )
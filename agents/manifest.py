@@ -0,0 +1,85 @@
+# agents/manifest.py
+
+import os
+import json
+import hashlib
+
+MANIFEST_FILENAME = "analysis_manifest.json"
+# Written by processor.py next to the manifest: per-view hashes of the catalog row and view definition.
+SYNC_STATE_FILENAME = "analysis_manifest.sync.json"
+
+
+def entry_hash(entry: dict) -> str:
+    return hashlib.sha256(json.dumps(entry, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class ManifestStore:
+    """
+    analysis_manifest.json held in memory and reloaded when processor.py rewrites it.
+
+    `get()` costs a couple of stat() calls. When the file changed, the new entries are diffed
+    against the old ones by view_name (and by the view definition hashes processor.py records)
+    and every registered listener is called with `(entries, changes)`, where `changes` has
+    `added`, `changed` and `removed` view names, so each consumer refreshes only what changed.
+    """
+
+    def __init__(self, path: str = MANIFEST_FILENAME, state_path: str = SYNC_STATE_FILENAME):
+        self.path = path
+        self.state_path = state_path
+        self.entries = []
+        self._hashes = {}
+        self._mtime = None
+        self._listeners = []
+
+    def on_change(self, listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def _read_hashes(self, entries: list) -> dict:
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        return {
+            entry.get("view_name"): entry_hash(entry) + state.get(entry.get("view_name"), {}).get("definition_hash", "")
+            for entry in entries
+        }
+
+    def get(self) -> list:
+        try:
+            mtime = (os.path.getmtime(self.path),
+                     os.path.getmtime(self.state_path) if os.path.exists(self.state_path) else None)
+        except OSError:
+            return self.entries
+        if mtime == self._mtime:
+            return self.entries
+
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"  > Manifest: could not reload '{self.path}', keeping the previous version. Error: {e}")
+            return self.entries
+
+        hashes = self._read_hashes(entries)
+        changes = {
+            "added": sorted(name for name in hashes if name not in self._hashes),
+            "changed": sorted(name for name in hashes if name in self._hashes and hashes[name] != self._hashes[name]),
+            "removed": sorted(name for name in self._hashes if name not in hashes),
+        }
+        first_load = self._mtime is None
+        self.entries, self._hashes, self._mtime = entries, hashes, mtime
+
+        if not first_load and any(changes.values()):
+            print(f"--- 🔄 Manifest reloaded: {changes} ---")
+            for listener in self._listeners:
+                try:
+                    listener(entries, changes)
+                except Exception as e:
+                    print(f"  > Manifest: reload listener failed. Error: {e}")
+        return entries
+
+
+# The manifest shared by the prompts, the fast path and the snapshot refresher.
+manifest_store = ManifestStore()
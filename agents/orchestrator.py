@@ -1,41 +1,144 @@
 import os
-from langchain_groq import ChatGroq
+import json
+import math
+import time
+from collections import OrderedDict
 
 from langchain_core.prompts import ChatPromptTemplate
+from agents.text import normalize_text, tokenize
+from agents.llm_router import create_routed_llm
 
 def create_orchestrator_llm():
     """
     Initializes and returns the LLM for the main orchestrator agent.
     We use a powerful model and low temperature for reliable routing decisions.
     """
-    llm = ChatGroq(
-        # The most capable model for reasoning and routing logic
-        model_name="llama3-70b-8192",
-        groq_api_key=os.getenv("GROQ_API_KEY"),
-        # Temperature 0 makes the output more deterministic and predictable
-        temperature=0
-    )
+    # Temperature 0 makes the output more deterministic and predictable
+    llm = create_routed_llm("orchestrator", primary="groq", temperature=0)
     return llm
 
 
-# Define the orchestrator node creation function
-def orchestrator_node(state: dict):
+# --- LOCAL FAST ROUTER ---
+# Clear-cut queries are routed by a tiny local classifier in microseconds; only
+# ambiguous ones pay for an LLM call. Every LLM decision is appended to
+# ROUTING_LOG_FILE and used as training data the next time the process starts.
+
+ROUTES = ("supabase_analyst", "clickhouse_analyst")
+ROUTING_LOG_FILE = os.getenv("ROUTING_LOG_FILE", "routing_decisions.jsonl")
+# Minimum log-odds margin between the two routes before the local decision is trusted.
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "2.0"))
+ROUTER_CACHE_SIZE = int(os.getenv("ROUTER_CACHE_SIZE", "1024"))
+
+# Seed vocabulary taken from the agent descriptions in the routing prompt.
+SEED_KEYWORDS = {
+    "supabase_analyst": [
+        "user", "users", "profile", "profiles", "account", "accounts", "signup", "signups", "sign",
+        "signed", "order", "orders", "transaction", "transactions", "customer", "customers", "email",
+        "login", "subscription", "questionnaire", "questionaire", "answers",
+    ],
+    "clickhouse_analyst": [
+        "analytics", "event", "events", "log", "logs", "mortgage", "case", "cases", "complexity",
+        "timing", "violations", "resource", "resources", "switches", "rework", "reworked", "sop",
+        "deviation", "activity", "activities", "latency", "performance", "metrics", "aggregation",
+        "trend", "trends", "throughput", "bottleneck", "bottlenecks", "view", "views", "analyzer",
+        "clickhouse", "incomplete", "threshold", "thresholds", "audit",
+    ],
+}
+
+
+class LocalRouter:
     """
-    Analyzes the user's query and routes it to the correct specialist.
-
-    Args:
-        state (dict): The current state of the graph, containing the message history.
+    A multinomial naive Bayes classifier over query tokens.
 
-    Returns:
-        dict: A dictionary with the key "next_node" indicating where to go next.
+    It starts from SEED_KEYWORDS and is refined with every (query, route) pair found in the
+    routing log, so routes the LLM decided in the past are learned as clear cases.
     """
-    print("--- 🧠 ORCHESTRATOR: Analyzing query... ---")
-
-    # 1. Get the LLM for the orchestrator using our existing function
-    llm = create_orchestrator_llm()
 
-    # 2. Define the routing prompt
-    routing_prompt_template = """You are an expert routing agent. Your job is to analyze a user's query and decide which of the following specialist agents is best suited to handle it.
+    def __init__(self):
+        self.token_counts = {route: {} for route in ROUTES}
+        self.route_counts = {route: 1 for route in ROUTES}
+        self.totals = {route: 0 for route in ROUTES}
+        self.vocabulary = set()
+        for route, keywords in SEED_KEYWORDS.items():
+            self.learn(" ".join(keywords), route, weight=3)
+
+    def learn(self, query: str, route: str, weight: int = 1):
+        if route not in self.token_counts:
+            return
+        self.route_counts[route] += 1
+        for token in tokenize(query):
+            self.token_counts[route][token] = self.token_counts[route].get(token, 0) + weight
+            self.totals[route] += weight
+            self.vocabulary.add(token)
+
+    def load_log(self, log_file: str = ROUTING_LOG_FILE):
+        if not os.path.exists(log_file):
+            return 0
+        learned = 0
+        with open(log_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.learn(record.get("query", ""), record.get("route"))
+                learned += 1
+        return learned
+
+    def classify(self, query: str):
+        """Returns (best_route, log-odds margin over the other route); margin 0 means no signal."""
+        tokens = [t for t in tokenize(query) if t in self.vocabulary]
+        if not tokens:
+            return None, 0.0
+        vocab_size = len(self.vocabulary)
+        scores = {}
+        for route in ROUTES:
+            score = math.log(self.route_counts[route])
+            for token in tokens:
+                count = self.token_counts[route].get(token, 0)
+                score += math.log((count + 1) / (self.totals[route] + vocab_size))
+            scores[route] = score
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[0][0], ranked[0][1] - ranked[1][1]
+
+
+_local_router = None
+_route_cache = OrderedDict()
+_router_chain = None
+
+
+def get_local_router() -> LocalRouter:
+    global _local_router
+    if _local_router is None:
+        _local_router = LocalRouter()
+        learned = _local_router.load_log()
+        print(f"--- 🧭 Local router ready ({learned} logged routing decisions learned) ---")
+    return _local_router
+
+
+def _cache_route(key: str, route: str):
+    _route_cache[key] = route
+    _route_cache.move_to_end(key)
+    while len(_route_cache) > ROUTER_CACHE_SIZE:
+        _route_cache.popitem(last=False)
+
+
+def _log_routing_decision(query: str, route: str):
+    try:
+        with open(ROUTING_LOG_FILE, 'a') as f:
+            f.write(json.dumps({"query": query, "route": route, "ts": time.time()}) + "\n")
+    except Exception as e:
+        print(f"  > Router: could not log routing decision. Error: {e}")
+
+
+def get_router_chain():
+    """Builds the routing prompt and LLM client once and reuses them for the whole process."""
+    global _router_chain
+    if _router_chain is None:
+        llm = create_orchestrator_llm()
+
+        # Define the routing prompt
+        routing_prompt_template = """You are an expert routing agent. Your job is to analyze a user's query and decide which of the following specialist agents is best suited to handle it.
     You must respond with ONLY the name of the chosen agent and nothing else.
 
     Here are the available agents and their descriptions:
@@ -48,24 +151,57 @@ def orchestrator_node(state: dict):
 
     Chosen Agent:"""
 
-    prompt = ChatPromptTemplate.from_template(routing_prompt_template)
+        prompt = ChatPromptTemplate.from_template(routing_prompt_template)
+        _router_chain = prompt | llm
+    return _router_chain
+
+
+# Define the orchestrator node creation function
+def orchestrator_node(state: dict):
+    """
+    Analyzes the user's query and routes it to the correct specialist.
+
+    Routing is tried in order: the LRU decision cache, the local classifier (when its
+    margin is at least ROUTER_MIN_MARGIN), and finally the LLM.
 
-    # 3. Create the chain and invoke it
-    router_chain = prompt | llm
+    Args:
+        state (dict): The current state of the graph, containing the message history.
+
+    Returns:
+        dict: A dictionary with the key "next_node" indicating where to go next.
+    """
+    print("--- 🧠 ORCHESTRATOR: Analyzing query... ---")
 
     # The user's query is the last message in the state
     user_query = state['messages'][-1].content
+    cache_key = normalize_text(user_query)
+
+    # 1. Previously routed query
+    if cache_key in _route_cache:
+        _route_cache.move_to_end(cache_key)
+        chosen_agent = _route_cache[cache_key]
+        print(f"--- ROUTING to: {chosen_agent} (cached) ---")
+        return {"next_node": chosen_agent}
 
-    # The LLM's response will be a string (e.g., "supabase_analyst")
-    chosen_agent = router_chain.invoke({"user_query": user_query}).content
+    # 2. Clear case for the local classifier
+    local_route, margin = get_local_router().classify(user_query)
+    if local_route and margin >= ROUTER_MIN_MARGIN:
+        _cache_route(cache_key, local_route)
+        print(f"--- ROUTING to: {local_route} (local, margin={margin:.1f}) ---")
+        return {"next_node": local_route}
+
+    # 3. Ambiguous: ask the LLM. The LLM's response will be a string (e.g., "supabase_analyst")
+    chosen_agent = get_router_chain().invoke({"user_query": user_query}).content
 
     # Clean up the response to ensure it's just the agent name
     chosen_agent = chosen_agent.strip().replace("`", "") # Also remove backticks if the LLM adds them
 
+    if chosen_agent in ROUTES:
+        _cache_route(cache_key, chosen_agent)
+        _log_routing_decision(user_query, chosen_agent)
+        get_local_router().learn(user_query, chosen_agent)
+
     print(f"--- ROUTING to: {chosen_agent} ---")
 
     # 4. Return the routing decision
     return {"next_node": chosen_agent}
-
-
-
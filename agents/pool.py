@@ -0,0 +1,205 @@
+# agents/pool.py
+
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class AgentPoolTimeout(asyncio.TimeoutError):
+    """No agent became free within the checkout timeout."""
+
+
+class AgentPool:
+    """
+    A fixed-size pool of pre-built MCPAgent instances.
+
+    Every agent is built by the given factory (e.g. `create_clickhouse_audit_agent`), so each
+    one owns its own MCPClient and MCP session. Callers borrow an agent with `checkout()`,
+    which guarantees exclusive use for the duration of the `async with` block. Agents that
+    fail a health check, raise out of the block, or are flagged with `mark_broken()` are
+    closed and replaced with a freshly built agent when they are returned. If the factory
+    fails, the slot keeps the closed agent, flagged broken, and the rebuild is retried on its
+    next checkout or health check, so the pool never shrinks.
+    """
+
+    def __init__(self, factory, size: int = 2, name: str = "agent", health_check_interval: float = 60.0):
+        """
+        Args:
+            factory (callable): Zero-argument function that builds a new MCPAgent.
+            size (int): Number of agents kept in the pool.
+            name (str): Label used in log output.
+            health_check_interval (float): Seconds between background checks of idle agents (0 disables).
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self.name = name
+        self.health_check_interval = health_check_interval
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._all = []
+        self._broken = set()
+        self._health_task = None
+        self._closed = False
+        self.replaced_count = 0
+
+    # --- LIFECYCLE ---
+
+    async def start(self, warm: bool = True):
+        """Builds every agent up front and, if `warm`, opens its MCP session before the first request."""
+        print(f"--- 🏊 Building {self.name} pool with {self.size} agents ---")
+        for _ in range(self.size):
+            agent = self.factory()
+            if warm:
+                await self._warm(agent)
+            self._all.append(agent)
+            self._idle.put_nowait(agent)
+        if self.health_check_interval:
+            self._health_task = asyncio.create_task(self._health_loop())
+        print(f"--- ✅ {self.name} pool is ready ({self.size} agents). ---")
+        return self
+
+    async def serve(self, stop: asyncio.Event, warm: bool = True, on_ready=None):
+        """
+        Starts the pool, keeps it until `stop` is set, then closes it, all inside one task.
+
+        Used to warm the pool in the background while the app already accepts requests:
+        MCP sessions have to be closed by the task that opened them, and `checkout()` simply
+        waits until the first agent is ready.
+        """
+        try:
+            await self.start(warm=warm)
+            if on_ready:
+                on_ready()
+            await stop.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stops the health checks and closes every agent's MCP sessions."""
+        self._closed = True
+        if self._health_task:
+            self._health_task.cancel()
+        # Newest first: MCP sessions opened in the same task hold nested anyio cancel scopes,
+        # which must be exited in reverse order or the close cancels the calling task.
+        for agent in reversed(self._all):
+            await self._close_agent(agent)
+        self._all = []
+        print(f"--- ❌ {self.name} pool shut down. ---")
+
+    # --- CHECKOUT / RETURN ---
+
+    @asynccontextmanager
+    async def checkout(self, timeout: float = None):
+        """
+        Borrows an agent for exclusive use.
+
+        Args:
+            timeout (float): Seconds to wait for a free agent. None waits forever.
+
+        Raises:
+            AgentPoolTimeout: If no agent became free within `timeout` (an asyncio.TimeoutError).
+            Exception: Whatever the factory raised, if the agent had to be rebuilt and could not be.
+        """
+        if self._closed:
+            raise RuntimeError(f"The {self.name} pool is closed.")
+        try:
+            agent = await asyncio.wait_for(self._idle.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise AgentPoolTimeout(f"No {self.name} agent became free within {timeout}s.") from None
+        if id(agent) in self._broken or not self.is_healthy(agent):
+            try:
+                agent = await self._replace(agent, reason="failed health check")
+            except Exception:
+                self._idle.put_nowait(agent)
+                raise
+        try:
+            yield agent
+        except BaseException:
+            self._broken.add(id(agent))
+            raise
+        finally:
+            await self._return(agent)
+
+    def mark_broken(self, agent):
+        """Flags a checked-out agent so it is replaced instead of being reused."""
+        self._broken.add(id(agent))
+
+    async def _return(self, agent):
+        if id(agent) in self._broken:
+            try:
+                agent = await self._replace(agent, reason="marked broken")
+            except Exception:
+                pass  # the slot stays flagged; the next checkout retries the rebuild
+        if self._closed:
+            await self._close_agent(agent)
+            return
+        self._idle.put_nowait(agent)
+
+    # --- HEALTH AND REPLACEMENT ---
+
+    def is_healthy(self, agent) -> bool:
+        """An agent is healthy if every MCP session it has opened is still connected."""
+        client = getattr(agent, "client", None)
+        if client is None:
+            return True
+        try:
+            return all(session.is_connected for session in client.get_all_active_sessions().values())
+        except Exception:
+            return False
+
+    async def _replace(self, agent, reason: str):
+        """Closes `agent` and builds its successor. If the factory raises, `agent` stays in its slot flagged broken."""
+        print(f"  > {self.name} pool: replacing agent ({reason}).")
+        await self._close_agent(agent)
+        try:
+            new_agent = self.factory()
+        except Exception as e:
+            self._broken.add(id(agent))
+            print(f"  > {self.name} pool: could not build a replacement agent, will retry. Error: {e}")
+            raise
+        self._broken.discard(id(agent))
+        if agent in self._all:
+            self._all[self._all.index(agent)] = new_agent
+        else:
+            self._all.append(new_agent)
+        self.replaced_count += 1
+        return new_agent
+
+    async def _warm(self, agent):
+        try:
+            await agent.initialize()
+        except Exception as e:
+            # The agent will retry the connection lazily on its first run.
+            print(f"  > {self.name} pool: could not pre-connect agent, it will connect on first use. Error: {e}")
+
+    async def _close_agent(self, agent):
+        try:
+            if hasattr(agent, "client"):
+                await agent.client.close_all_sessions()
+        except Exception as e:
+            print(f"  > {self.name} pool: ignoring error while closing agent: {e}")
+
+    async def _health_loop(self):
+        """Periodically checks idle agents and swaps out the ones whose sessions have dropped."""
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            for _ in range(self._idle.qsize()):
+                try:
+                    agent = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if id(agent) in self._broken or not self.is_healthy(agent):
+                    try:
+                        agent = await self._replace(agent, reason="failed background health check")
+                        await self._warm(agent)
+                    except Exception:
+                        pass  # still flagged broken, retried next round
+                self._idle.put_nowait(agent)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "in_use": len(self._all) - self._idle.qsize(),
+            "ready": len(self._all),
+            "replaced": self.replaced_count,
+        }
@@ -0,0 +1,184 @@
+# agents/prompt_builder.py
+
+import os
+import re
+from agents.text import tokenize
+
+# --- CONFIGURATION ---
+# Upper bound for a system prompt, in tokens. Retrieved entries are dropped until the prompt fits.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+# How many manifest/SOP entries are retrieved into the prompt for a request.
+PROMPT_TOP_K = int(os.getenv("PROMPT_TOP_K", "3"))
+# Log the size of every prompt built (otherwise prompts are built silently).
+PROMPT_BUILDER_DEBUG = os.getenv("PROMPT_BUILDER_DEBUG", "false").lower() == "true"
+
+# Added to the procedures of agents whose tool calls are often independent of each other.
+PARALLEL_TOOL_CALLS_HINT = (
+    "Tool calls that do not depend on each other's results (e.g. several independent `run_select_query` "
+    "probes) MUST be requested together in a single turn: they are executed in parallel."
+)
+
+# tiktoken is optional; without it tokens are estimated at ~4 characters each.
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4) if text else 0
+
+
+def escape_braces(text: str) -> str:
+    """MCPAgent feeds the system prompt through a LangChain prompt template, so literal braces must be doubled."""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _rank(query: str, entry_tokens: list, k: int) -> list:
+    """Indices of the k entries sharing the most tokens with the query (ties keep manifest order)."""
+    query_tokens = set(tokenize(query))
+    scores = [(len(query_tokens & tokens), -i) for i, tokens in enumerate(entry_tokens)]
+    ranked = sorted(range(len(entry_tokens)), key=lambda i: scores[i], reverse=True)
+    return [i for i in ranked[:k] if scores[i][0] > 0]
+
+
+class ManifestIndex:
+    """
+    analysis_manifest.json kept in memory as one compact line per analysis, plus a token set
+    per entry for retrieval. Replaces the pretty-printed JSON dump in the system prompt.
+    """
+
+    def __init__(self, entries: list):
+        self.entries, self.lines, self.tokens = [], [], []
+        self.update(entries)
+
+    def update(self, entries: list):
+        """Swaps in a new manifest, re-rendering only the entries that are new or changed."""
+        previous = {self._key(entry): (line, tokens) for entry, line, tokens in zip(self.entries, self.lines, self.tokens)}
+        rendered = [previous.get(self._key(entry)) or self._index(entry) for entry in entries]
+        self.entries = entries
+        self.lines = [line for line, _ in rendered]
+        self.tokens = [tokens for _, tokens in rendered]
+
+    @staticmethod
+    def _key(entry: dict) -> str:
+        return repr(sorted(entry.items()))
+
+    def _index(self, entry: dict):
+        return self._render(entry), set(tokenize(" ".join(str(v) for v in entry.values() if v)))
+
+    @staticmethod
+    def _render(entry: dict) -> str:
+        return (f"- {entry.get('analysis_type')}: sql_template_path=`{entry.get('sql_template_path')}`, "
+                f"udf_required={entry.get('udf_required') or 'null'}, table=`{entry.get('dataset')}` "
+                f"({entry.get('description')})")
+
+    def section(self, query: str, k: int = None) -> str:
+        """
+        The manifest section for a request: full lines for the top-k matches, name and template
+        for the rest. Without a query the first k entries are shown in full (all when k is None).
+        """
+        selected = _rank(query, self.tokens, k) if query else list(range(len(self.lines)))[:k]
+        lines = [self.lines[i] for i in selected]
+        others = [f"{self.entries[i].get('analysis_type')} -> `{self.entries[i].get('sql_template_path')}`"
+                  for i in range(len(self.entries)) if i not in selected]
+        if others:
+            lines.append("Other analyses (analysis_type -> sql_template_path): " + "; ".join(others))
+        return escape_braces("\n".join(lines))
+
+
+class SopIndex:
+    """
+    prompts/clickhouse_audit.txt split into its fixed parts (mandate, tools, procedure) and
+    its numbered audit entries, so only the audits relevant to a request are inlined.
+    """
+
+    ENTRY_PATTERN = re.compile(r"^\d+\.\s+\*\*Audit Name:\*\*", re.MULTILINE)
+
+    def __init__(self, sop_text: str):
+        manifest_start = sop_text.find("### AUDIT QUERY MANIFEST")
+        procedure_start = sop_text.find("### MANDATORY STEP-BY-STEP PROCEDURE")
+        if manifest_start == -1 or procedure_start == -1:
+            # Unknown layout: treat the whole SOP as fixed text.
+            self.header, self.footer, self.entries = sop_text, "", []
+        else:
+            self.header = sop_text[:manifest_start].rstrip()
+            self.footer = sop_text[procedure_start:].strip()
+            body = sop_text[manifest_start:procedure_start]
+            starts = [m.start() for m in self.ENTRY_PATTERN.finditer(body)]
+            self.entries = [
+                re.sub(r"\n-{3}\n\*\*Category:.*", "", body[start:end], flags=re.DOTALL).strip()
+                for start, end in zip(starts, starts[1:] + [len(body)])
+            ]
+        self.tokens = [set(tokenize(entry)) for entry in self.entries]
+        self.names = [self._field(entry, r'\*\*Audit Name:\*\*\s*"?([^"\n]+)') for entry in self.entries]
+        self.file_names = [self._field(entry, r"\*\*file_name:\*\*\s*`([^`]+)`") for entry in self.entries]
+
+    @staticmethod
+    def _field(entry: str, pattern: str) -> str:
+        match = re.search(pattern, entry)
+        return match.group(1) if match else "unknown"
+
+    def section(self, query: str, k: int = None) -> str:
+        if not self.entries:
+            return ""
+        selected = _rank(query, self.tokens, k) if query else list(range(len(self.entries)))[:k]
+        parts = ["### AUDIT QUERY MANIFEST (Your Internal Knowledge Base)"]
+        parts += [self.entries[i] for i in selected]
+        others = [f'"{self.names[i]}" -> `{self.file_names[i]}`' for i in range(len(self.entries)) if i not in selected]
+        if others:
+            parts.append("Other available audits (name -> file_name): " + "; ".join(others))
+        return "\n\n".join(parts)
+
+
+def build_prompt(fixed_sections: list, retrieved_name: str, retrieve, query: str,
+                 top_k: int = PROMPT_TOP_K, budget: int = PROMPT_TOKEN_BUDGET, label: str = "prompt"):
+    """
+    Assembles a system prompt from fixed sections plus one retrieved section, within a token budget.
+
+    With a query, the top_k best matching entries are inlined; without one (the default prompt)
+    every entry is. While the prompt is over budget, entries are inlined one fewer at a time,
+    down to none (the section then only names them).
+
+    Args:
+        fixed_sections (list): (name, text) pairs always included, in order. A text of None marks
+            where the retrieved section goes.
+        retrieved_name (str): Report name of the retrieved section.
+        retrieve (callable): `retrieve(query, k)` returning the retrieved section's text.
+        query (str): The user's request ('' builds the default prompt with every entry).
+        top_k (int): Entries to retrieve before budget enforcement.
+        budget (int): Maximum prompt size in tokens.
+
+    Returns:
+        tuple: (prompt text, report dict of tokens per section, total, budget and k used)
+
+    Raises:
+        ValueError: If the prompt exceeds the budget even with no entry inlined.
+    """
+    k = top_k if query else None
+    while True:
+        sections = [(name, text if text is not None else retrieve(query, k)) for name, text in fixed_sections]
+        report = {(retrieved_name if text is None else name): count_tokens(section_text)
+                  for (name, text), (_, section_text) in zip(fixed_sections, sections)}
+        prompt = "\n".join(section_text for _, section_text in sections)
+        total = count_tokens(prompt)
+        if total <= budget:
+            break
+        if k == 0:
+            raise ValueError(f"The {label} system prompt needs {total} tokens without any retrieved entry, "
+                             f"over PROMPT_TOKEN_BUDGET={budget}: {report}")
+        k = top_k if k is None else k - 1
+
+    report.update({"total": total, "budget": budget, "k": "all" if k is None else k})
+    if PROMPT_BUILDER_DEBUG:
+        print(f"  > Prompt builder [{label}]: {total} tokens (budget {budget}), sections={report}")
+    return prompt, report
+
+
+def apply_system_prompt(agent, prompt: str):
+    """Installs a per-request system prompt on an agent, whether or not it has been initialized yet."""
+    agent.system_prompt = prompt
+    agent.set_system_message(prompt)
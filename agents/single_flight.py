@@ -0,0 +1,51 @@
+# agents/single_flight.py
+
+import asyncio
+from metrics import SINGLE_FLIGHT_CALLS, SINGLE_FLIGHT_IN_FLIGHT
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical agent runs.
+
+    The first caller for a key starts the work; callers that arrive while it is still running
+    await the same task and get the same result (or exception) instead of starting their own
+    run. Keys come from AnswerCache.make_key, i.e. the normalized question, agent type, prompt
+    version and manifest hash, so coalescing and caching agree on what "the same question" is.
+    The work runs in its own task: a caller that disconnects does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    async def do(self, key: str, agent_type: str, work):
+        """
+        Runs `await work()` once per key at a time.
+
+        Returns:
+            tuple: (result, shared) where `shared` is True when the result came from another caller's run.
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            SINGLE_FLIGHT_CALLS.labels(agent_type, "coalesced").inc()
+        else:
+            SINGLE_FLIGHT_CALLS.labels(agent_type, "executed").inc()
+            SINGLE_FLIGHT_IN_FLIGHT.labels(agent_type).inc()
+            task = asyncio.create_task(work())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, agent_type, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: str, agent_type: str, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        SINGLE_FLIGHT_IN_FLIGHT.labels(agent_type).dec()
+        if not task.cancelled():
+            task.exception()  # retrieved here so an error nobody waited for is not logged as unhandled
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight)}
+
+
+# Shared by '/ask' and the batch audit workers, so overlapping callers cost one run.
+single_flight = SingleFlight()
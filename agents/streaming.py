@@ -0,0 +1,113 @@
+# agents/streaming.py
+
+import os
+import json
+import time
+import asyncio
+from metrics import record_agent_run
+
+# --- CONFIGURATION ---
+# A comment line is sent when nothing else happened for this long, so proxies keep the stream open.
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "10"))
+# Tool results are forwarded as a preview of at most this many characters.
+SSE_TOOL_PREVIEW_CHARS = int(os.getenv("SSE_TOOL_PREVIEW_CHARS", "2000"))
+
+_DONE = object()
+
+
+def sse(event: str, data) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _text(content) -> str:
+    """The text of a message chunk; some providers send a list of content parts."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return ""
+
+
+def _preview(output) -> dict:
+    """A bounded preview of a tool result (MCP tools return a list of content parts)."""
+    if isinstance(output, (list, tuple)):
+        text = "".join(getattr(part, "text", None) or _text([part]) for part in output)
+    else:
+        text = _text(getattr(output, "content", output))
+    text = text or str(output)
+    return {"preview": text[:SSE_TOOL_PREVIEW_CHARS], "chars": len(text),
+            "truncated": len(text) > SSE_TOOL_PREVIEW_CHARS}
+
+
+def translate_event(event: dict, state: dict):
+    """
+    Maps one LangChain `astream_events` event to an (event name, payload) pair, or None.
+
+    `state` carries the step counter and the final answer across events.
+    """
+    kind, data = event.get("event"), event.get("data") or {}
+    if kind == "on_chat_model_start":
+        state["steps"] += 1
+        return "step", {"step": state["steps"], "elapsed": round(time.perf_counter() - state["started"], 2)}
+    if kind == "on_chat_model_stream":
+        text = _text(getattr(data.get("chunk"), "content", ""))
+        return ("token", {"text": text}) if text else None
+    if kind == "on_tool_start":
+        return "tool_start", {"tool": event.get("name"), "input": data.get("input")}
+    if kind == "on_tool_end":
+        return "tool_result", {"tool": event.get("name"), **_preview(data.get("output"))}
+    if kind == "on_tool_error":
+        return "tool_error", {"tool": event.get("name"), "error": str(data.get("error"))}
+    if kind == "on_chain_end" and not event.get("parent_ids"):
+        output = data.get("output")
+        if isinstance(output, dict) and "output" in output:
+            state["answer"] = output["output"]
+    return None
+
+
+async def stream_agent_run(agent, query: str, agent_type: str):
+    """
+    Runs `agent.stream_events(query)` and yields (event name, payload) pairs as they happen,
+    with a ("heartbeat", None) pair whenever the agent has been quiet for SSE_HEARTBEAT_INTERVAL.
+    Ends with ("answer", {...}). Records the same run metrics as observe_agent_run.
+
+    The run happens in its own task, so the caller can send heartbeats while a long LLM or tool
+    call is pending; closing this generator cancels the run.
+    """
+    queue = asyncio.Queue()
+    state = {"steps": 0, "answer": None, "started": time.perf_counter()}
+
+    async def produce():
+        status = "error"
+        try:
+            async for event in agent.stream_events(query):
+                translated = translate_event(event, state)
+                if translated:
+                    await queue.put(translated)
+            status = "ok"
+        except Exception as e:
+            await queue.put(("error", {"error": str(e)}))
+        finally:
+            record_agent_run(agent, agent_type, status, time.perf_counter() - state["started"], state["steps"])
+            await queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield "heartbeat", None
+                continue
+            if item is _DONE:
+                break
+            yield item
+            if item[0] == "error":
+                return
+        yield "answer", {"answer": state["answer"], "steps": state["steps"],
+                         "elapsed": round(time.perf_counter() - state["started"], 2)}
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
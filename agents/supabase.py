@@ -1,14 +1,11 @@
 import os
-from langchain_groq import ChatGroq
+from agents.llm_router import create_routed_llm
 
 def create_supabase_llm():
     """
     Initializes and returns the LLM for the Supabase specialist agent.
     """
-    llm = ChatGroq(
-        model_name="llama3-70b-8192",
-        groq_api_key=os.getenv("GROQ_API_KEY")
-    )
+    llm = create_routed_llm("supabase", primary="groq")
     return llm
 
 
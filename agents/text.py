@@ -0,0 +1,28 @@
+# agents/text.py
+
+import re
+
+# Words that carry no routing or matching signal on their own.
+STOPWORDS = {
+    "a", "an", "the", "on", "in", "of", "for", "to", "and", "or", "is", "are", "be", "me", "my",
+    "please", "can", "you", "i", "we", "need", "want", "run", "show", "give", "get", "do", "what",
+    "with", "by", "from", "this", "that", "it", "all", "any", "table", "default", "analysis",
+}
+
+
+def normalize_text(text: str) -> str:
+    """Lower-cases a question and collapses punctuation and whitespace so equivalent phrasings compare equal."""
+    text = (text or "").lower().replace("`", " ")
+    text = re.sub(r"[^a-z0-9_.\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .")
+
+
+def tokenize(text: str, drop_stopwords: bool = True) -> list:
+    """Splits text into word tokens. Underscored identifiers such as `mortgage_events` also yield their parts."""
+    tokens = []
+    for word in re.findall(r"[a-z0-9_]+", normalize_text(text)):
+        parts = [word] + ([p for p in word.split("_") if p] if "_" in word else [])
+        for part in parts:
+            if not drop_stopwords or part not in STOPWORDS:
+                tokens.append(part)
+    return tokens
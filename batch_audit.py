@@ -0,0 +1,241 @@
+# batch_audit.py
+
+import os
+import time
+import asyncio
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+from agents.clickhouse_auditor import create_clickhouse_audit_agent, build_audit_prompt, PROMPT_VERSION as AUDIT_PROMPT_VERSION
+from agents.prompt_builder import apply_system_prompt
+from agents.answer_cache import answer_cache
+from agents.pool import AgentPool, AgentPoolTimeout
+from agents.single_flight import single_flight
+from metrics import observe_agent_run
+from connectors.answer_writer import BufferedAnswerWriter
+from connectors.question_intake import QuestionIntake
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# --- CONFIGURATION ---
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# How many questions are in flight at once. Each in-flight question borrows one agent
+# (and therefore one MCP session), so this is also the size of the agent pool.
+BATCH_AUDIT_CONCURRENCY = int(os.getenv("BATCH_AUDIT_CONCURRENCY", "4"))
+# Hard ceiling for a single question; a stuck agent must not stall the whole run.
+BATCH_AUDIT_QUESTION_TIMEOUT = float(os.getenv("BATCH_AUDIT_QUESTION_TIMEOUT", "300"))
+
+_STOP = object()  # Sentinel that tells a worker to exit.
+
+
+async def feed_questions(first_page: list, pages, question_queue: asyncio.Queue, workers: int, stats: dict):
+    """
+    Streams the intake's pages into the (bounded) question queue, then tells every worker to stop.
+    Only a couple of pages are ever held in memory, however large the questionnaire is.
+    """
+    try:
+        page = first_page
+        while page:
+            stats["total"] += len(page)
+            for item in page:
+                await question_queue.put(item)
+            page = await anext(pages, None)
+    finally:
+        for _ in range(workers):
+            await question_queue.put(_STOP)
+
+
+async def audit_worker(worker_id: int, pool: AgentPool, question_queue: asyncio.Queue,
+                       writer: BufferedAnswerWriter, intake: QuestionIntake, question_timeout: float, stats: dict):
+    """
+    Processes questions from the queue, each on an agent borrowed from the pool,
+    until it sees the stop sentinel.
+    """
+    while True:
+        item = await question_queue.get()
+        try:
+            if item is _STOP:
+                return
+            question_id = item.get("id")
+            question_text = item.get("question")
+            if not question_id or not question_text:
+                print("  > Batch Audit: Skipping malformed question item from database.")
+                stats["skipped"] += 1
+                continue
+
+            print(f"\n  > Batch Audit [worker {worker_id}]: Processing Question #{question_id}: '{question_text}'")
+            try:
+                agent_response = await answer_question(pool, question_id, question_text, question_timeout, stats)
+            except Exception as e:
+                # One bad item must not cost the run a worker.
+                stats["failed"] += 1
+                print(f"❌ ERROR: Failed to process question ID {question_id}. Error: {e}")
+                agent_response = None
+            if agent_response is None:
+                # Give the question back so the next run retries it instead of waiting out the lease.
+                await intake.arelease(question_id)
+                continue
+            if agent_response:
+                await writer.put(answer_row(question_id, question_text, agent_response))
+        finally:
+            question_queue.task_done()
+
+
+def answer_row(question_id, question_text: str, agent_response: str) -> dict:
+    return {
+        "question_id": question_id,
+        "question": question_text,
+        "answer": {"answer": agent_response},  # Store the agent's string response in a JSON object
+        "status": "Approved"
+    }
+
+
+async def answer_question(pool: AgentPool, question_id, question_text: str, question_timeout: float, stats: dict):
+    """Answers one question from the answer cache or on a pooled agent. Returns None if it failed."""
+    agent_response = await answer_cache.get(question_text, "clickhouse_audit", AUDIT_PROMPT_VERSION)
+    if agent_response is not None:
+        stats["cached"] += 1
+    else:
+        async def run_once():
+            response = await _run_on_pool(pool, question_id, question_text, question_timeout, stats)
+            if response is not None:
+                try:
+                    await answer_cache.put(question_text, "clickhouse_audit", AUDIT_PROMPT_VERSION, response)
+                except Exception as e:
+                    print(f"  > Batch Audit: could not cache the answer to question ID {question_id}. Error: {e}")
+            return response
+
+        # The same question may already be running for '/ask' or another worker; share that run.
+        key = answer_cache.make_key(question_text, "clickhouse_audit", AUDIT_PROMPT_VERSION)
+        try:
+            agent_response, shared = await single_flight.do(key, "clickhouse_audit", run_once)
+        except Exception as e:
+            # run_once never raises, so this is the failure of a run we joined (e.g. '/ask' timing
+            # out waiting for its own pool). It says nothing about ours: answer on our own agent.
+            print(f"  > Batch Audit: the shared run for question ID {question_id} failed ({e!r}), retrying on this pool.")
+            agent_response, shared = await run_once(), False
+        if shared:
+            stats["coalesced"] += 1
+        if agent_response is None:
+            if shared:
+                stats["failed"] += 1
+            return None
+    stats["answered"] += 1
+    return agent_response
+
+
+async def _run_on_pool(pool: AgentPool, question_id, question_text: str, question_timeout: float, stats: dict):
+    """
+    Runs one question on a pooled agent. Returns None (and counts the failure) if it did not
+    complete, including when no working agent could be checked out (e.g. the factory is down).
+    """
+    try:
+        async with pool.checkout() as agent:
+            try:
+                apply_system_prompt(agent, build_audit_prompt(question_text))
+                return await asyncio.wait_for(observe_agent_run(agent, question_text, "clickhouse_audit"), timeout=question_timeout)
+            except Exception:
+                # A failed or cancelled run can leave the MCP session mid-request, so start clean.
+                pool.mark_broken(agent)
+                raise
+    except AgentPoolTimeout as e:
+        stats["failed"] += 1
+        print(f"❌ ERROR: No agent for question ID {question_id}. Error: {e}")
+    except asyncio.TimeoutError:
+        stats["timed_out"] += 1
+        print(f"❌ ERROR: Question ID {question_id} timed out after {question_timeout:.0f}s.")
+    except Exception as e:
+        stats["failed"] += 1
+        print(f"❌ ERROR: Failed to process question ID {question_id}. Error: {e}")
+    return None
+
+
+async def run_batch_audit(concurrency: int = None, question_timeout: float = None,
+                          supabase: "Client" = None, agent_factory=None, run_id: str = None):
+    """
+    Runs every approved question through the ClickHouse Auditor agent on a single event loop.
+
+    Args:
+        concurrency (int): Number of questions processed in parallel. Defaults to BATCH_AUDIT_CONCURRENCY.
+        question_timeout (float): Per-question timeout in seconds. Defaults to BATCH_AUDIT_QUESTION_TIMEOUT.
+        supabase (Client): Supabase client to use. Defaults to one built from SUPABASE_URL / SUPABASE_KEY.
+        agent_factory (callable): Builds the auditor agents. Defaults to create_clickhouse_audit_agent.
+        run_id (str): Identifies the run's answers (and its spilled batches). With ANSWER_WRITER_MODE=upsert,
+            re-using a run id overwrites that run's answers instead of duplicating them.
+            Defaults to BATCH_RUN_ID or a new id.
+
+    Returns:
+        dict: Counters and timing for the run.
+    """
+    concurrency = max(1, concurrency or BATCH_AUDIT_CONCURRENCY)
+    question_timeout = question_timeout or BATCH_AUDIT_QUESTION_TIMEOUT
+    stats = {"total": 0, "answered": 0, "cached": 0, "coalesced": 0, "stored": 0, "failed": 0, "timed_out": 0,
+             "skipped": 0, "store_failed": 0, "elapsed_seconds": 0.0}
+
+    print("\n--- 🚀 Starting Automated Batch Auditor Run ---")
+    start_time = time.perf_counter()
+    if supabase is None:
+        from supabase import create_client  # imported on first use, see jobs.create_supabase_client
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    print("✅ Batch Audit: Successfully connected to Supabase.")
+
+    # 1. Stream questions: pages by id, already-answered questions skipped, the rest claimed
+    print("  > Batch Audit: Fetching approved questions that still need an answer...")
+    intake = QuestionIntake(supabase)
+    pages = intake.apages()
+    first_page = await anext(pages, None)
+    if not first_page:
+        print(f"--- 🏁 Batch Audit: No questions to process ({intake.stats['already_answered']} already answered). Exiting. ---")
+        return stats
+
+    if intake.exhausted:
+        # The table has been read to the end, so this is the whole backlog; no point in building
+        # more agents than there are questions.
+        concurrency = min(concurrency, len(first_page))
+    print(f"  > Batch Audit: Work found. Running with concurrency={concurrency}, timeout={question_timeout:.0f}s.")
+
+    question_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    # 2. Start the writer and the worker pool, 3. wait for the queue to drain
+    pool = AgentPool(agent_factory or create_clickhouse_audit_agent, size=concurrency, name="batch", health_check_interval=0)
+    await pool.start()
+    # Answers are buffered and written in multi-row batches (upserts keyed by (question_id, run_id) in "upsert" mode).
+    writer = await BufferedAnswerWriter(supabase, run_id=run_id).start()
+    try:
+        feeder = asyncio.create_task(feed_questions(first_page, pages, question_queue, concurrency, stats))
+        workers = [
+            asyncio.create_task(audit_worker(i + 1, pool, question_queue, writer, intake, question_timeout, stats))
+            for i in range(concurrency)
+        ]
+        results = await asyncio.gather(*workers, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ ERROR: A batch audit worker crashed. Error: {result}")
+        if not feeder.done():
+            # Workers died before draining the queue; the feeder would block forever.
+            feeder.cancel()
+        elif feeder.exception():
+            print(f"❌ ERROR: Question intake stopped early. Error: {feeder.exception()}")
+    finally:
+        await writer.close()
+        await pool.close()
+    stats["stored"] = writer.stats["stored"]
+    stats["store_failed"] = writer.stats["spilled"]
+    stats["run_id"] = writer.run_id
+    stats["already_answered"] = intake.stats["already_answered"]
+    stats["claimed_elsewhere"] = intake.stats["claimed_elsewhere"]
+
+    stats["elapsed_seconds"] = round(time.perf_counter() - start_time, 2)
+    throughput = stats["answered"] / stats["elapsed_seconds"] * 60 if stats["elapsed_seconds"] else 0.0
+    print(f"\n--- ✅ Automated Batch Auditor Run Complete: {stats['answered']}/{stats['total']} answered, "
+          f"{stats['cached']} from cache, {stats['stored']} stored, {stats['failed']} failed, {stats['timed_out']} timed out "
+          f"in {stats['elapsed_seconds']}s ({throughput:.1f} questions/min) ---")
+    return stats
+
+
+if __name__ == "__main__":
+    asyncio.run(run_batch_audit())
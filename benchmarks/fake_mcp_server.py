@@ -0,0 +1,56 @@
+# benchmarks/fake_mcp_server.py
+
+# A stand-in for the ClickHouse MCP server, launched over stdio by benchmarks/fakes.py.
+# It exposes the same tool names and returns canned result sets after a configurable delay.
+
+import os
+import json
+import time
+import random
+from mcp.server.fastmcp import FastMCP
+
+FAKE_MCP_LATENCY = float(os.getenv("FAKE_MCP_LATENCY", "0.02"))
+FAKE_MCP_ROWS = int(os.getenv("FAKE_MCP_ROWS", "200"))
+
+server = FastMCP("clickhouse_server", log_level="WARNING")
+
+
+def _result_set(rows: int) -> str:
+    rng = random.Random(42)
+    return json.dumps({
+        "columns": ["case_id", "activity_count", "duration_hours", "resource"],
+        "rows": [[f"CASE-{i}", rng.randint(3, 40), round(rng.lognormvariate(3, 1), 2), f"user_{i % 17}"]
+                 for i in range(rows)],
+    })
+
+
+@server.tool()
+def run_select_query(query: str) -> str:
+    """Run a SELECT query in ClickHouse."""
+    time.sleep(FAKE_MCP_LATENCY)
+    return _result_set(FAKE_MCP_ROWS)
+
+
+@server.tool()
+def run_audit_query_from_file(file_name: str) -> str:
+    """Run an audit query from the SQL library by file name."""
+    time.sleep(FAKE_MCP_LATENCY)
+    return _result_set(FAKE_MCP_ROWS)
+
+
+@server.tool()
+def list_databases() -> str:
+    """List ClickHouse databases."""
+    time.sleep(FAKE_MCP_LATENCY)
+    return json.dumps(["default", "system"])
+
+
+@server.tool()
+def list_tables(database: str) -> str:
+    """List tables in a ClickHouse database."""
+    time.sleep(FAKE_MCP_LATENCY)
+    return json.dumps([{"name": "mortgage_events"}, {"name": "view_metadata_catalog"}])
+
+
+if __name__ == "__main__":
+    server.run()
@@ -0,0 +1,199 @@
+# benchmarks/fakes.py
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from mcp_use import MCPAgent
+from connectors.mcp_client import HookedMCPClient
+from agents.clickhouse_auditor import build_audit_prompt
+
+FAKE_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_mcp_server.py")
+
+FAKE_ANSWER = """---
+**Dataset:** `mortgage_events`
+**Question:** `{question}`
+**Provided Answer:** `Scripted benchmark answer after {steps} tool call(s).`
+---"""
+
+
+# --- FAKE LLM ---
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A chat model that plugs into MCPAgent without any provider.
+
+    Each turn sleeps for `latency` seconds (to stand in for the network round trip), then
+    either asks for the next tool call in `tool_plan` or, once every planned call has a
+    result in the scratchpad, returns a fixed answer in the auditor's output format.
+    """
+
+    latency: float = 0.05
+    tool_plan: List[Any] = [("run_audit_query_from_file", {"file_name": "case_complexity_analyzer.sql"})]
+    bound_tools: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-benchmark"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"bound_tools": [tool.name for tool in tools]})
+
+    def _next_message(self, messages) -> AIMessage:
+        done = sum(isinstance(message, ToolMessage) for message in messages)
+        plan = [(name, args) for name, args in self.tool_plan if not self.bound_tools or name in self.bound_tools]
+        if done < len(plan):
+            name, args = plan[done]
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}],
+                             usage_metadata={"input_tokens": 900, "output_tokens": 20, "total_tokens": 920})
+        question = next((m.content for m in messages if getattr(m, "type", "") == "human"), "")
+        return AIMessage(content=FAKE_ANSWER.format(question=question, steps=done),
+                         usage_metadata={"input_tokens": 1200, "output_tokens": 60, "total_tokens": 1260})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+
+# --- FAKE MCP SERVER ---
+
+def create_fake_clickhouse_client(tool_latency: float = 0.02, rows: int = 200):
+    """A HookedMCPClient that launches benchmarks/fake_mcp_server.py over stdio as 'clickhouse_server'."""
+    config = {
+        "mcpServers": {
+            "clickhouse_server": {
+                "command": sys.executable,
+                "args": [FAKE_SERVER_SCRIPT],
+                "env": {**os.environ, "FAKE_MCP_LATENCY": str(tool_latency), "FAKE_MCP_ROWS": str(rows)},
+            }
+        }
+    }
+    return HookedMCPClient.from_dict(config)
+
+
+def make_fake_audit_agent_factory(llm_latency: float = 0.05, tool_latency: float = 0.02, rows: int = 200):
+    """Returns a drop-in replacement for create_clickhouse_audit_agent backed by the fakes."""
+    def create_fake_audit_agent():
+        return MCPAgent(
+            llm=ScriptedChatModel(latency=llm_latency),
+            client=create_fake_clickhouse_client(tool_latency, rows),
+            system_prompt=build_audit_prompt(),
+            max_steps=25,
+            memory_enabled=False,
+        )
+    return create_fake_audit_agent
+
+
+# --- FAKE SUPABASE ---
+
+def _matches(row: dict, column: str, op: str, value) -> bool:
+    current = row.get(column)
+    if op == "is":
+        return current is None if str(value) == "null" else current == value
+    if op == "in":
+        return current in value
+    if current is None:
+        return False
+    if op == "eq":
+        return current == value
+    return current > value if op == "gt" else current < value
+
+
+class _FakeQuery:
+    """The subset of the postgrest query builder used by the batch audit."""
+
+    def __init__(self, store: list):
+        self._store = store
+        self._filters = []
+        self._insert = None
+        self._update = None
+        self._conflict_keys = None
+        self._order = None
+        self._limit = None
+
+    def select(self, *columns):
+        return self
+
+    def _filter(self, column, op, value):
+        self._filters.append(lambda row: _matches(row, column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", list(values))
+
+    def or_(self, expression: str):
+        # e.g. "lease_expires_at.is.null,lease_expires_at.lt.2026-10-18T14:00:00Z"
+        clauses = [clause.split(".", 2) for clause in expression.split(",")]
+        self._filters.append(lambda row: any(_matches(row, c, op, v) for c, op, v in clauses))
+        return self
+
+    def order(self, column):
+        self._order = column
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def insert(self, rows):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict: str = "id"):
+        self.insert(rows)
+        self._conflict_keys = [key.strip() for key in on_conflict.split(",")]
+        return self
+
+    def update(self, values: dict):
+        self._update = values
+        return self
+
+    def execute(self):
+        if self._insert is not None:
+            for row in self._insert:
+                if self._conflict_keys:
+                    key = [row.get(k) for k in self._conflict_keys]
+                    self._store[:] = [r for r in self._store if [r.get(k) for k in self._conflict_keys] != key]
+                self._store.append(dict(row))
+            return SimpleNamespace(data=self._insert)
+        rows = [row for row in self._store if all(f(row) for f in self._filters)]
+        if self._update is not None:
+            for row in rows:
+                row.update(self._update)
+        if self._order:
+            rows.sort(key=lambda row: row.get(self._order))
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+
+class FakeSupabase:
+    """An in-process stand-in for the Supabase tables the batch audit reads and writes."""
+
+    def __init__(self, questions: list = None):
+        self.tables = {"t_auditor_questionaire": list(questions or []), "t_auditor_ques_answers": []}
+
+    def table(self, name: str):
+        return _FakeQuery(self.tables.setdefault(name, []))
+
+
+def make_questions(count: int) -> list:
+    topics = ["case complexity", "SOP deviation", "long running cases", "resource switches", "rework"]
+    return [{"id": i + 1, "question": f"Audit {topics[i % len(topics)]} for batch item {i + 1}", "status": "Approved"}
+            for i in range(count)]
@@ -0,0 +1,190 @@
+# benchmarks/run.py
+
+# Offline benchmark suite: no Azure, Gemini, Groq, Supabase or MCP server on port 8000 needed.
+#
+#     python -m benchmarks.run --requests 50 --concurrency 1,4,8 --output bench.json
+#     python -m benchmarks.run --baseline bench.json        # compare with an earlier commit
+#
+# Agents are real MCPAgents driven by a scripted chat model (benchmarks/fakes.py) and talk to a
+# fake MCP server over stdio, so agent, prompt, middleware and session overhead is measured
+# while LLM and tool latency are fixed by --llm-latency / --tool-latency.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+# mcp_use's telemetry makes a network call on every agent initialization; keep it out of the numbers.
+os.environ.setdefault("MCP_USE_ANONYMIZED_TELEMETRY", "false")
+# /ask is measured on its own; the batch job worker would otherwise share the app's event loop.
+os.environ.setdefault("JOBS_INPROCESS_WORKER", "false")
+
+import httpx
+from benchmarks.fakes import FakeSupabase, make_fake_audit_agent_factory, make_questions
+from agents.answer_cache import answer_cache
+from agents.clickhouse_auditor import build_audit_prompt
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p90/p95/p99/mean/max in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p90_ms": pick(0.9), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+# --- COMPONENT OVERHEAD ---
+
+async def bench_components(factory, iterations: int) -> dict:
+    """Agent construction, prompt building and MCP session setup, timed separately."""
+    construction, prompt_build, session_setup, teardown = [], [], [], []
+    for i in range(iterations):
+        started = time.perf_counter()
+        agent = factory()
+        construction.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        build_audit_prompt(make_questions(i + 1)[-1]["question"])
+        prompt_build.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await agent.initialize()
+        session_setup.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await agent.client.close_all_sessions()
+        teardown.append(time.perf_counter() - started)
+    return {"agent_construction": percentiles(construction), "prompt_build": percentiles(prompt_build),
+            "session_setup": percentiles(session_setup), "session_teardown": percentiles(teardown)}
+
+
+# --- /ask LATENCY ---
+
+async def bench_ask(factory, requests: int, concurrency: int, pool_size: int) -> dict:
+    """Drives the real FastAPI app in-process with `concurrency` simultaneous callers."""
+    import main
+    main.create_clickhouse_audit_agent = factory
+    main.ASK_AGENT_POOL_SIZE = pool_size
+
+    latencies, errors = [], 0
+    questions = make_questions(requests)
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(question):
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get("/ask", params={"q": question["question"]})
+                    latencies.append(time.perf_counter() - started)
+                    errors += response.status_code != 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(q) for q in questions))
+            elapsed = time.perf_counter() - started
+    return {"requests": requests, "concurrency": concurrency, "pool_size": pool_size, "errors": errors,
+            "elapsed_seconds": round(elapsed, 3), "requests_per_second": round(requests / elapsed, 2),
+            "latency": percentiles(latencies)}
+
+
+# --- BATCH THROUGHPUT ---
+
+async def bench_batch(factory, questions: int, concurrency_levels: list) -> list:
+    from batch_audit import run_batch_audit
+    results = []
+    for concurrency in concurrency_levels:
+        supabase = FakeSupabase(make_questions(questions))
+        stats = await run_batch_audit(concurrency=concurrency, supabase=supabase, agent_factory=factory)
+        elapsed = stats["elapsed_seconds"] or 1e-9
+        results.append({"concurrency": concurrency, "questions": questions, "answered": stats["answered"],
+                        "stored": len(supabase.tables["t_auditor_ques_answers"]), "elapsed_seconds": elapsed,
+                        "questions_per_minute": round(stats["answered"] / elapsed * 60, 1)})
+    return results
+
+
+# --- REPORT ---
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """Lines describing how the headline numbers moved relative to a baseline report."""
+    def ratio(new, old):
+        return f"{new} vs {old} ({(new / old - 1) * 100:+.1f}%)" if old else f"{new} vs {old}"
+
+    lines = [f"Comparing {report['commit']} against baseline {baseline.get('commit')}:"]
+    for name in report["components"]:
+        old = baseline.get("components", {}).get(name, {}).get("p50_ms")
+        lines.append(f"  {name} p50_ms: {ratio(report['components'][name]['p50_ms'], old)}")
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        old = baseline.get("ask", {}).get("latency", {}).get(key)
+        lines.append(f"  /ask {key}: {ratio(report['ask']['latency'].get(key), old)}")
+    old_batch = {entry["concurrency"]: entry for entry in baseline.get("batch", [])}
+    for entry in report["batch"]:
+        old = old_batch.get(entry["concurrency"], {}).get("questions_per_minute")
+        lines.append(f"  batch c={entry['concurrency']} questions/min: {ratio(entry['questions_per_minute'], old)}")
+    return lines
+
+
+async def run(args) -> dict:
+    answer_cache.enabled = False  # every request must reach an agent
+    factory = make_fake_audit_agent_factory(args.llm_latency, args.tool_latency, args.rows)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {"llm_latency": args.llm_latency, "tool_latency": args.tool_latency, "rows": args.rows,
+                   "requests": args.requests, "concurrency": levels, "python": sys.version.split()[0]},
+        "components": await bench_components(factory, args.iterations),
+        "ask": await bench_ask(factory, args.requests, max(levels), max(levels)),
+        "batch": await bench_batch(factory, args.requests, levels),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmarks.")
+    parser.add_argument("--requests", type=int, default=40, help="Questions per /ask run and per batch run.")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated batch concurrency levels.")
+    parser.add_argument("--iterations", type=int, default=5, help="Iterations for the component timings.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per scripted LLM call.")
+    parser.add_argument("--tool-latency", type=float, default=0.02, help="Seconds per fake MCP tool call.")
+    parser.add_argument("--rows", type=int, default=200, help="Rows returned by each fake query.")
+    parser.add_argument("--output", default=None, help="Where to write the JSON report (default: stdout only).")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON report to compare against.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the application's own logging.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+        report = asyncio.run(run(args))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            print("\n".join(compare(report, json.load(f))))
+
+
+if __name__ == "__main__":
+    main()
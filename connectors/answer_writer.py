@@ -0,0 +1,205 @@
+# connectors/answer_writer.py
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+# --- CONFIGURATION ---
+ANSWERS_TABLE = "t_auditor_ques_answers"
+# Rows are flushed when this many are buffered...
+ANSWER_WRITER_BATCH_SIZE = int(os.getenv("ANSWER_WRITER_BATCH_SIZE", "50"))
+# ...or when the oldest buffered row has waited this long (seconds).
+ANSWER_WRITER_FLUSH_INTERVAL = float(os.getenv("ANSWER_WRITER_FLUSH_INTERVAL", "2"))
+ANSWER_WRITER_MAX_RETRIES = int(os.getenv("ANSWER_WRITER_MAX_RETRIES", "5"))
+ANSWER_WRITER_BACKOFF_BASE = float(os.getenv("ANSWER_WRITER_BACKOFF_BASE", "0.5"))
+# "insert" (default) writes the original columns and works against the existing table, but a
+# retried batch may store an answer twice. "upsert" adds a run_id column to every row and is
+# idempotent; it needs this migration first:
+#     ALTER TABLE t_auditor_ques_answers ADD COLUMN IF NOT EXISTS run_id text;
+#     ALTER TABLE t_auditor_ques_answers ADD CONSTRAINT t_auditor_ques_answers_question_run_key UNIQUE (question_id, run_id);
+ANSWER_WRITER_MODE = os.getenv("ANSWER_WRITER_MODE", "insert")
+# Batches that still fail after every retry are appended here, tagged with their run id, and
+# replayed by the next writer for the same run (e.g. a resumed job or the same BATCH_RUN_ID).
+ANSWER_WRITER_SPILL_PATH = os.getenv("ANSWER_WRITER_SPILL_PATH", "failed_answers.jsonl")
+
+
+def new_run_id() -> str:
+    """A sortable, unique id for one audit run, e.g. '20261018T140255-3f9a1c'."""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+# Writers of different jobs share the spill file.
+_spill_lock = threading.Lock()
+
+
+class BufferedAnswerWriter:
+    """
+    Collects answer rows and writes them to Supabase in multi-row upserts.
+
+    A batch is written when ANSWER_WRITER_BATCH_SIZE rows are buffered or the oldest row has
+    waited ANSWER_WRITER_FLUSH_INTERVAL seconds, and always on close(). In "upsert" mode every
+    row carries the run id and (question_id, run_id) is the upsert key, so retrying a batch or
+    re-running with the same BATCH_RUN_ID never duplicates answers. Failed writes are retried
+    with exponential backoff and jitter; a batch that still fails is spilled to a JSONL file
+    and replayed by the next writer with the same run id instead of being lost.
+
+    The async API (start / put / flush / close) is for the service; `write` / `close_sync`
+    serve synchronous scripts such as run_audit.py.
+    """
+
+    def __init__(self, supabase, run_id: str = None, table: str = ANSWERS_TABLE,
+                 batch_size: int = ANSWER_WRITER_BATCH_SIZE, flush_interval: float = ANSWER_WRITER_FLUSH_INTERVAL,
+                 max_retries: int = ANSWER_WRITER_MAX_RETRIES, mode: str = ANSWER_WRITER_MODE,
+                 spill_path: str = ANSWER_WRITER_SPILL_PATH, on_stored=None):
+        self.supabase = supabase
+        self.run_id = run_id or os.getenv("BATCH_RUN_ID") or new_run_id()
+        self.table = table
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.mode = mode
+        self.spill_path = spill_path
+        # Optional `on_stored(rows)` callback, called (from a worker thread) after each successful write.
+        self.on_stored = on_stored
+        self._buffer = {}  # (question_id, run_id) -> row; a later answer for the same key wins
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_task = None
+        self.stats = {"buffered": 0, "stored": 0, "batches": 0, "retries": 0, "spilled": 0, "replayed": 0}
+
+    # --- BUFFERING ---
+
+    def _add(self, row: dict) -> bool:
+        """Buffers a row and returns True when the buffer should be flushed."""
+        if self.mode == "upsert":
+            row = {**row, "run_id": row.get("run_id") or self.run_id}
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer[(row["question_id"], row.get("run_id") or self.run_id)] = row
+            self.stats["buffered"] += 1
+            return len(self._buffer) >= self.batch_size
+
+    def _take(self) -> list:
+        with self._lock:
+            rows, self._buffer, self._oldest = list(self._buffer.values()), {}, None
+        return rows
+
+    def _due(self) -> bool:
+        with self._lock:
+            return bool(self._buffer) and time.monotonic() - self._oldest >= self.flush_interval
+
+    # --- WRITING ---
+
+    def _write_with_retry(self, rows: list):
+        """Writes one batch (blocking), retrying with backoff; spills it to disk if every attempt fails."""
+        if not rows:
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                query = self.supabase.table(self.table)
+                if self.mode == "upsert":
+                    query = query.upsert(rows, on_conflict="question_id,run_id")
+                else:
+                    query = query.insert(rows)
+                query.execute()
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"❌ ERROR: Answer writer gave up on {len(rows)} answers after {attempt + 1} attempts. Error: {e}")
+                    self._spill(rows)
+                    return
+                delay = ANSWER_WRITER_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+                self.stats["retries"] += 1
+                print(f"  > Answer writer: write failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+        self.stats["stored"] += len(rows)
+        self.stats["batches"] += 1
+        print(f"  > Answer writer: stored {len(rows)} answers in one {self.mode} (run {self.run_id}).")
+        if self.on_stored:
+            try:
+                self.on_stored(rows)
+            except Exception as e:
+                print(f"  > Answer writer: on_stored callback failed. Error: {e}")
+
+    def _spill(self, rows: list):
+        if not self.spill_path:
+            return
+        with _spill_lock, open(self.spill_path, 'a') as f:
+            for row in rows:
+                f.write(json.dumps({"run_id": self.run_id, "row": row}, default=str) + "\n")
+        self.stats["spilled"] += len(rows)
+        print(f"  > Answer writer: spilled {len(rows)} answers to '{self.spill_path}' for replay.")
+
+    def replay_spilled(self):
+        """
+        Re-sends the answers this run spilled earlier. Lines of other runs stay in the file, so
+        a new run never re-sends (or reports through on_stored) answers that are not its own.
+        """
+        if not self.spill_path:
+            return
+        with _spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            with open(self.spill_path, 'r') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            # Lines written before spills were tagged are plain rows; their run_id column (if any) decides.
+            mine = [e for e in entries if e.get("run_id") == self.run_id]
+            others = [e for e in entries if e.get("run_id") != self.run_id]
+            if not mine:
+                return
+            if others:
+                kept_path = self.spill_path + ".tmp"
+                with open(kept_path, 'w') as f:
+                    f.writelines(json.dumps(e, default=str) + "\n" for e in others)
+                os.replace(kept_path, self.spill_path)
+            else:
+                os.remove(self.spill_path)
+        rows = [e.get("row", e) for e in mine]
+        print(f"  > Answer writer: replaying {len(rows)} spilled answers of run {self.run_id}.")
+        for start in range(0, len(rows), self.batch_size):
+            self._write_with_retry(rows[start:start + self.batch_size])
+        self.stats["replayed"] += len(rows)
+
+    # --- ASYNC API ---
+
+    async def start(self):
+        await asyncio.to_thread(self.replay_spilled)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def put(self, row: dict):
+        if self._add(row):
+            await self.flush()
+
+    async def flush(self):
+        await asyncio.to_thread(self._write_with_retry, self._take())
+
+    async def close(self):
+        """Stops the timer and writes whatever is still buffered."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(min(self.flush_interval, 1.0))
+            if self._due():
+                await self.flush()
+
+    # --- SYNC API ---
+
+    def write(self, row: dict):
+        if self._add(row) or self._due():
+            self._write_with_retry(self._take())
+
+    def close_sync(self):
+        self._write_with_retry(self._take())
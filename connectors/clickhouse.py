@@ -0,0 +1,37 @@
+# connectors/clickhouse.py
+
+import asyncio
+
+# One direct clickhouse_connect client shared by everything that queries ClickHouse
+# without going through the MCP server (fast path, answer cache freshness checks, ...).
+_shared_client = None
+_client_lock = asyncio.Lock()
+
+
+async def get_shared_clickhouse_client():
+    """Creates the shared ClickHouse client on first use and returns it."""
+    global _shared_client
+    async with _client_lock:
+        if _shared_client is None:
+            from processor import create_clickhouse_client
+            # No session id, so concurrent queries don't collide on one ClickHouse session.
+            _shared_client = await asyncio.to_thread(create_clickhouse_client, autogenerate_session_id=False)
+        return _shared_client
+
+
+async def run_query(sql: str, parameters: dict = None):
+    """Runs a query on the shared client in a worker thread so the event loop is never blocked."""
+    client = await get_shared_clickhouse_client()
+    return await asyncio.to_thread(client.query, sql, parameters=parameters)
+
+
+async def run_command(sql: str, parameters: dict = None):
+    """Runs a DDL/DML statement on the shared client in a worker thread."""
+    client = await get_shared_clickhouse_client()
+    return await asyncio.to_thread(client.command, sql, parameters=parameters)
+
+
+async def run_raw_query(sql: str, fmt: str = "Parquet") -> bytes:
+    """Runs a query and returns the raw response bytes in the given ClickHouse output format."""
+    client = await get_shared_clickhouse_client()
+    return await asyncio.to_thread(client.raw_query, sql, fmt=fmt)
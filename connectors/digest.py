@@ -0,0 +1,141 @@
+# connectors/digest.py
+
+import os
+import json
+import numpy as np
+from connectors.tool_middleware import result_text, text_result
+
+# --- CONFIGURATION ---
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "true").lower() == "true"
+# Result sets up to this many rows are small enough to hand to the LLM unchanged.
+DIGEST_PASSTHROUGH_ROWS = int(os.getenv("DIGEST_PASSTHROUGH_ROWS", "20"))
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", "5"))
+DIGEST_SAMPLE_ROWS = int(os.getenv("DIGEST_SAMPLE_ROWS", "5"))
+DIGEST_Z_THRESHOLD = float(os.getenv("DIGEST_Z_THRESHOLD", "3.0"))
+# Tools whose results are raw query result sets.
+DIGEST_TOOLS = {"run_select_query", "run_audit_query_from_file"}
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _as_numeric(values: list):
+    """Returns a float array (NaN for nulls) if every non-null value is numeric, else None."""
+    present = [v for v in values if v is not None]
+    if not present or any(isinstance(v, bool) for v in present):
+        return None
+    try:
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+    except (TypeError, ValueError):
+        return None
+
+
+def _round(value: float):
+    return None if value is None or np.isnan(value) else float(round(value, 4))
+
+
+def digest_columns(column_names: list, columns: list) -> dict:
+    """
+    Summarizes a columnar result set.
+
+    Args:
+        column_names (list): Column names.
+        columns (list): One list of values per column (e.g. clickhouse_connect's `result_columns`).
+
+    Returns:
+        dict: Row count, per-column statistics (quantiles / mean / std / z-score outliers for
+        numeric columns, distinct count and top-k values otherwise) and a small sample of rows
+        that always includes the most extreme outliers.
+    """
+    row_count = len(columns[0]) if columns else 0
+    digest = {"row_count": row_count, "columns": {}, "sample": []}
+    outlier_rows = set()
+
+    for name, values in zip(column_names, columns):
+        values = list(values)
+        numeric = _as_numeric(values)
+        if numeric is not None:
+            present = numeric[~np.isnan(numeric)]
+            mean, std = float(present.mean()), float(present.std())
+            stats = {
+                "type": "numeric",
+                "nulls": int(np.isnan(numeric).sum()),
+                "min": _round(present.min()),
+                "max": _round(present.max()),
+                "mean": _round(mean),
+                "std": _round(std),
+                "quantiles": {f"p{int(q * 100)}": _round(v) for q, v in zip(QUANTILES, np.quantile(present, QUANTILES))},
+            }
+            if std > 0:
+                z_scores = np.abs((numeric - mean) / std)
+                outliers = np.where(np.nan_to_num(z_scores) > DIGEST_Z_THRESHOLD)[0]
+                worst = outliers[np.argsort(-z_scores[outliers])][:DIGEST_TOP_K]
+                stats["outliers"] = {
+                    "count": int(len(outliers)),
+                    "threshold_z": DIGEST_Z_THRESHOLD,
+                    "top": [{"row": int(i), "value": _round(numeric[i]), "z": _round(z_scores[i])} for i in worst],
+                }
+                outlier_rows.update(int(i) for i in worst)
+        else:
+            labels = np.array(["<null>" if v is None else str(v) for v in values], dtype=object)
+            unique, counts = np.unique(labels, return_counts=True) if row_count else (np.array([]), np.array([]))
+            order = np.argsort(-counts)[:DIGEST_TOP_K]
+            stats = {
+                "type": "categorical",
+                "distinct": int(len(unique)),
+                "top_values": [{"value": unique[i][:80], "count": int(counts[i])} for i in order],
+            }
+        digest["columns"][name] = stats
+
+    # Representative sample: evenly spaced rows plus the most extreme outliers.
+    spread = np.linspace(0, row_count - 1, num=min(DIGEST_SAMPLE_ROWS, row_count), dtype=int) if row_count else []
+    sample_rows = sorted(set(int(i) for i in spread) | outlier_rows)[: DIGEST_SAMPLE_ROWS + DIGEST_TOP_K]
+    digest["sample"] = [
+        {"row": i, **{name: columns[c][i] for c, name in enumerate(column_names)}} for i in sample_rows
+    ]
+    return digest
+
+
+def format_digest(digest: dict) -> str:
+    return "RESULT DIGEST (statistical summary of the full result set, not raw rows):\n" + json.dumps(digest, default=str)
+
+
+def format_result_for_llm(column_names: list, columns: list) -> str:
+    """Small result sets are passed as rows; anything larger becomes a digest."""
+    row_count = len(columns[0]) if columns else 0
+    if row_count <= DIGEST_PASSTHROUGH_ROWS:
+        return json.dumps({"columns": column_names, "rows": [list(row) for row in zip(*columns)]}, default=str)
+    return format_digest(digest_columns(column_names, columns))
+
+
+def _parse_result_set(text: str):
+    """
+    Extracts (column_names, columns) from a query tool's JSON output. Understands the
+    `{"columns": [...], "rows": [[...]]}` shape and a plain list of row objects.
+    Returns None for anything else (errors, plain text).
+    """
+    try:
+        payload = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(payload, dict) and isinstance(payload.get("columns"), list) and isinstance(payload.get("rows"), list):
+        column_names, rows = payload["columns"], payload["rows"]
+    elif isinstance(payload, list) and payload and all(isinstance(row, dict) for row in payload):
+        column_names = list(payload[0].keys())
+        rows = [[row.get(name) for name in column_names] for row in payload]
+    else:
+        return None
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in column_names]
+    return column_names, columns
+
+
+async def digest_select_results(server_name, tool_name, arguments, call_next):
+    """Tool middleware: replaces large query result sets with their digest before the LLM sees them."""
+    result = await call_next(tool_name, arguments)
+    if not DIGEST_ENABLED or tool_name not in DIGEST_TOOLS or getattr(result, "isError", False):
+        return result
+    parsed = _parse_result_set(result_text(result))
+    if parsed is None or (parsed[1] and len(parsed[1][0]) <= DIGEST_PASSTHROUGH_ROWS):
+        return result
+    digest = digest_columns(*parsed)
+    print(f"  > Digest: {tool_name} returned {digest['row_count']} rows, handing a digest to the agent.")
+    return text_result(format_digest(digest))
@@ -1,67 +1,410 @@
 from mcp_use import MCPClient
+from mcp_use.client.config import create_connector_from_config
+from mcp_use.client.connectors.base import BaseConnector
+from mcp_use.client.session import MCPSession
+from mcp.shared.exceptions import McpError
 import os
+import time
+import asyncio
+from connectors.tool_middleware import add_tool_middleware, wrap_connector
+from connectors.digest import digest_select_results
+from connectors.tool_cache import cache_tool_results
+from connectors.query_guard import guard_select_queries
+from snapshot_refresher import redirect_to_snapshot
+from metrics import record_tool_metrics, MCP_SESSION_EVENTS, MCP_SESSION_IN_FLIGHT
+from agents.cache import is_session_error
 
-def create_client_to_running_server_clickhouse():
-    running_server_url = "http://127.0.0.1:8000/sse/"
+# --- CONFIGURATION ---
+# Agents share a few long-lived MCP sessions per server (see MCPSessionManager) instead of
+# each opening its own. Set to false to give every agent a private session again.
+MCP_SHARED_SESSIONS = os.getenv("MCP_SHARED_SESSIONS", "true").lower() == "true"
+# Sessions kept open per server; concurrent tool calls are spread over them.
+MCP_SESSIONS_PER_SERVER = int(os.getenv("MCP_SESSIONS_PER_SERVER", "2"))
+# Servers connected when the manager starts; others are connected on first use.
+MCP_PRECONNECT_SERVERS = [s.strip() for s in os.getenv("MCP_PRECONNECT_SERVERS", "clickhouse_server").split(",") if s.strip()]
+# Every idle session is pinged this often and reconnected if the ping fails (seconds).
+MCP_HEARTBEAT_INTERVAL = float(os.getenv("MCP_HEARTBEAT_INTERVAL", "30"))
+MCP_HEARTBEAT_TIMEOUT = float(os.getenv("MCP_HEARTBEAT_TIMEOUT", "5"))
+# How long a tool call waits for a server to be connected (or reconnected) before failing.
+MCP_SESSION_WAIT_TIMEOUT = float(os.getenv("MCP_SESSION_WAIT_TIMEOUT", "30"))
+
+MCP_SERVERS = {
+    "clickhouse_server": {"url": "http://127.0.0.1:8000/sse/"},
+    "supabase_server": {"url": "http://127.0.0.1:8000/"},
+}
+
+# Query results are digested before the agent sees them (see connectors/digest.py).
+# Outermost first: the latency metric covers everything the agent waits for, cache hits included,
+# and cached results are stored after the snapshot redirect and the digest. The query guard sees
+# the query that actually runs (after the snapshot redirect) and adds its notes after the digest.
+add_tool_middleware(record_tool_metrics)
+add_tool_middleware(cache_tool_results)
+add_tool_middleware(redirect_to_snapshot)
+add_tool_middleware(guard_select_queries)
+add_tool_middleware(digest_select_results)
+
+
+class HookedMCPClient(MCPClient):
+    """An MCPClient whose sessions route every tool call through connectors/tool_middleware.py."""
+
+    async def create_session(self, server_name: str, auto_initialize: bool = True):
+        session = await super().create_session(server_name, auto_initialize)
+        if session is not None:
+            wrap_connector(session.connector, server_name)
+        return session
+
+
+# --- SHARED SESSIONS ---
+
+class _Session:
+    """One live MCP session of a server, the task holding it open and the calls running on it."""
+
+    def __init__(self, connector, task: asyncio.Task, close: asyncio.Event):
+        self.connector = connector
+        self.task = task
+        self.close = close
+        self.in_flight = 0
+        self.calls = 0
+        self.reconnects = 0
+        self.reconnecting = None  # future, while the connection is being replaced
+
+
+class MCPSessionManager:
+    """
+    Keeps a bounded set of warm MCP sessions per server and lets every agent share them.
+
+    Sessions are opened when the manager starts (MCP_PRECONNECT_SERVERS) or on first use, and
+    the server's tool, resource and prompt lists are fetched once and cached, so an agent built
+    afterwards initializes without a round trip. Concurrent tool calls are spread over the
+    server's sessions, least busy first; MCP matches responses to requests, so one session
+    carries many calls at once.
+
+    Sessions are pinged every MCP_HEARTBEAT_INTERVAL and replaced when a ping fails. A call
+    that fails because its session dropped waits for the replacement and is retried once.
+
+    Each session is opened and closed by a task of its own: an MCP session has to be closed by
+    the task that opened it, and agents run in request tasks that come and go.
+    """
 
-    # Build the config dict: use "url" for HTTP-based (SSE) servers
-    config = {
-        "mcpServers": {
-            "clickhouse_server": {
-                "url": running_server_url
+    def __init__(self, sessions_per_server: int = MCP_SESSIONS_PER_SERVER):
+        self.sessions_per_server = max(1, sessions_per_server)
+        self._configs = dict(MCP_SERVERS)
+        self._sessions = {}  # server name -> [_Session]
+        self._schemas = {}   # server name -> cached initialize result, tools, resources, prompts
+        self._ready = {}     # server name -> future, done once the server's sessions are open
+        self._heartbeat_task = None
+
+    def register(self, server_name: str, config: dict):
+        """Adds (or replaces) a server config in the mcp_config.json format, e.g. {"url": ...}."""
+        self._configs[server_name] = config
+
+    def config(self, server_name: str) -> dict:
+        return self._configs[server_name]
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat_task is not None
+
+    # --- LIFECYCLE ---
+
+    async def start(self, servers=None):
+        """Connects `servers` (default MCP_PRECONNECT_SERVERS) in the background and starts the heartbeats."""
+        if self.running:
+            return
+        print(f"--- 🔌 MCP session manager started ({self.sessions_per_server} sessions per server) ---")
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        for server_name in (MCP_PRECONNECT_SERVERS if servers is None else servers):
+            self._request_open(server_name)
+
+    async def stop(self):
+        """Stops the heartbeats and closes every session."""
+        if not self.running:
+            return
+        self._heartbeat_task.cancel()
+        await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        self._heartbeat_task = None
+        for future in self._ready.values():
+            future.cancel()  # an open still in progress closes its sessions itself
+        sessions = [session for server_sessions in self._sessions.values() for session in server_sessions]
+        for session in sessions:
+            session.close.set()
+        await asyncio.gather(*(session.task for session in sessions), return_exceptions=True)
+        self._sessions, self._ready = {}, {}
+        print("--- ❌ MCP session manager stopped. ---")
+
+    # --- CONNECTIONS ---
+
+    async def _connect(self, server_name: str) -> _Session:
+        """Opens one session in a task that holds it until `session.close` is set."""
+        opened, close = self._future(), asyncio.Event()
+
+        async def hold():
+            connector = create_connector_from_config(self._configs[server_name])
+            # Reconnects go through the manager; a connector reconnecting itself would open
+            # the new session in whichever agent task noticed the drop.
+            connector.auto_reconnect = False
+            try:
+                await connector.connect()
+                info = await connector.initialize()
+            except Exception as e:
+                opened.set_exception(e)
+                await asyncio.gather(connector.disconnect(), return_exceptions=True)
+                return
+            self._schemas[server_name] = {
+                "info": info, "capabilities": connector.capabilities, "tools": connector.tools,
+                "resources": connector.resources, "prompts": connector.prompts,
             }
-        }
-    }
+            MCP_SESSION_EVENTS.labels(server_name, "connect").inc()
+            opened.set_result(connector)
+            try:
+                await close.wait()
+            finally:
+                try:
+                    await connector.disconnect()
+                except Exception as e:
+                    print(f"  > MCP session manager: error while closing a session to '{server_name}': {e}")
 
-    # Create the MCPClient from the config dict
-    client = MCPClient.from_dict(config)
-    return client
+        task = asyncio.create_task(hold())
+        try:
+            connector = await asyncio.shield(opened)
+        except asyncio.CancelledError:
+            close.set()
+            raise
+        return _Session(connector, task, close)
 
+    async def _open(self, server_name: str, future: asyncio.Future):
+        started = time.perf_counter()
+        sessions = []
+        try:
+            for _ in range(self.sessions_per_server):
+                sessions.append(await self._connect(server_name))
+        except BaseException as e:
+            for session in sessions:
+                session.close.set()
+            if not future.done():
+                print(f"❌ MCP session manager: could not connect to '{server_name}': {e}")
+                future.set_exception(e)
+            return
+        if future.cancelled():  # stopped while connecting
+            for session in sessions:
+                session.close.set()
+            return
+        self._sessions[server_name] = sessions
+        print(f"  > MCP session manager: {len(sessions)} sessions to '{server_name}' ready in "
+              f"{time.perf_counter() - started:.2f}s, {len(self._schemas[server_name]['tools'])} tools cached.")
+        future.set_result(True)
 
-# def create_and_launch_supabase_client():
-#     """
-#     Creates a client that will AUTOMATICALLY LAUNCH the Supabase MCP server.
-#     The server configuration is defined directly in this function.
-#     """
-#     print("--- ⚙️ Defining configuration to LAUNCH Supabase MCP server... ---")
-    
-#     # 1. Get the PAT from the environment
-#     token = os.getenv("SUPABASE_ACCESS_TOKEN")
-#     if not token:
-#         raise ValueError("SUPABASE_ACCESS_TOKEN not found in .env file.")
-
-#     # 2. Define the server configuration as a Python dictionary
-#     config = {
-#         "mcpServers": {
-#             "supabase_server": { # Logical name for the Supabase server
-#                 "command": "npx",
-#                 "args": [
-#                     "-y", "@supabase/mcp-server-supabase@latest",
-#                     "--read-only",
-#                     "--port=8001", # Use a different port to avoid conflict with ClickHouse!
-#                     "--project-ref=jvgufroqfhtgnfgjijop"
-#                 ],
-#                 "env": {
-#                     "SUPABASE_ACCESS_TOKEN": token
-#                 }
-#             }
-#         }
-#     }
-
-#     # 3. Create the client from the dictionary
-#     client = MCPClient.from_dict(config)
-#     print("--- ✅ Supabase client is configured and ready to launch the server on demand. ---")
-#     return client
+    async def _replace(self, server_name: str, session: _Session):
+        """Swaps a dead connection for a new one; concurrent callers share the same attempt."""
+        if session.reconnecting is None:
+            session.reconnecting = self._future()
+            asyncio.create_task(self._reconnect(server_name, session, session.reconnecting))
+        await asyncio.wait_for(asyncio.shield(session.reconnecting), MCP_SESSION_WAIT_TIMEOUT)
+
+    async def _reconnect(self, server_name: str, session: _Session, future: asyncio.Future):
+        session.close.set()
+        try:
+            replacement = await self._connect(server_name)
+            session.connector, session.task, session.close = replacement.connector, replacement.task, replacement.close
+            session.reconnects += 1
+            MCP_SESSION_EVENTS.labels(server_name, "reconnect").inc()
+            print(f"  > MCP session manager: reconnected a session to '{server_name}'.")
+            future.set_result(True)
+        except Exception as e:
+            print(f"❌ MCP session manager: could not reconnect to '{server_name}': {e}")
+            future.set_exception(e)
+        finally:
+            session.reconnecting = None
+
+    async def _heartbeat_loop(self):
+        """Pings every idle session and replaces the ones that do not answer."""
+        while True:
+            await asyncio.sleep(MCP_HEARTBEAT_INTERVAL)
+            checked = [(server_name, session) for server_name, sessions in self._sessions.items()
+                       for session in sessions if session.in_flight == 0 and session.reconnecting is None]
+            alive = await asyncio.gather(*(self._alive(session.connector) for _, session in checked))
+            for (server_name, session), ok in zip(checked, alive):
+                if not ok:
+                    MCP_SESSION_EVENTS.labels(server_name, "heartbeat_failure").inc()
+                    print(f"  > MCP session manager: a session to '{server_name}' missed its heartbeat.")
+                    try:
+                        await self._replace(server_name, session)
+                    except Exception:
+                        pass  # logged by _reconnect; the next heartbeat tries again
+
+    @staticmethod
+    async def _alive(connector) -> bool:
+        if not connector.is_connected:
+            return False
+        try:
+            await asyncio.wait_for(connector.client_session.send_ping(), timeout=MCP_HEARTBEAT_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    # --- CALLS ---
+
+    @staticmethod
+    def _future() -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting (e.g. a pre-connect that fails); retrieve the error so it is not logged.
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return future
+
+    def _request_open(self, server_name: str) -> asyncio.Future:
+        if server_name not in self._configs:
+            raise ValueError(f"MCP server '{server_name}' is not configured")
+        future = self._ready.get(server_name)
+        if future is None or (future.done() and not future.cancelled() and future.exception() is not None):
+            future = self._ready[server_name] = self._future()
+            asyncio.create_task(self._open(server_name, future))
+        return future
+
+    async def ready(self, server_name: str):
+        """Waits until the server's sessions are open, connecting it first if needed."""
+        if not self.running:
+            raise RuntimeError("MCP session manager is not running")
+        await asyncio.wait_for(asyncio.shield(self._request_open(server_name)), MCP_SESSION_WAIT_TIMEOUT)
+
+    async def schema(self, server_name: str) -> dict:
+        """The cached initialize result and tool, resource and prompt lists of a server."""
+        await self.ready(server_name)
+        return self._schemas[server_name]
+
+    async def call(self, server_name: str, method: str, *args):
+        """
+        Runs `connector.<method>(*args)` (call_tool, read_resource, get_prompt) on the least busy
+        session of the server. If the session turns out to be dead, the call is retried once on
+        its replacement; errors returned by the server itself are raised as they are. A
+        CONNECTION_CLOSED McpError counts as a dropped session (see agents.cache.is_session_error).
+        """
+        await self.ready(server_name)
+        session = min(self._sessions[server_name], key=lambda candidate: candidate.in_flight)
+        for attempt in range(2):
+            connector = session.connector
+            session.in_flight += 1
+            session.calls += 1
+            MCP_SESSION_IN_FLIGHT.labels(server_name).inc()
+            try:
+                return await getattr(connector, method)(*args)
+            except Exception as e:
+                if isinstance(e, McpError) and not is_session_error(e):
+                    raise  # returned by the server itself
+                # A session error (e.g. McpError CONNECTION_CLOSED) is a drop; anything else is one if the ping fails.
+                if attempt or (not is_session_error(e) and await self._alive(connector)):
+                    raise
+                MCP_SESSION_EVENTS.labels(server_name, "retry").inc()
+                print(f"  > MCP session manager: session to '{server_name}' dropped during {method} ({e}), "
+                      f"retrying on a new one.")
+                if session.connector is connector:  # not already replaced by another call
+                    await self._replace(server_name, session)
+            finally:
+                session.in_flight -= 1
+                MCP_SESSION_IN_FLIGHT.labels(server_name).dec()
+
+    def stats(self) -> dict:
+        return {"running": self.running, "servers": {
+            server_name: {
+                "ready": server_name in self._sessions,
+                "tools": len(self._schemas.get(server_name, {}).get("tools") or []),
+                "sessions": [{"connected": session.connector.is_connected, "in_flight": session.in_flight,
+                              "calls": session.calls, "reconnects": session.reconnects}
+                             for session in self._sessions.get(server_name, [])],
+            } for server_name in self._ready
+        }}
+
+
+# Shared by every agent in the process; started and stopped by the app's lifespan (see main.py).
+session_manager = MCPSessionManager()
+
+
+class SharedConnector(BaseConnector):
+    """
+    The connector an agent sees when sessions are shared. Its tool, resource and prompt lists
+    come from the manager's cache and every call runs on one of the manager's sessions, so
+    connecting is free and disconnecting leaves the shared sessions open for the other agents.
+    """
+
+    def __init__(self, manager: MCPSessionManager, server_name: str):
+        super().__init__()
+        self.manager = manager
+        self.server_name = server_name
+
+    @property
+    def public_identifier(self) -> str:
+        return f"shared:{self.server_name}"
+
+    @property
+    def is_connected(self) -> bool:
+        # Dropped sessions are replaced by the manager, so the agent stays usable while it runs.
+        return self._connected and self.manager.running
+
+    async def connect(self):
+        await self.manager.ready(self.server_name)
+        self._connected = True
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def initialize(self):
+        schema = await self.manager.schema(self.server_name)
+        self.capabilities = schema["capabilities"]
+        self._tools, self._resources, self._prompts = schema["tools"], schema["resources"], schema["prompts"]
+        self._connected = self._initialized = True
+        return schema["info"]
+
+    async def list_tools(self):
+        return self._tools if self._initialized else (await self.manager.schema(self.server_name))["tools"]
+
+    async def list_resources(self):
+        return self._resources if self._initialized else (await self.manager.schema(self.server_name))["resources"]
+
+    async def list_prompts(self):
+        return self._prompts if self._initialized else (await self.manager.schema(self.server_name))["prompts"]
+
+    async def call_tool(self, name, arguments, read_timeout_seconds=None):
+        return await self.manager.call(self.server_name, "call_tool", name, arguments, read_timeout_seconds)
+
+    async def read_resource(self, uri):
+        return await self.manager.call(self.server_name, "read_resource", uri)
+
+    async def get_prompt(self, name, arguments=None):
+        return await self.manager.call(self.server_name, "get_prompt", name, arguments)
+
+
+class SharedMCPClient(HookedMCPClient):
+    """A HookedMCPClient whose sessions are SharedConnectors on `session_manager`."""
+
+    async def create_session(self, server_name: str, auto_initialize: bool = True):
+        session = MCPSession(wrap_connector(SharedConnector(session_manager, server_name), server_name))
+        if auto_initialize:
+            await session.initialize()
+        self.sessions[server_name] = session
+        if server_name not in self.active_sessions:
+            self.active_sessions.append(server_name)
+        return session
+
+
+def create_mcp_client(server_name: str):
+    """
+    A client for one of MCP_SERVERS. While the session manager runs (inside the API process)
+    the client shares its warm sessions; otherwise (scripts, worker processes) it opens its own.
+    """
+    config = {"mcpServers": {server_name: session_manager.config(server_name)}}
+    if MCP_SHARED_SESSIONS and session_manager.running:
+        return SharedMCPClient.from_dict(config)
+    return HookedMCPClient.from_dict(config)
+
+
+def create_client_to_running_server_clickhouse():
+    # "url" config = HTTP-based (SSE) server; see MCP_SERVERS.
+    return create_mcp_client("clickhouse_server")
 
 
 def create_and_launch_supabase_client():
     """Connects to the running Supabase MCP server on the default port 8000."""
-    running_server_url = "http://127.0.0.1:8000/"
     print("--- 🔌 Connecting to existing Supabase MCP server at 127.0.0.1:8000 ---")
-    
-    config = { "mcpServers": { "supabase_server": { "url": running_server_url } } }
-    client = MCPClient.from_dict(config)
-    return client
+    return create_mcp_client("supabase_server")
 
 
 from langchain_community.utilities.sql_database import SQLDatabase
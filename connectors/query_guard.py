@@ -0,0 +1,314 @@
+# connectors/query_guard.py
+
+import os
+import re
+import time
+import uuid
+import asyncio
+from connectors.clickhouse import run_query
+from connectors.tool_middleware import text_result, with_note, result_text
+from agents.manifest import manifest_store
+from snapshot_refresher import snapshot_table_name
+from metrics import QUERY_GUARD_DECISIONS, QUERY_GUARD_ESTIMATED_ROWS
+
+# --- CONFIGURATION ---
+QUERY_GUARD_ENABLED = os.getenv("QUERY_GUARD_ENABLED", "true").lower() == "true"
+# Budget per query, as estimated by EXPLAIN ESTIMATE before it runs (0 disables a budget).
+QUERY_GUARD_MAX_ROWS = int(os.getenv("QUERY_GUARD_MAX_ROWS", "50000000"))
+QUERY_GUARD_MAX_MARKS = int(os.getenv("QUERY_GUARD_MAX_MARKS", "0"))
+# "rewrite": an over-budget query on a table with a sampling key runs on a SAMPLE that fits the
+# budget, anything else is rejected. "reject": over-budget queries are always rejected.
+QUERY_GUARD_ACTION = os.getenv("QUERY_GUARD_ACTION", "rewrite")
+# LIMIT added to queries that have none (0 = never add one). Manifest SQL templates are exempt:
+# their full result feeds the digest (connectors/digest.py).
+QUERY_GUARD_DEFAULT_LIMIT = int(os.getenv("QUERY_GUARD_DEFAULT_LIMIT", "10000"))
+# Settings attached to every guarded query. A result over max_result_rows fails the query
+# instead of being cut short.
+QUERY_GUARD_MAX_EXECUTION_TIME = int(os.getenv("QUERY_GUARD_MAX_EXECUTION_TIME", "60"))
+QUERY_GUARD_MAX_RESULT_ROWS = int(os.getenv("QUERY_GUARD_MAX_RESULT_ROWS", "100000"))
+QUERY_GUARD_MAX_MEMORY_USAGE = int(os.getenv("QUERY_GUARD_MAX_MEMORY_USAGE", str(4 * 1024 ** 3)))
+# How those settings reach ClickHouse. "query": in a SETTINGS clause, which needs the MCP server
+# to run queries with readonly=0 or 2 (mcp-clickhouse uses readonly=1 unless writes are allowed,
+# and readonly=1 rejects every setting). "profile": not sent; set them in a settings profile of
+# the MCP server's ClickHouse user instead, e.g.
+#   CREATE SETTINGS PROFILE agent_guard SETTINGS max_execution_time = 60, max_result_rows = 100000,
+#     result_overflow_mode = 'throw', max_memory_usage = 4294967296 TO <mcp user>
+# "auto": sent until the server rejects them as READONLY, then "profile" for the rest of the process.
+QUERY_GUARD_SETTINGS = os.getenv("QUERY_GUARD_SETTINGS", "auto")
+# How long the estimate may take, and how long to run without estimates after one fails
+# (e.g. no direct ClickHouse credentials); queries still get their LIMIT and settings.
+QUERY_GUARD_ESTIMATE_TIMEOUT = float(os.getenv("QUERY_GUARD_ESTIMATE_TIMEOUT", "5"))
+QUERY_GUARD_ESTIMATE_RETRY = float(os.getenv("QUERY_GUARD_ESTIMATE_RETRY", "60"))
+
+GUARDED_TOOLS = {"run_select_query"}
+GUARD_SETTINGS = ("max_execution_time", "max_result_rows", "result_overflow_mode", "max_memory_usage", "log_comment")
+# Clauses that may follow `FROM <table>` when a SAMPLE clause is inserted after the table name.
+_AFTER_TABLE = {"FINAL", "PREWHERE", "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "SETTINGS", "FORMAT"}
+_TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*|\d+|[(),;]")
+_SET_OPERATORS = {"UNION", "EXCEPT", "INTERSECT"}
+# Aggregate functions (and their -If / -State / ... combinators); one in the select list reads every row.
+_AGGREGATE = re.compile(r"(count|sum|avg|min|max|any|uniq|arg(min|max)|group|quantile|median|stddev|var|topk|corr|covar"
+                        r"|entropy|histogram|sequence|windowfunnel|retention)\w*")
+# The shape of every manifest SQL template (and of its snapshot, after redirect_to_snapshot).
+_TEMPLATE_QUERY = re.compile(r"\s*SELECT\s+\*\s+FROM\s+([A-Za-z0-9_.]+)\s*;?\s*", re.IGNORECASE)
+
+_READONLY_ERROR = re.compile(r"Code: 164\b|\(READONLY\)")
+
+_estimates_paused_until = 0.0
+_send_settings = QUERY_GUARD_SETTINGS != "profile"
+_sampling_keys = {}  # (database, table) -> sampling key ("" when the table has none)
+
+
+# --- PARSING ---
+
+def _mask(sql: str) -> str:
+    """Blanks out literals, quoted identifiers and comments (keeping offsets) so clauses can be found by scanning."""
+    chars, i, n = list(sql), 0, len(sql)
+    while i < n:
+        if sql[i] in "'\"`":
+            j = i + 1
+            while j < n and sql[j] != sql[i]:
+                j += 2 if sql[j] == "\\" else 1
+            for k in range(i + 1, min(j, n)):
+                chars[k] = " "
+            i = j + 1
+        elif sql.startswith("--", i) or sql.startswith("/*", i):
+            j = sql.find("\n", i) if sql[i] == "-" else sql.find("*/", i + 2) + 2
+            j = n if j < i + 2 else j
+            for k in range(i, j):
+                chars[k] = " "
+            i = j
+        else:
+            i += 1
+    return "".join(chars)
+
+
+def parse_query(sql: str) -> dict:
+    """
+    Finds the top-level structure of a statement: its kind, the number of statements, the
+    LIMIT and the SETTINGS / FORMAT clauses, and the table of a plain `FROM [db.]table`.
+    `streaming` is True for an unfiltered, unaggregated read of that table, i.e. a query that
+    stops reading once it has LIMIT rows.
+    """
+    masked = _mask(sql)
+    end = len(masked.rstrip().rstrip(";").rstrip())
+    depth, statements, top = 0, 1, []
+    for match in _TOKEN.finditer(masked, 0, end):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            if token == ";":
+                statements += 1
+            else:
+                top.append((token.upper(), match.start(), match.end()))
+    words = [word for word, _, _ in top]
+
+    def position(word):
+        return next((start for w, start, _ in top if w == word), None)
+
+    def follows(i, word):
+        return i + 1 < len(words) and words[i + 1] == word
+
+    info = {"kind": words[0] if words else "", "statements": statements, "end": end,
+            "settings": position("SETTINGS"), "format": position("FORMAT"), "limit": None,
+            "sample": "SAMPLE" in words, "from_table": None, "set_operation": bool(_SET_OPERATORS & set(words)),
+            "streaming": not any(follows(i, "BY") for i, w in enumerate(words) if w in ("GROUP", "ORDER"))
+            and not {"DISTINCT", "JOIN", "ARRAY", "WHERE", "PREWHERE", "HAVING"} & set(words)
+            and not _SET_OPERATORS & set(words)}
+    for i, word in enumerate(words):
+        if info["set_operation"]:
+            break  # a LIMIT after UNION / EXCEPT / INTERSECT only binds the last SELECT
+        if word == "LIMIT" and i + 1 < len(words) and words[i + 1].isdigit():
+            count = int(words[i + 3]) if follows(i + 1, ",") and i + 3 < len(words) and words[i + 3].isdigit() else int(words[i + 1])
+            by = follows(i + 3 if follows(i + 1, ",") else i + 1, "BY")
+            if not by:
+                info["limit"] = count
+    from_positions = [i for i, word in enumerate(words) if word == "FROM"]
+    if len(from_positions) == 1 and from_positions[0] + 1 < len(words):
+        i = from_positions[0]
+        _, start, stop = top[i + 1]
+        plain = not masked[top[i][2]:start].strip() and not masked[stop:].lstrip().startswith("(")
+        if plain and (i + 2 == len(words) or words[i + 2] in _AFTER_TABLE):
+            insert_at = top[i + 2][2] if i + 2 < len(words) and words[i + 2] == "FINAL" else stop
+            info["from_table"] = (sql[start:stop], insert_at)
+    select = words.index("SELECT") if "SELECT" in words else len(words)
+    select_list = top[select + 1:from_positions[0]] if from_positions else []
+    info["streaming"] = info["streaming"] and info["from_table"] is not None and not any(
+        _AGGREGATE.fullmatch(word.lower()) and masked[stop:].lstrip().startswith("(") for word, _, stop in select_list)
+    return info
+
+
+def user_settings(sql: str, info: dict) -> set:
+    if info["settings"] is None:
+        return set()
+    clause = _mask(sql)[info["settings"]:info["format"] or info["end"]]
+    return {name.lower() for name in re.findall(r"([A-Za-z_][A-Za-z0-9_]*)\s*=", clause)}
+
+
+def is_template_query(sql: str) -> bool:
+    """True for a manifest SQL template, `SELECT * FROM default.<analyzer view>`, or its snapshot table."""
+    match = _TEMPLATE_QUERY.fullmatch(sql)
+    if not match:
+        return False
+    views = [entry["view_name"] for entry in manifest_store.get() if entry.get("view_name")]
+    return match.group(1) in {f"default.{view}" for view in views} | {snapshot_table_name(view) for view in views}
+
+
+def guard_query(sql: str, info: dict, query_id: str, sample: float = None, template: bool = False,
+                send_settings: bool = True) -> tuple:
+    """
+    Returns (guarded SQL, notes for the agent): SAMPLE and LIMIT when needed, plus the guard's
+    SETTINGS unless `send_settings` is False. A UNION / EXCEPT / INTERSECT is wrapped in a
+    subquery so the LIMIT bounds all of it. A template query keeps its full result: it gets no
+    LIMIT and no result row cap.
+    """
+    clauses_at = min(p for p in (info["settings"], info["format"], info["end"]) if p is not None)
+    main, notes = sql[:clauses_at].rstrip(), []
+    settings = sql[info["settings"]:info["format"] or info["end"]].strip() if info["settings"] is not None else ""
+    fmt = sql[info["format"]:info["end"]].strip() if info["format"] is not None else ""
+    if sample:
+        table, insert_at = info["from_table"]
+        main = f"{sql[:insert_at]} SAMPLE {sample}{sql[insert_at:clauses_at]}".rstrip()
+        notes.append(f"it ran on a SAMPLE {sample} of {table} (about {sample:.2%} of the rows); counts and sums "
+                     f"are about {sample} times the full-table values, add filters for exact numbers")
+    if info["limit"] is None and QUERY_GUARD_DEFAULT_LIMIT and not template:
+        main = f"SELECT * FROM ({main})" if info["set_operation"] else main
+        main += f" LIMIT {QUERY_GUARD_DEFAULT_LIMIT}"
+        notes.append(f"LIMIT {QUERY_GUARD_DEFAULT_LIMIT} was added, so the result may be incomplete")
+    result_cap = "" if template else f"max_result_rows={QUERY_GUARD_MAX_RESULT_ROWS}, result_overflow_mode='throw', "
+    guard = (f"max_execution_time={QUERY_GUARD_MAX_EXECUTION_TIME}, {result_cap}"
+             f"max_memory_usage={QUERY_GUARD_MAX_MEMORY_USAGE}, log_comment='{query_id}'")
+    if send_settings:
+        settings = f"{settings}, {guard}" if settings else f"SETTINGS {guard}"
+    return " ".join(part for part in (main, settings, fmt) if part), notes
+
+
+# --- ESTIMATES ---
+
+async def estimate_query(sql: str, info: dict):
+    """Rows and marks the query would read per table, from EXPLAIN ESTIMATE; None when unavailable."""
+    global _estimates_paused_until
+    if time.monotonic() < _estimates_paused_until:
+        return None
+    try:
+        result = await asyncio.wait_for(run_query(f"EXPLAIN ESTIMATE {sql[:info['end']]}"), QUERY_GUARD_ESTIMATE_TIMEOUT)
+    except Exception as e:
+        _estimates_paused_until = time.monotonic() + QUERY_GUARD_ESTIMATE_RETRY
+        print(f"  > Query guard: EXPLAIN ESTIMATE failed ({e}); running queries unestimated for "
+              f"{QUERY_GUARD_ESTIMATE_RETRY:.0f}s.")
+        return None
+    tables = [dict(zip(result.column_names, row)) for row in result.result_rows]
+    return {"rows": sum(int(t["rows"]) for t in tables), "marks": sum(int(t["marks"]) for t in tables), "tables": tables}
+
+
+def over_budget(estimate: dict) -> bool:
+    return bool((QUERY_GUARD_MAX_ROWS and estimate["rows"] > QUERY_GUARD_MAX_ROWS)
+                or (QUERY_GUARD_MAX_MARKS and estimate["marks"] > QUERY_GUARD_MAX_MARKS))
+
+
+async def sample_ratio(info: dict, estimate: dict):
+    """The SAMPLE ratio that brings a plain single-table query within budget, or None if it cannot be sampled."""
+    if info["sample"] or not info["from_table"] or len(estimate["tables"]) != 1 or not QUERY_GUARD_MAX_ROWS:
+        return None
+    table = estimate["tables"][0]
+    if info["from_table"][0].split(".")[-1].strip("`\"") != table["table"]:
+        return None
+    key = (table["database"], table["table"])
+    if key not in _sampling_keys:
+        try:
+            result = await run_query("SELECT sampling_key FROM system.tables WHERE database = {db:String} AND name = {t:String}",
+                                     parameters={"db": key[0], "t": key[1]})
+            _sampling_keys[key] = result.result_rows[0][0] if result.result_rows else ""
+        except Exception:
+            return None
+    if not _sampling_keys[key]:
+        return None
+    return max(round(QUERY_GUARD_MAX_ROWS / max(estimate["rows"], 1), 4), 0.0001)
+
+
+# --- MIDDLEWARE ---
+
+def _reject(reason: str):
+    QUERY_GUARD_DECISIONS.labels("rejected").inc()
+    print(f"  > Query guard: rejected a query ({reason}).")
+    return text_result(f"Query rejected by the query guard: {reason}", is_error=True)
+
+
+async def _run_guarded(call_next, tool_name: str, arguments: dict, sql: str, info: dict, query_id: str,
+                       sample: float = None, template: bool = False) -> tuple:
+    """Runs the guarded query; in "auto" mode, once again without the guard's SETTINGS if the server is read-only."""
+    global _send_settings
+    guarded, notes = guard_query(sql, info, query_id, sample, template, _send_settings)
+    result = await call_next(tool_name, {**arguments, "query": guarded})
+    if _send_settings and QUERY_GUARD_SETTINGS == "auto" and _READONLY_ERROR.search(result_text(result)):
+        _send_settings = False
+        print("⚠️ Query guard: the MCP server runs queries with readonly=1 and rejects SETTINGS. Guard settings "
+              "are no longer sent; enforce them with a settings profile (see QUERY_GUARD_SETTINGS).")
+        guarded, notes = guard_query(sql, info, query_id, sample, template, send_settings=False)
+        result = await call_next(tool_name, {**arguments, "query": guarded})
+    return result, notes
+
+
+async def guard_select_queries(server_name, tool_name, arguments, call_next):
+    """
+    Tool middleware: bounds every SELECT an agent runs. The statement is estimated with
+    EXPLAIN ESTIMATE first; one that would read more than the budget is rewritten to run on a
+    SAMPLE (when the table has a sampling key) or rejected with advice for the agent. Each query
+    that runs gets a LIMIT if it has none and the guard's resource settings (see
+    QUERY_GUARD_SETTINGS). The MCP tool takes no query_id, so the guard's id for the query is
+    sent as the `log_comment` setting: find it with `WHERE log_comment = '<id>'` in
+    system.query_log. Manifest SQL templates skip the budget and the LIMIT; only the time and
+    memory limits apply to them.
+    """
+    if not QUERY_GUARD_ENABLED or tool_name not in GUARDED_TOOLS:
+        return await call_next(tool_name, arguments)
+    sql = str(arguments.get("query", ""))
+    info = parse_query(sql)
+    if info["statements"] > 1:
+        return _reject("send one statement per call")
+    if info["kind"] not in ("SELECT", "WITH"):
+        return await call_next(tool_name, arguments)
+    overridden = user_settings(sql, info) & set(GUARD_SETTINGS)
+    if overridden:
+        return _reject(f"SETTINGS may not override {sorted(overridden)}")
+
+    query_id = f"agent-query-{uuid.uuid4().hex[:16]}"
+    if is_template_query(sql):
+        QUERY_GUARD_DECISIONS.labels("template").inc()
+        result, _ = await _run_guarded(call_next, tool_name, arguments, sql, info, query_id, template=True)
+        return result
+
+    estimate = await estimate_query(sql, info)
+    sample = None
+    if estimate is not None:
+        QUERY_GUARD_ESTIMATED_ROWS.observe(estimate["rows"])
+        # An unfiltered, unaggregated scan stops at its LIMIT, so it reads far less than the estimate
+        # says. A WHERE or an aggregate reads the whole table whatever the LIMIT.
+        stops_early = info["streaming"] and info["limit"] is not None and info["limit"] <= QUERY_GUARD_MAX_RESULT_ROWS
+        if over_budget(estimate) and not stops_early:
+            if QUERY_GUARD_ACTION == "rewrite":
+                sample = await sample_ratio(info, estimate)
+            if sample is None:
+                tables = ", ".join(f"{t['database']}.{t['table']}" for t in estimate["tables"])
+                return _reject(
+                    f"it would read about {estimate['rows']:,} rows ({estimate['marks']:,} marks) from {tables}, over "
+                    f"the budget of {QUERY_GUARD_MAX_ROWS:,} rows. Filter on the table's sorting key, aggregate in SQL, "
+                    f"narrow the time range or query a smaller view.")
+
+    if sample:
+        decision = "sampled"
+    elif estimate is None:
+        decision = "unestimated"
+    else:
+        decision = "limited" if info["limit"] is None and QUERY_GUARD_DEFAULT_LIMIT else "allowed"
+    QUERY_GUARD_DECISIONS.labels(decision).inc()
+    if estimate is not None or sample or (info["limit"] is None and QUERY_GUARD_DEFAULT_LIMIT):
+        print(f"  > Query guard [{query_id}]: {decision}"
+              + (f", estimated {estimate['rows']:,} rows / {estimate['marks']:,} marks." if estimate else "."))
+    result, notes = await _run_guarded(call_next, tool_name, arguments, sql, info, query_id, sample)
+    if notes and not getattr(result, "isError", False):
+        result = with_note(result, f"NOTE (query guard, {query_id}): " + "; ".join(notes) + ".")
+    return result
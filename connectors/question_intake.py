@@ -0,0 +1,126 @@
+# connectors/question_intake.py
+
+import os
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# --- CONFIGURATION ---
+QUESTIONS_TABLE = "t_auditor_questionaire"
+ANSWERS_TABLE = "t_auditor_ques_answers"
+# Questions read per round trip; memory use is bounded by this, not by the questionnaire size.
+QUESTION_PAGE_SIZE = int(os.getenv("QUESTION_PAGE_SIZE", "100"))
+# How long a claimed question is reserved for this process before another run may take it.
+QUESTION_LEASE_SECONDS = float(os.getenv("QUESTION_LEASE_SECONDS", "900"))
+# Off by default: claiming needs two extra columns on the questionnaire, so run this first:
+#     ALTER TABLE t_auditor_questionaire ADD COLUMN IF NOT EXISTS claimed_by text;
+#     ALTER TABLE t_auditor_questionaire ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz;
+# Without claims, pages are still streamed and answered questions skipped, but two concurrent
+# runs may answer the same question.
+QUESTION_CLAIM_ENABLED = os.getenv("QUESTION_CLAIM_ENABLED", "false").lower() == "true"
+
+
+class QuestionIntake:
+    """
+    Streams approved questions page by page (keyset pagination on id) and yields only the
+    ones that still need work.
+
+    A question is skipped when `t_auditor_ques_answers` already holds an answer for the same
+    question text, so edited questions are answered again and unchanged ones are not. With
+    QUESTION_CLAIM_ENABLED, the remaining questions of a page are claimed in a single
+    conditional UPDATE that only matches rows whose lease is missing or expired; the rows it
+    returns are the ones this process owns, so concurrent runs never process the same
+    question. Leases of questions that fail are released so the next run retries them.
+    """
+
+    def __init__(self, supabase, page_size: int = QUESTION_PAGE_SIZE, lease_seconds: float = QUESTION_LEASE_SECONDS,
+                 claim: bool = QUESTION_CLAIM_ENABLED, worker_id: str = None):
+        self.supabase = supabase
+        self.page_size = max(1, page_size)
+        self.lease_seconds = lease_seconds
+        self.claim_enabled = claim
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = {"pages": 0, "seen": 0, "already_answered": 0, "claimed_elsewhere": 0, "yielded": 0}
+        self.exhausted = False  # True once the last page of the table has been read
+
+    # --- ONE PAGE (blocking Supabase calls) ---
+
+    def fetch_page(self, after_id) -> list:
+        query = self.supabase.table(QUESTIONS_TABLE).select("id, question").eq("status", "Approved")
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return query.order("id").limit(self.page_size).execute().data or []
+
+    def drop_answered(self, page: list) -> list:
+        """Removes the questions whose current text already has an answer."""
+        ids = [item["id"] for item in page]
+        answers = (self.supabase.table(ANSWERS_TABLE).select("question_id, question")
+                   .in_("question_id", ids).execute().data or [])
+        answered = {(row["question_id"], row.get("question")) for row in answers}
+        pending = [item for item in page if (item["id"], item.get("question")) not in answered]
+        self.stats["already_answered"] += len(page) - len(pending)
+        return pending
+
+    def claim(self, page: list) -> list:
+        """Atomically leases the page's unclaimed (or expired) questions; returns the ones now owned."""
+        if not self.claim_enabled or not page:
+            return page
+        now = datetime.now(timezone.utc)
+        expires = now + timedelta(seconds=self.lease_seconds)
+        claimed = (self.supabase.table(QUESTIONS_TABLE)
+                   .update({"claimed_by": self.worker_id,
+                            "lease_expires_at": expires.strftime("%Y-%m-%dT%H:%M:%SZ")})
+                   .in_("id", [item["id"] for item in page])
+                   .eq("status", "Approved")
+                   .or_(f"lease_expires_at.is.null,lease_expires_at.lt.{now.strftime('%Y-%m-%dT%H:%M:%SZ')}")
+                   .execute().data or [])
+        owned = {row["id"] for row in claimed}
+        self.stats["claimed_elsewhere"] += len(page) - len(owned)
+        return [item for item in page if item["id"] in owned]
+
+    def release(self, question_id):
+        """Gives a question back (e.g. after a failure) so the next run can pick it up."""
+        if not self.claim_enabled:
+            return
+        try:
+            (self.supabase.table(QUESTIONS_TABLE).update({"claimed_by": None, "lease_expires_at": None})
+             .eq("id", question_id).eq("claimed_by", self.worker_id).execute())
+        except Exception as e:
+            print(f"  > Question intake: could not release question {question_id}, its lease will expire. Error: {e}")
+
+    def next_page(self, after_id):
+        """Returns (questions to process, last id read); the last id is None when the table is exhausted."""
+        page = self.fetch_page(after_id)
+        self.exhausted = len(page) < self.page_size
+        if not page:
+            return [], None
+        self.stats["pages"] += 1
+        self.stats["seen"] += len(page)
+        work = self.claim(self.drop_answered(page))
+        self.stats["yielded"] += len(work)
+        return work, page[-1]["id"]
+
+    # --- ITERATION ---
+
+    def pages(self):
+        """Synchronous generator of non-empty work pages."""
+        after_id = None
+        while True:
+            work, after_id = self.next_page(after_id)
+            if after_id is None:
+                return
+            if work:
+                yield work
+
+    async def apages(self):
+        """Async generator of non-empty work pages; Supabase calls run in a worker thread."""
+        after_id = None
+        while True:
+            work, after_id = await asyncio.to_thread(self.next_page, after_id)
+            if after_id is None:
+                return
+            if work:
+                yield work
+
+    async def arelease(self, question_id):
+        await asyncio.to_thread(self.release, question_id)
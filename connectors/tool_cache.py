@@ -0,0 +1,149 @@
+# connectors/tool_cache.py
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from agents.manifest import manifest_store
+from connectors.tool_middleware import result_text
+from metrics import TOOL_CACHE_EVENTS, TOOL_CACHE_BYTES
+
+# --- CONFIGURATION ---
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+# Seconds a result stays valid, per tool. Tools without a TTL are never cached.
+DEFAULT_TOOL_CACHE_TTLS = {
+    "list_databases": 3600,
+    "list_tables": 3600,
+    "list_user_defined_functions": 3600,
+    "read_sql_query_file": 3600,
+    "get_view_implementation": 3600,
+}
+
+
+def _parse_ttls(spec: str) -> dict:
+    ttls = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, ttl = item.split("=", 1)
+            ttls[name.strip()] = float(ttl)
+    return ttls
+
+
+# Overrides and additions, e.g. "list_tables=600,get_view_implementation=0". Query results
+# (run_select_query, run_audit_query_from_file) are only cached when listed here explicitly.
+TOOL_CACHE_TTLS = {**DEFAULT_TOOL_CACHE_TTLS, **_parse_ttls(os.getenv("TOOL_CACHE_TTLS", ""))}
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1024"))
+# Total characters of cached result text; least recently used entries go first.
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# A single result bigger than this is passed through without being cached.
+TOOL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("TOOL_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+
+class ToolResultCache:
+    """
+    Caches the results of MCP tools whose answers rarely change (schema listings, SQL
+    templates, view definitions), so a repeated call costs no round trip to the server.
+
+    Entries are keyed by server, tool and arguments and expire after the tool's TTL. Only
+    successful, text-only results are kept. Memory is bounded by entry count and total size
+    with LRU eviction, and everything is dropped when processor.py re-syncs the manifest,
+    since templates and view definitions may have changed with it.
+    """
+
+    def __init__(self, ttls: dict = None, max_entries: int = TOOL_CACHE_MAX_ENTRIES,
+                 max_bytes: int = TOOL_CACHE_MAX_BYTES):
+        self.ttls = TOOL_CACHE_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (result, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, tool_name: str) -> bool:
+        return self.ttls.get(tool_name, 0) > 0
+
+    @staticmethod
+    def make_key(server_name: str, tool_name: str, arguments: dict) -> str:
+        arguments = dict(arguments or {})
+        if isinstance(arguments.get("query"), str):
+            arguments["query"] = " ".join(arguments["query"].split())
+        return f"{server_name}:{tool_name}:{json.dumps(arguments, sort_keys=True, default=str)}"
+
+    def get(self, key: str, tool_name: str):
+        manifest_store.get()  # a manifest re-sync clears the cache (see invalidate)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        TOOL_CACHE_EVENTS.labels(tool_name, "hit" if entry else "miss").inc()
+        return entry[0] if entry else None
+
+    def put(self, key: str, tool_name: str, result):
+        if getattr(result, "isError", False) or any(getattr(item, "type", None) != "text" for item in result.content or []):
+            return
+        size = len(result_text(result))
+        if size > TOOL_CACHE_MAX_ENTRY_BYTES:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (result, size, time.monotonic() + self.ttls[tool_name])
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                TOOL_CACHE_EVENTS.labels(tool_name, "evict").inc()
+        TOOL_CACHE_BYTES.set(self._bytes)
+
+    def _drop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self, tool_name: str = None) -> int:
+        """Drops every entry, or only those of one tool. Returns how many were dropped."""
+        with self._lock:
+            keys = [key for key in self._entries if tool_name is None or key.split(":", 2)[1] == tool_name]
+            for key in keys:
+                self._drop(key)
+        TOOL_CACHE_BYTES.set(self._bytes)
+        return len(keys)
+
+    def invalidate(self, entries: list, changes: dict):
+        """Manifest listener: templates and view definitions may have changed, so start over."""
+        dropped = self.clear()
+        TOOL_CACHE_EVENTS.labels("*", "invalidate").inc()
+        print(f"  > Tool cache: manifest re-synced, dropped {dropped} cached tool results.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"enabled": TOOL_CACHE_ENABLED, "entries": len(self._entries), "bytes": self._bytes,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0, "ttls": self.ttls}
+
+
+# Shared by every agent in the process.
+tool_cache = ToolResultCache()
+manifest_store.on_change(tool_cache.invalidate)
+
+
+async def cache_tool_results(server_name, tool_name, arguments, call_next):
+    """Tool middleware: answers repeated calls to tools with a TTL from the cache."""
+    if not TOOL_CACHE_ENABLED or not tool_cache.cacheable(tool_name):
+        return await call_next(tool_name, arguments)
+    key = tool_cache.make_key(server_name, tool_name, arguments)
+    cached = tool_cache.get(key, tool_name)
+    if cached is not None:
+        return cached
+    result = await call_next(tool_name, arguments)
+    tool_cache.put(key, tool_name, result)
+    return result
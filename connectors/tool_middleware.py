@@ -0,0 +1,72 @@
+# connectors/tool_middleware.py
+
+# Every MCP tool call an agent makes goes through the connector's `call_tool`. The clients
+# built in connectors/mcp_client.py wrap that method so registered middlewares see each call:
+#
+#     async def middleware(server_name, tool_name, arguments, call_next):
+#         ...                                    # inspect / rewrite the call
+#         result = await call_next(tool_name, arguments)
+#         ...                                    # inspect / rewrite the CallToolResult
+#         return result
+#
+# Middlewares run in registration order, the first one registered being the outermost.
+
+import os
+import asyncio
+
+# The agent executor runs every tool call of one model turn concurrently. This caps how many
+# calls of one connector (i.e. one agent, one turn at a time) are in flight together.
+AGENT_MAX_PARALLEL_TOOL_CALLS = int(os.getenv("AGENT_MAX_PARALLEL_TOOL_CALLS", "4"))
+
+_middlewares = []
+
+
+def add_tool_middleware(middleware):
+    """Registers a middleware for every MCP tool call in the process (idempotent)."""
+    if middleware not in _middlewares:
+        _middlewares.append(middleware)
+
+
+def remove_tool_middleware(middleware):
+    if middleware in _middlewares:
+        _middlewares.remove(middleware)
+
+
+def wrap_connector(connector, server_name: str):
+    """Routes `connector.call_tool` through the registered middlewares, at most AGENT_MAX_PARALLEL_TOOL_CALLS at a time."""
+    if getattr(connector, "_middleware_installed", False):
+        return connector
+    original_call_tool = connector.call_tool
+    slots = asyncio.Semaphore(max(1, AGENT_MAX_PARALLEL_TOOL_CALLS))
+
+    async def call_tool(name, arguments, read_timeout_seconds=None):
+        async def dispatch(index, tool_name, tool_arguments):
+            if index == len(_middlewares):
+                return await original_call_tool(tool_name, tool_arguments, read_timeout_seconds)
+            return await _middlewares[index](
+                server_name, tool_name, tool_arguments,
+                lambda next_name, next_arguments: dispatch(index + 1, next_name, next_arguments),
+            )
+        async with slots:
+            return await dispatch(0, name, arguments)
+
+    connector.call_tool = call_tool
+    connector._middleware_installed = True
+    return connector
+
+
+def text_result(text: str, is_error: bool = False):
+    """Builds a CallToolResult carrying a single text block, as MCP servers return."""
+    from mcp.types import CallToolResult, TextContent
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=is_error)
+
+
+def with_note(result, text: str):
+    """A copy of a CallToolResult with one more text block at the end (e.g. a note for the agent)."""
+    from mcp.types import TextContent
+    return result.model_copy(update={"content": [*(result.content or []), TextContent(type="text", text=text)]})
+
+
+def result_text(result) -> str:
+    """Concatenates the text blocks of a CallToolResult (non-text blocks are ignored)."""
+    return "".join(getattr(item, "text", "") for item in (result.content or []))
@@ -0,0 +1,456 @@
+# jobs.py
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from agents.clickhouse_auditor import create_clickhouse_audit_agent
+from agents.pool import AgentPool
+from connectors.answer_writer import BufferedAnswerWriter
+from connectors.question_intake import QuestionIntake
+from batch_audit import answer_question, answer_row, BATCH_AUDIT_CONCURRENCY, BATCH_AUDIT_QUESTION_TIMEOUT
+
+# --- CONFIGURATION ---
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# The job queue. Every API process and worker process that shares this file shares the jobs;
+# on several nodes, put it on a volume they all mount.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+# A claimed question whose worker has not finished it within this time is handed to another worker.
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "900"))
+# A question that failed this many times is given up on.
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# How often an idle worker looks for new work (seconds).
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "5"))
+# Run a worker inside the API process. Set to false when dedicated `python jobs.py worker`
+# processes do the work.
+JOBS_INPROCESS_WORKER = os.getenv("JOBS_INPROCESS_WORKER", "true").lower() == "true"
+# Idle workers close their agents after this long without work (seconds).
+JOBS_IDLE_SHUTDOWN = float(os.getenv("JOBS_IDLE_SHUTDOWN", "60"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def create_supabase_client():
+    # Imported on first use: an API process with no batch work never loads the Supabase SDK.
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp else None
+
+
+class JobStore:
+    """
+    SQLite-backed batch audit jobs.
+
+    A job is one pass over the questionnaire. Its questions are copied into `job_items`
+    while the questionnaire is paged through, and each item moves
+    pending -> claimed -> done (or back to pending after a failure, until JOBS_MAX_ATTEMPTS).
+    Claims are leases taken inside an IMMEDIATE transaction, so any number of worker
+    processes can pull from the same job; a worker that dies simply lets its leases expire
+    and the items are picked up again. That is also how a job resumes after a restart.
+    Enumeration holds a lease of its own, renewed with every page, so a job whose enumeration
+    was interrupted is picked up and enumerated again by the next worker.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT,
+                    enumerated INTEGER NOT NULL DEFAULT 0, enumeration_lease_expires_at REAL, error TEXT,
+                    created_at REAL, started_at REAL, finished_at REAL);
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL, question_id INTEGER NOT NULL, question TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT, lease_expires_at REAL, error TEXT, finished_at REAL,
+                    PRIMARY KEY (job_id, question_id));
+                CREATE INDEX IF NOT EXISTS job_items_status ON job_items (job_id, status, lease_expires_at);
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "enumeration_lease_expires_at" not in columns:  # stores created before enumeration leases
+                conn.execute("ALTER TABLE jobs ADD COLUMN enumeration_lease_expires_at REAL")
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit; multi-statement updates open their own IMMEDIATE transaction.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # --- JOBS ---
+
+    def create_job(self, params: dict = None):
+        """
+        Creates a job, unless one is already queued or running, in which case that one is
+        returned: two triggers never run the same questions twice.
+
+        Returns:
+            tuple: (job id, created)
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                f"SELECT id FROM jobs WHERE status IN {ACTIVE_STATUSES} ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if active:
+                conn.execute("COMMIT")
+                return active["id"], False
+            job_id = f"job-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            conn.execute("INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                         (job_id, json.dumps(params or {}), _now()))
+            conn.execute("COMMIT")
+        return job_id, True
+
+    def job_params(self, job_id: str) -> dict:
+        with self._connect() as conn:
+            row = conn.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["params"] or "{}") if row else {}
+
+    def claim_enumeration(self, job_id: str = None, lease_seconds: float = JOBS_LEASE_SECONDS):
+        """
+        Takes the enumeration lease of `job_id`, or of the oldest active job whose enumeration
+        is unfinished and not leased (e.g. it was interrupted by a restart).
+
+        Returns:
+            str: The job id, or None when there is nothing to enumerate.
+        """
+        now = _now()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"""SELECT id FROM jobs WHERE status IN {ACTIVE_STATUSES} AND enumerated = 0
+                      AND (enumeration_lease_expires_at IS NULL OR enumeration_lease_expires_at < ?)
+                      AND (? IS NULL OR id = ?)
+                    ORDER BY created_at LIMIT 1""",
+                (now, job_id, job_id),
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET enumeration_lease_expires_at = ? WHERE id = ?", (now + lease_seconds, row["id"]))
+            conn.execute("COMMIT")
+        return row["id"] if row else None
+
+    def add_items(self, job_id: str, items: list, lease_seconds: float = JOBS_LEASE_SECONDS):
+        """Queues one page of questions and renews the enumeration lease."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_items (job_id, question_id, question) VALUES (?, ?, ?)",
+                [(job_id, item["id"], item["question"]) for item in items if item.get("id") and item.get("question")],
+            )
+            conn.execute("UPDATE jobs SET enumeration_lease_expires_at = ? WHERE id = ? AND enumeration_lease_expires_at IS NOT NULL",
+                         (_now() + lease_seconds, job_id))
+
+    def finish_enumeration(self, job_id: str, error: str = None):
+        with self._connect() as conn:
+            if error:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, "
+                             "enumeration_lease_expires_at = NULL WHERE id = ?", (error, _now(), job_id))
+            else:
+                conn.execute("UPDATE jobs SET enumerated = 1, enumeration_lease_expires_at = NULL WHERE id = ?", (job_id,))
+        self._maybe_complete(job_id)
+
+    def cancel_job(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN {ACTIVE_STATUSES}",
+                (_now(), job_id))
+        return cursor.rowcount > 0
+
+    # --- ITEMS ---
+
+    def next_job(self, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        """The active job that claim() currently takes items from, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"""SELECT i.job_id FROM job_items i JOIN jobs j ON j.id = i.job_id WHERE j.status IN {ACTIVE_STATUSES}
+                    AND (i.status = 'pending' OR (i.status = 'claimed' AND i.lease_expires_at < ?))
+                    AND i.attempts < ? ORDER BY j.created_at LIMIT 1""",
+                (_now(), max_attempts),
+            ).fetchone()
+        return row["job_id"] if row else None
+
+    def has_work(self, max_attempts: int = JOBS_MAX_ATTEMPTS) -> bool:
+        return self.next_job(max_attempts) is not None
+
+    def claim(self, worker: str, limit: int = 1, lease_seconds: float = JOBS_LEASE_SECONDS,
+              max_attempts: int = JOBS_MAX_ATTEMPTS) -> list:
+        """
+        Leases up to `limit` pending (or abandoned) items of the oldest active job. Abandoned
+        items that already used up max_attempts are failed instead of being leased again.
+        """
+        now = _now()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            exhausted = [row["job_id"] for row in conn.execute(
+                "SELECT DISTINCT job_id FROM job_items WHERE status = 'claimed' AND lease_expires_at < ? AND attempts >= ?",
+                (now, max_attempts))]
+            conn.execute(
+                "UPDATE job_items SET status = 'failed', error = 'lease expired after ' || attempts || ' attempts', "
+                "lease_expires_at = NULL, finished_at = ? WHERE status = 'claimed' AND lease_expires_at < ? AND attempts >= ?",
+                (now, now, max_attempts),
+            )
+            rows = conn.execute(
+                f"""SELECT i.job_id, i.question_id, i.question FROM job_items i JOIN jobs j ON j.id = i.job_id
+                    WHERE j.status IN {ACTIVE_STATUSES}
+                      AND (i.status = 'pending' OR (i.status = 'claimed' AND i.lease_expires_at < ?))
+                      AND i.attempts < ?
+                    ORDER BY j.created_at, i.question_id LIMIT ?""",
+                (now, max_attempts, limit),
+            ).fetchall()
+            for row in rows:
+                conn.execute(
+                    "UPDATE job_items SET status = 'claimed', worker = ?, lease_expires_at = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND question_id = ?",
+                    (worker, now + lease_seconds, row["job_id"], row["question_id"]),
+                )
+            for job_id in {row["job_id"] for row in rows}:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) "
+                             "WHERE id = ? AND status = 'queued'", (now, job_id))
+            conn.execute("COMMIT")
+        for job_id in exhausted:
+            self._maybe_complete(job_id)
+        return [dict(row) for row in rows]
+
+    def mark_done(self, job_id: str, question_ids: list):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE job_items SET status = 'done', finished_at = ?, error = NULL WHERE job_id = ? AND question_id = ?",
+                [(_now(), job_id, question_id) for question_id in question_ids],
+            )
+        self._maybe_complete(job_id)
+
+    def mark_failed(self, job_id: str, question_id, error: str, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        """Puts the item back in the queue, or fails it for good after max_attempts."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE job_items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_expires_at = NULL, finished_at = ? WHERE job_id = ? AND question_id = ?",
+                (max_attempts, error, _now(), job_id, question_id),
+            )
+        self._maybe_complete(job_id)
+
+    def _maybe_complete(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                f"""UPDATE jobs SET status = 'completed', finished_at = ?
+                    WHERE id = ? AND status IN {ACTIVE_STATUSES} AND enumerated = 1
+                      AND NOT EXISTS (SELECT 1 FROM job_items WHERE job_id = ? AND status IN ('pending', 'claimed'))""",
+                (_now(), job_id, job_id),
+            )
+
+    # --- PROGRESS ---
+
+    def progress(self, job_id: str):
+        """Counts per item state plus throughput and ETA, or None for an unknown job."""
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = {row["status"]: row["n"] for row in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM job_items WHERE job_id = ? GROUP BY status", (job_id,))}
+            workers = [row["worker"] for row in conn.execute(
+                "SELECT DISTINCT worker FROM job_items WHERE job_id = ? AND status = 'claimed' AND lease_expires_at >= ?",
+                (job_id, _now()))]
+
+        done, failed = counts.get("done", 0), counts.get("failed", 0)
+        remaining = counts.get("pending", 0) + counts.get("claimed", 0)
+        elapsed = ((job["finished_at"] or _now()) - job["started_at"]) if job["started_at"] else 0.0
+        throughput = done / elapsed * 60 if elapsed else 0.0
+        eta = remaining / throughput * 60 if throughput and job["status"] in ACTIVE_STATUSES else None
+        return {
+            "job_id": job["id"], "status": job["status"], "error": job["error"],
+            "total": sum(counts.values()), "done": done, "failed": failed, "remaining": remaining,
+            "in_progress": counts.get("claimed", 0), "enumeration_complete": bool(job["enumerated"]),
+            "active_workers": workers, "elapsed_seconds": round(elapsed, 1),
+            "throughput_per_minute": round(throughput, 2), "eta_seconds": round(eta) if eta is not None else None,
+            "created_at": _iso(job["created_at"]), "started_at": _iso(job["started_at"]),
+            "finished_at": _iso(job["finished_at"]),
+        }
+
+    def list_jobs(self, limit: int = 20) -> list:
+        with self._connect() as conn:
+            ids = [row["id"] for row in conn.execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))]
+        return [self.progress(job_id) for job_id in ids]
+
+
+# --- ENUMERATION ---
+
+async def enumerate_job(store: JobStore, job_id: str, supabase=None):
+    """
+    Copies the questions that still need an answer into the job, one page at a time. Does
+    nothing if another process holds the job's enumeration lease. Re-running an interrupted
+    enumeration is safe: items already queued are kept as they are.
+    """
+    if await asyncio.to_thread(store.claim_enumeration, job_id) is None:
+        return
+    await _enumerate(store, job_id, supabase)
+
+
+async def resume_enumerations(store: JobStore, supabase=None):
+    """Finishes enumerating every active job whose enumeration was interrupted (e.g. by a restart)."""
+    while job_id := await asyncio.to_thread(store.claim_enumeration):
+        print(f"--- 📋 Job {job_id}: resuming the interrupted enumeration. ---")
+        await _enumerate(store, job_id, supabase)
+
+
+async def _enumerate(store: JobStore, job_id: str, supabase=None):
+    try:
+        # The job's own leases replace the questionnaire claims.
+        intake = QuestionIntake(supabase or create_supabase_client(), claim=False)
+        async for page in intake.apages():
+            await asyncio.to_thread(store.add_items, job_id, page)
+        await asyncio.to_thread(store.finish_enumeration, job_id)
+        print(f"--- 📋 Job {job_id}: queued {intake.stats['yielded']} questions "
+              f"({intake.stats['already_answered']} already answered). ---")
+    except Exception as e:
+        print(f"❌ ERROR: Job {job_id}: could not read the questionnaire. Error: {e}")
+        await asyncio.to_thread(store.finish_enumeration, job_id, str(e))
+
+
+# --- WORKERS ---
+
+async def run_job_worker(store: JobStore = None, concurrency: int = None, worker_id: str = None,
+                         stop_when_idle: bool = False, supabase=None, agent_factory=None,
+                         question_timeout: float = None):
+    """
+    Pulls questions from active jobs and answers them until cancelled (or, with
+    `stop_when_idle`, until there is no work left).
+
+    Runs inside the API process (see main.py) or standalone: `python jobs.py worker`.
+    Answers are written through a BufferedAnswerWriter per job with the job's run id (the job
+    id unless the job was started with one), and an item is only marked done once its answer
+    has actually been stored. A job's `concurrency` parameter caps the slots used for it.
+    Enumerations interrupted by a restart are resumed here as well.
+    """
+    store = store or JobStore()
+    concurrency = max(1, concurrency or BATCH_AUDIT_CONCURRENCY)
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    question_timeout = question_timeout or BATCH_AUDIT_QUESTION_TIMEOUT
+    pool = None
+    writers = {}
+    stats = {"answered": 0, "cached": 0, "coalesced": 0, "failed": 0, "timed_out": 0}
+    idle_since = time.monotonic()
+
+    async def writer_for(job_id: str) -> BufferedAnswerWriter:
+        nonlocal supabase
+        if job_id not in writers:
+            supabase = supabase or create_supabase_client()
+            params = await asyncio.to_thread(store.job_params, job_id)
+            writers[job_id] = await BufferedAnswerWriter(
+                supabase, run_id=params.get("run_id") or job_id,
+                on_stored=lambda rows: store.mark_done(job_id, [row["question_id"] for row in rows]),
+            ).start()
+        return writers[job_id]
+
+    async def slot(slot_id: int):
+        while True:
+            items = await asyncio.to_thread(store.claim, f"{worker_id}/{slot_id}", 1)
+            if not items:
+                return
+            item = items[0]
+            timed_out = stats["timed_out"]
+            try:
+                response = await answer_question(pool, item["question_id"], item["question"], question_timeout, stats)
+                if response is None:
+                    error = "timed out" if stats["timed_out"] > timed_out else "agent error"
+                    await asyncio.to_thread(store.mark_failed, item["job_id"], item["question_id"], error)
+                elif not response:
+                    # Nothing to store, but the question was handled.
+                    await asyncio.to_thread(store.mark_done, item["job_id"], [item["question_id"]])
+                else:
+                    writer = await writer_for(item["job_id"])
+                    await writer.put(answer_row(item["question_id"], item["question"], response))
+            except Exception as e:
+                # One bad item must not take the worker down (and leave its lease to run out).
+                stats["failed"] += 1
+                print(f"❌ ERROR: Job {item['job_id']}, question ID {item['question_id']} failed. Error: {e}")
+                await asyncio.to_thread(store.mark_failed, item["job_id"], item["question_id"], str(e) or type(e).__name__)
+
+    async def slots_for_next_job() -> int:
+        job_id = await asyncio.to_thread(store.next_job)
+        params = await asyncio.to_thread(store.job_params, job_id) if job_id else {}
+        return max(1, min(concurrency, params.get("concurrency") or concurrency))
+
+    print(f"--- 👷 Job worker {worker_id} started (concurrency={concurrency}). ---")
+    enumerations = None
+    try:
+        while True:
+            if enumerations is None or enumerations.done():
+                enumerations = asyncio.create_task(resume_enumerations(store, supabase))
+            if await asyncio.to_thread(store.has_work):
+                if pool is None:
+                    pool = await AgentPool(agent_factory or create_clickhouse_audit_agent, size=concurrency,
+                                           name="jobs", health_check_interval=0).start()
+                await asyncio.gather(*(slot(i + 1) for i in range(await slots_for_next_job())))
+                for writer in writers.values():
+                    await writer.flush()
+                idle_since = time.monotonic()
+                continue
+            if stop_when_idle:
+                await enumerations
+                if await asyncio.to_thread(store.has_work):
+                    continue
+                return stats
+            if pool is not None and time.monotonic() - idle_since > JOBS_IDLE_SHUTDOWN:
+                await pool.close()
+                pool = None
+            await asyncio.sleep(JOBS_POLL_INTERVAL)
+    finally:
+        if enumerations is not None:
+            enumerations.cancel()
+            await asyncio.gather(enumerations, return_exceptions=True)
+        for writer in writers.values():
+            await writer.close()
+        if pool is not None:
+            await pool.close()
+        print(f"--- 👷 Job worker {worker_id} stopped: {stats} ---")
+
+
+# --- CLI ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch audit jobs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="Run a worker process that pulls from the job queue.")
+    worker.add_argument("--concurrency", type=int, default=None)
+    worker.add_argument("--once", action="store_true", help="Exit when there is no work left.")
+    commands.add_parser("submit", help="Create a job (or show the one already active).")
+    status = commands.add_parser("status", help="Show job progress.")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args()
+
+    store = JobStore()
+    if args.command == "worker":
+        asyncio.run(run_job_worker(store, concurrency=args.concurrency, stop_when_idle=args.once))
+    elif args.command == "submit":
+        job_id, created = store.create_job({"source": "cli"})
+        if created:
+            asyncio.run(enumerate_job(store, job_id))
+        print(json.dumps(store.progress(job_id), indent=2))
+    else:
+        print(json.dumps(store.progress(args.job_id) if args.job_id else store.list_jobs(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
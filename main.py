@@ -1,122 +1,358 @@
 # main.py
 
+from startup import startup_profile, preload_modules, STARTUP_MODE
 import os
-import requests
-from supabase import create_client, Client
+import time
+import asyncio
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Query, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Query, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
-from agents.clickhouse_audit_agent import create_clickhouse_audit_agent
+from agents.clickhouse_auditor import create_clickhouse_audit_agent, build_audit_prompt, PROMPT_VERSION as AUDIT_PROMPT_VERSION
+from agents.prompt_builder import apply_system_prompt
+from agents.answer_cache import answer_cache
+from agents.pool import AgentPool, AgentPoolTimeout
+from agents.cache import agent_cache
+from agents.streaming import stream_agent_run, sse
+from agents.single_flight import single_flight
+from agents.llm_router import provider_stats
+from jobs import JobStore, enumerate_job, run_job_worker, JOBS_INPROCESS_WORKER, JOBS_POLL_INTERVAL
+from snapshot_refresher import snapshot_refresher, SNAPSHOT_REFRESH_ENABLED
+from metrics import REQUEST_LATENCY, observe_agent_run, render_metrics
+from agents.assets import assets
+from connectors.tool_cache import tool_cache
+startup_profile.mark("imports")
 
 # --- CONFIGURATION (can be shared across the app) ---
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# mcp_use's anonymized telemetry makes a network call whenever an agent is initialized, which
+# is on the start-up path of every agent in the pool. Set it to "true" to opt back in.
+os.environ.setdefault("MCP_USE_ANONYMIZED_TELEMETRY", "false")
 
-# This global agent will be used by the interactive '/ask' endpoint
-interactive_agent = None
+# Size of the agent pool behind the interactive '/ask' endpoint, i.e. how many
+# questions can be answered at the same time before callers start queueing.
+ASK_AGENT_POOL_SIZE = int(os.getenv("ASK_AGENT_POOL_SIZE", "4"))
+# How long an '/ask' caller waits for a free agent before getting a 503.
+ASK_CHECKOUT_TIMEOUT = float(os.getenv("ASK_CHECKOUT_TIMEOUT", "30"))
+# STARTUP_MODE=fast: how long to wait before warming the '/ask' pool again after a failed warm-up.
+ASK_WARMUP_RETRY_INTERVAL = float(os.getenv("ASK_WARMUP_RETRY_INTERVAL", "30"))
+
+# This global pool will be used by the interactive '/ask' endpoint
+interactive_agent_pool: AgentPool = None
+# Why the last background warm-up of that pool failed (None once it is ready); see '/startup'.
+ask_pool_error: str = None
+# Batch audit jobs; see jobs.py. Extra worker processes can pull from the same store.
+job_store = JobStore()
+job_worker_task: asyncio.Task = None
+# Warm MCP sessions shared by every agent (connectors/mcp_client.py), once started.
+mcp_session_manager = None
+
+
+async def start_mcp_sessions():
+    """Starts the shared MCP session manager; imported here so that fast start-up stays light."""
+    global mcp_session_manager
+    from connectors.mcp_client import session_manager, MCP_SHARED_SESSIONS
+    if MCP_SHARED_SESSIONS:
+        await session_manager.start()
+        mcp_session_manager = session_manager
+
+def start_job_worker(delay: float = 0):
+    """Starts the in-process job worker; if it crashes, the error is logged and it is started again."""
+    global job_worker_task
+
+    async def run():
+        await asyncio.sleep(delay)
+        return await run_job_worker(job_store)
+
+    job_worker_task = asyncio.create_task(run())
+    job_worker_task.add_done_callback(_restart_job_worker)
+
+
+def _restart_job_worker(task: asyncio.Task):
+    if task.cancelled() or task.exception() is None:
+        return
+    print(f"❌ ERROR: The job worker crashed, restarting it in {JOBS_POLL_INTERVAL:.0f}s. Error: {task.exception()!r}")
+    start_job_worker(delay=JOBS_POLL_INTERVAL)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Handles startup and shutdown of the interactive agent."""
-    global interactive_agent
-    interactive_agent = create_clickhouse_audit_agent()
-    print("✅ Interactive ClickHouse Auditor Agent pre-loaded for /ask endpoint.")
+    """Handles startup and shutdown of the interactive agent pool."""
+    global interactive_agent_pool
+    interactive_agent_pool = AgentPool(create_clickhouse_audit_agent, size=ASK_AGENT_POOL_SIZE, name="ask")
+    pool_stop, pool_task = asyncio.Event(), None
+    if STARTUP_MODE == "fast":
+        # Serve right away; '/ask' waits in checkout() until the first agent is warm.
+        async def warm_in_background(delay: float = 0):
+            if delay:
+                try:
+                    await asyncio.wait_for(pool_stop.wait(), delay)
+                    return  # shutting down
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.to_thread(preload_modules)
+            startup_profile.mark("preload (background)")
+            await start_mcp_sessions()
+
+            def on_ready():
+                global ask_pool_error
+                ask_pool_error = None
+                startup_profile.mark("agent_pool (background)")
+
+            await interactive_agent_pool.serve(pool_stop, on_ready=on_ready)
+
+        def retry_warm_up(task: asyncio.Task):
+            global interactive_agent_pool, ask_pool_error
+            nonlocal pool_task
+            if task.cancelled() or task.exception() is None or pool_stop.is_set():
+                return
+            ask_pool_error = repr(task.exception())
+            print(f"❌ ERROR: Warming the '/ask' agent pool failed, retrying in {ASK_WARMUP_RETRY_INTERVAL:.0f}s. "
+                  f"Error: {ask_pool_error}")
+            # serve() closed the failed pool; new requests wait on a fresh one until a retry succeeds.
+            interactive_agent_pool = AgentPool(create_clickhouse_audit_agent, size=ASK_AGENT_POOL_SIZE, name="ask")
+            pool_task = asyncio.create_task(warm_in_background(ASK_WARMUP_RETRY_INTERVAL))
+            pool_task.add_done_callback(retry_warm_up)
+
+        pool_task = asyncio.create_task(warm_in_background())
+        pool_task.add_done_callback(retry_warm_up)
+    else:
+        await start_mcp_sessions()
+        await interactive_agent_pool.start()
+        startup_profile.mark("agent_pool")
+        print("✅ Interactive ClickHouse Auditor Agent pool pre-loaded for /ask endpoint.")
+    if SNAPSHOT_REFRESH_ENABLED:
+        await snapshot_refresher.start()
+    if JOBS_INPROCESS_WORKER:
+        start_job_worker()
+    startup_profile.mark("lifespan")
     
     yield
     
-    if hasattr(interactive_agent, "client"):
-        await interactive_agent.client.close_all_sessions()
-    print("❌ Interactive ClickHouse Auditor Agent shut down.")
+    if job_worker_task:
+        job_worker_task.cancel()
+        await asyncio.gather(job_worker_task, return_exceptions=True)
+    await snapshot_refresher.stop()
+    if pool_task:
+        pool_stop.set()
+        await asyncio.gather(pool_task, return_exceptions=True)
+    else:
+        await interactive_agent_pool.close()
+    await agent_cache.close_all()
+    if mcp_session_manager:
+        await mcp_session_manager.stop()
+    print("❌ Interactive ClickHouse Auditor Agent pool shut down.")
 
 app = FastAPI(lifespan=lifespan)
 
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Records end-to-end latency for every request, labelled by route template."""
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(request.method, getattr(route, "path", "unmatched"), status).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 # --- ENDPOINT 1: INTERACTIVE QUESTION ASKING ---
 @app.get("/ask")
 async def ask_agent(q: str = Query(..., description="Your question for the ClickHouse auditor agent")):
-    """Handles a single, interactive question to the agent."""
-    global interactive_agent
+    """Handles a single, interactive question on an agent borrowed from the pool."""
     try:
-        result = await interactive_agent.run(q)
-        print(f"Audit Result for '{q}': {result}")
-        return JSONResponse(content={"answer": result})
+        cached = await answer_cache.get(q, "clickhouse_audit", AUDIT_PROMPT_VERSION)
+        if cached is not None:
+            return JSONResponse(content={"answer": cached, "cached": True})
+
+        async def run_once():
+            async with interactive_agent_pool.checkout(timeout=ASK_CHECKOUT_TIMEOUT) as agent:
+                apply_system_prompt(agent, build_audit_prompt(q))
+                result = await observe_agent_run(agent, q, "clickhouse_audit")
+            print(f"Audit Result for '{q}': {result}")
+            await answer_cache.put(q, "clickhouse_audit", AUDIT_PROMPT_VERSION, result)
+            return result
+
+        # Identical questions already being answered join that run instead of starting another.
+        key = answer_cache.make_key(q, "clickhouse_audit", AUDIT_PROMPT_VERSION)
+        result, shared = await single_flight.do(key, "clickhouse_audit", run_once)
+        return JSONResponse(content={"answer": result, **({"coalesced": True} if shared else {})})
+    except AgentPoolTimeout:
+        return JSONResponse(content={"error": "All agents are busy, please retry shortly."}, status_code=503)
+    except asyncio.TimeoutError:
+        return JSONResponse(content={"error": "The agent timed out while answering."}, status_code=504)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+@app.get("/ask/stream")
+async def ask_agent_stream(q: str = Query(..., description="Your question for the ClickHouse auditor agent")):
+    """
+    Same as '/ask', streamed as Server-Sent Events while the agent works:
+    `start`, `waiting`, `step`, `tool_start`, `tool_result`, `token`, then `answer` (or `error`) and `done`.
+    """
+    async def events():
+        yield sse("start", {"question": q})
+        try:
+            cached = await answer_cache.get(q, "clickhouse_audit", AUDIT_PROMPT_VERSION)
+            if cached is not None:
+                yield sse("answer", {"answer": cached, "cached": True})
+                yield sse("done", {})
+                return
+
+            pool = interactive_agent_pool
+            if pool.stats()["idle"] == 0:
+                yield sse("waiting", {"message": "All agents are busy, waiting for a free one."})
+            async with pool.checkout(timeout=ASK_CHECKOUT_TIMEOUT) as agent:
+                apply_system_prompt(agent, build_audit_prompt(q))
+                async for event, data in stream_agent_run(agent, q, "clickhouse_audit"):
+                    if event == "heartbeat":
+                        yield ": heartbeat\n\n"
+                        continue
+                    if event == "error":
+                        # The run failed (e.g. on a dead session); replace the agent, as '/ask' does.
+                        pool.mark_broken(agent)
+                    yield sse(event, data)
+                    if event == "answer":
+                        print(f"Audit Result for '{q}': {data['answer']}")
+                        await answer_cache.put(q, "clickhouse_audit", AUDIT_PROMPT_VERSION, data["answer"])
+        except AgentPoolTimeout:
+            yield sse("error", {"error": "All agents are busy, please retry shortly."})
+        except asyncio.TimeoutError:
+            yield sse("error", {"error": "The agent timed out while answering."})
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+        yield sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/ask/pool")
+async def ask_pool_status():
+    """Reports how many '/ask' agents are idle, busy, and replaced, plus answer cache hit rates."""
+    return JSONResponse(content={**interactive_agent_pool.stats(), "error": ask_pool_error,
+                                 "answer_cache": answer_cache.stats(), "single_flight": single_flight.stats()})
+
+
+@app.get("/llm/providers")
+async def llm_provider_status():
+    """Rolling latency and error rate per LLM provider, as used by the router."""
+    return JSONResponse(content=provider_stats.snapshot())
+
+
+@app.get("/mcp/sessions")
+async def mcp_session_status():
+    """The shared MCP sessions per server: readiness, cached tools, calls in flight and reconnects."""
+    return JSONResponse(content=mcp_session_manager.stats() if mcp_session_manager else {"running": False})
+
+
+@app.get("/tools/cache")
+async def tool_cache_status():
+    """Hit/miss counts, size and per-tool TTLs of the MCP tool result cache."""
+    return JSONResponse(content=tool_cache.stats())
+
+
+@app.delete("/tools/cache")
+async def clear_tool_cache(tool: str = Query(None, description="Only drop this tool's results")):
+    """Drops cached tool results, e.g. after changing a view outside of processor.py."""
+    return JSONResponse(content={"dropped": tool_cache.clear(tool)})
+
+
+@app.get("/startup")
+async def startup_status():
+    """Start-up timeline (see startup.py), the '/ask' pool's readiness and the loaded assets."""
+    return JSONResponse(content={**startup_profile.snapshot(),
+                                 "ask_pool": {**interactive_agent_pool.stats(), "error": ask_pool_error},
+                                 "assets": assets.stats()})
+
+
+@app.get("/snapshots")
+async def snapshot_status():
+    """Lists the analyzer snapshots and how old each one is."""
+    return JSONResponse(content={"enabled": SNAPSHOT_REFRESH_ENABLED, "backend": snapshot_refresher.backend,
+                                 "snapshots": snapshot_refresher.stats()})
+
+
+@app.post("/snapshots/refresh")
+async def refresh_snapshots(background_tasks: BackgroundTasks):
+    """Refreshes every analyzer snapshot now, in the background."""
+    background_tasks.add_task(snapshot_refresher.refresh_all)
+    return JSONResponse(content={"message": "Snapshot refresh started in the background."})
+
+
 # --- LOGIC FOR THE NEW BATCH AUDIT ENDPOINT (from your run_audit.py script) ---
 
-def run_full_audit_process():
+async def enumerate_batch_job(job_id: str):
     """
-    This function contains the complete logic from your run_audit.py script.
-    It will be run in the background to avoid tying up the API response.
+    Copies the questions that still need an answer into the job.
+    It will be run in the background to avoid tying up the API response;
+    the job workers (see jobs.py) start answering as soon as the first page is queued.
     """
     try:
-        print("\n--- 🚀 Starting Automated Batch Auditor Run ---")
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("✅ Batch Audit: Successfully connected to Supabase.")
-        
-        # 1. Fetch Questions
-        print("  > Batch Audit: Fetching approved questions...")
-        fetch_response = supabase.table("t_auditor_questionaire").select("id, question").eq("status", "Approved").execute()
-        
-        if not fetch_response.data:
-            print("--- 🏁 Batch Audit: No questions to process. Exiting. ---")
-            return
-
-        questions_to_process = fetch_response.data
-        print(f"  > Batch Audit: Found {len(questions_to_process)} questions.")
-        
-        # Create a single agent instance to reuse for all API calls in this batch
-        batch_agent = create_clickhouse_audit_agent()
-        
-        for item in questions_to_process:
-            question_id = item.get("id")
-            question_text = item.get("question")
-            print(f"\n  > Batch Audit: Processing Question #{question_id}: '{question_text}'")
-
-            try:
-                # 2. Call the agent
-                agent_response = asyncio.run(batch_agent.run(question_text))
-                
-                # 3. Store the answer
-                if agent_response:
-                    print(f"  > Batch Audit: Storing answer for question ID {question_id}...")
-                    supabase.table("t_auditor_ques_answers").insert({
-                        "question_id": question_id,
-                        "question": question_text,
-                        "answer": {"answer": agent_response}, # Store the agent's string response in a JSON object
-                        "status": "Approved"
-                    }).execute()
-                    print(f"  > Batch Audit: Successfully stored answer for question ID {question_id}.")
-
-            except Exception as e:
-                print(f"❌ ERROR: Failed to process question ID {question_id}. Error: {e}")
-                # Optional: You could update the status in Supabase to 'Failed' here
-                continue # Move to the next question
-        
-        # Clean up the batch agent's session
-        asyncio.run(batch_agent.client.close_all_sessions())
-        print("\n--- ✅ Automated Batch Auditor Run Complete ---")
-
+        await enumerate_job(job_store, job_id)
     except Exception as e:
-        print(f"❌ FATAL ERROR during batch audit process: {e}")
+        print(f"❌ FATAL ERROR while queueing batch audit job {job_id}: {e}")
 
 
 # --- ENDPOINT 2: BATCH AUDIT TRIGGER ---
 @app.post("/run_batch_audit")
-def trigger_batch_audit(background_tasks: BackgroundTasks):
+def trigger_batch_audit(
+    background_tasks: BackgroundTasks,
+    concurrency: int = Query(None, ge=1, description="Questions processed in parallel per worker (defaults to BATCH_AUDIT_CONCURRENCY)"),
+    run_id: str = Query(None, description="Re-use an earlier run id to overwrite that run's answers instead of adding new ones")
+):
     """
-    Triggers the full, automated audit process in the background.
-    Fetches all approved questions from Supabase, runs them through the agent,
-    and stores the answers back in Supabase.
+    Starts a durable batch audit job, or returns the one already running.
+    Every approved question without an answer is queued, answered by the job workers,
+    and the answers are stored back in Supabase. Follow progress at GET /jobs/{job_id}.
+    `concurrency` and `run_id` apply to a new job; an active job keeps its own.
     """
-    print("✅ Received request to run batch audit. Starting process in the background...")
-    background_tasks.add_task(run_full_audit_process)
+    params = {"source": "api", "concurrency": concurrency, "run_id": run_id}
+    job_id, created = job_store.create_job({key: value for key, value in params.items() if value is not None})
+    if created:
+        print(f"✅ Received request to run batch audit. Created job {job_id}.")
+        background_tasks.add_task(enumerate_batch_job, job_id)
+    else:
+        print(f"✅ Received request to run batch audit. Job {job_id} is already active.")
     return JSONResponse(
-        content={"message": "Accepted. The automated audit process has been started in the background. Check server logs for progress."},
+        content={"message": "Accepted. The batch audit job is running in the background." if created
+                 else "A batch audit job is already active.",
+                 "job_id": job_id, "created": created, "progress_url": f"/jobs/{job_id}"},
         status_code=202
-    )
\ No newline at end of file
+    )
+
+
+@app.get("/jobs")
+def list_batch_jobs(limit: int = Query(20, ge=1, le=200)):
+    return JSONResponse(content={"jobs": job_store.list_jobs(limit)})
+
+
+@app.get("/jobs/{job_id}")
+def get_batch_job(job_id: str):
+    """Progress of one job: done / failed / remaining, throughput and ETA."""
+    progress = job_store.progress(job_id)
+    if progress is None:
+        return JSONResponse(content={"error": f"Unknown job '{job_id}'."}, status_code=404)
+    return JSONResponse(content=progress)
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_batch_job(job_id: str):
+    if not job_store.cancel_job(job_id):
+        return JSONResponse(content={"error": f"Job '{job_id}' is not active."}, status_code=404)
+    return JSONResponse(content=job_store.progress(job_id))
@@ -0,0 +1,184 @@
+# metrics.py
+
+import time
+import contextvars
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from langchain_core.callbacks import AsyncCallbackHandler
+
+# --- METRIC DEFINITIONS ---
+# Exposed at GET /metrics (see main.py). Agent types are the labels used with the agent cache:
+# "clickhouse", "clickhouse_audit", "auditor", "supabase".
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "End-to-end HTTP request latency.",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+AGENT_RUN_LATENCY = Histogram(
+    "agent_run_duration_seconds", "Latency of one full MCPAgent.run().",
+    ["agent_type", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_LATENCY = Histogram(
+    "llm_call_duration_seconds", "Latency of one LLM call.",
+    ["agent_type", "status"], buckets=LATENCY_BUCKETS,
+)
+TOOL_CALL_LATENCY = Histogram(
+    "mcp_tool_call_duration_seconds", "Latency of one MCP tool call.",
+    ["server", "tool", "status"], buckets=LATENCY_BUCKETS,
+)
+AGENT_STEPS = Histogram(
+    "agent_steps", "LLM steps taken by one agent run.",
+    ["agent_type"], buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 25, 30, 40, 50),
+)
+AGENT_STEP_RATIO = Histogram(
+    "agent_steps_ratio_of_max", "Steps taken by one agent run as a fraction of its max_steps.",
+    ["agent_type"], buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+AGENT_MAX_STEPS = Gauge("agent_max_steps", "Configured max_steps per agent type.", ["agent_type"])
+AGENT_STEP_LIMIT_HITS = Counter(
+    "agent_step_limit_hits_total", "Agent runs that used all of their max_steps.", ["agent_type"],
+)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used.", ["agent_type", "kind"])
+LLM_PROVIDER_LATENCY = Histogram(
+    "llm_provider_call_duration_seconds", "Latency of one call to an LLM provider behind the router.",
+    ["provider", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_ROUTER_EVENTS = Counter(
+    "llm_router_events_total", "LLM router decisions: 'hedge', 'failover' and 'won_by_<provider>' after a hedge.",
+    ["agent_type", "event"],
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "single_flight_calls_total",
+    "Agent runs requested through single-flight, by outcome: 'executed' started a run, 'coalesced' joined one.",
+    ["agent_type", "outcome"],
+)
+SINGLE_FLIGHT_IN_FLIGHT = Gauge("single_flight_in_flight", "Distinct agent runs currently in flight.", ["agent_type"])
+MCP_SESSION_EVENTS = Counter(
+    "mcp_session_events_total",
+    "Shared MCP session events: 'connect', 'reconnect', 'heartbeat_failure' and 'retry' of a call on a new session.",
+    ["server", "event"],
+)
+MCP_SESSION_IN_FLIGHT = Gauge("mcp_session_in_flight", "MCP calls currently running on the shared sessions.", ["server"])
+TOOL_CACHE_EVENTS = Counter(
+    "mcp_tool_cache_events_total",
+    "MCP tool result cache: 'hit', 'miss', 'evict', and 'invalidate' when the manifest is re-synced.",
+    ["tool", "event"],
+)
+LLM_TOOL_CALLS_PER_TURN = Histogram(
+    "llm_tool_calls_per_turn", "Tool calls requested by one LLM response; they run concurrently.",
+    ["agent_type"], buckets=(0, 1, 2, 3, 4, 6, 8, 12),
+)
+QUERY_GUARD_DECISIONS = Counter(
+    "query_guard_decisions_total",
+    "Agent SELECTs by query guard decision: 'allowed', 'limited' (LIMIT added), 'sampled', 'rejected', 'unestimated' (EXPLAIN ESTIMATE unavailable), 'template' (manifest SQL template, not limited).",
+    ["decision"],
+)
+QUERY_GUARD_ESTIMATED_ROWS = Histogram(
+    "query_guard_estimated_rows", "Rows an agent SELECT would read, according to EXPLAIN ESTIMATE.",
+    buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8, 1e9, 1e10),
+)
+TOOL_CACHE_BYTES = Gauge("mcp_tool_cache_bytes", "Characters of tool result text held by the tool cache.")
+
+# Steps of the agent run in progress in the current task (see observe_agent_run).
+_current_run = contextvars.ContextVar("current_agent_run", default=None)
+
+
+class MetricsCallbackHandler(AsyncCallbackHandler):
+    """
+    LangChain callback attached to every agent LLM: records per-call latency, prompt and
+    completion tokens, and counts the steps of the enclosing agent run.
+    """
+
+    def __init__(self, agent_type: str):
+        self.agent_type = agent_type
+        self._started = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+        run = _current_run.get()
+        if run is not None:
+            run["steps"] += 1
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        self._observe(run_id, "ok")
+        prompt_tokens, completion_tokens = _token_usage(response)
+        LLM_TOKENS.labels(self.agent_type, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(self.agent_type, "completion").inc(completion_tokens)
+        for generations in response.generations:
+            for generation in generations[:1]:
+                LLM_TOOL_CALLS_PER_TURN.labels(self.agent_type).observe(
+                    len(getattr(getattr(generation, "message", None), "tool_calls", None) or []))
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._observe(run_id, "error")
+
+    def _observe(self, run_id, status: str):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            LLM_CALL_LATENCY.labels(self.agent_type, status).observe(time.perf_counter() - started)
+
+
+def _token_usage(response) -> tuple:
+    """(prompt, completion) tokens from an LLMResult, whichever way the provider reports them."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not (prompt_tokens or completion_tokens):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+async def observe_agent_run(agent, query: str, agent_type: str):
+    """Runs `agent.run(query)` and records its latency and step count against max_steps."""
+    run = {"steps": 0}
+    token = _current_run.set(run)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        result = await agent.run(query)
+        status = "ok"
+        return result
+    finally:
+        _current_run.reset(token)
+        record_agent_run(agent, agent_type, status, time.perf_counter() - started, run["steps"])
+
+
+def record_agent_run(agent, agent_type: str, status: str, elapsed: float, steps: int):
+    """Records one finished agent run: latency, steps, and steps against the agent's max_steps."""
+    AGENT_RUN_LATENCY.labels(agent_type, status).observe(elapsed)
+    AGENT_STEPS.labels(agent_type).observe(steps)
+    max_steps = getattr(agent, "max_steps", None)
+    if max_steps:
+        AGENT_MAX_STEPS.labels(agent_type).set(max_steps)
+        AGENT_STEP_RATIO.labels(agent_type).observe(min(steps / max_steps, 1.0))
+        if steps >= max_steps:
+            AGENT_STEP_LIMIT_HITS.labels(agent_type).inc()
+
+
+async def record_tool_metrics(server_name, tool_name, arguments, call_next):
+    """Tool middleware: times every MCP tool call, labelled by server and tool name."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        result = await call_next(tool_name, arguments)
+        status = "tool_error" if getattr(result, "isError", False) else "ok"
+        return result
+    finally:
+        TOOL_CALL_LATENCY.labels(server_name, tool_name, status).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """Returns (body, content type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
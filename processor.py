@@ -1,13 +1,18 @@
 import os
 import json
+import hashlib
+import tempfile
 import traceback
 import clickhouse_connect
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def create_clickhouse_client():
-    """Reads connection details from environment variables and creates a ClickHouse client."""
+def create_clickhouse_client(**client_options):
+    """
+    Reads connection details from environment variables and creates a ClickHouse client.
+    Any keyword arguments (e.g. `autogenerate_session_id=False`) are passed to `clickhouse_connect.get_client`.
+    """
     config = {
         "host": os.getenv("CLICKHOUSE_HOST"),
         "port": int(os.getenv("CLICKHOUSE_PORT", "8123")),
@@ -20,76 +25,169 @@ def create_clickhouse_client():
         raise ValueError("Error: Missing essential ClickHouse environment variables.")
     
     print(f"Connecting to host: {config['host']}:{config['port']}...")
-    client = clickhouse_connect.get_client(**config)
+    client = clickhouse_connect.get_client(**config, **client_options)
     client.ping()
     print("Successfully connected to ClickHouse.")
     return client
 
+SYNC_STATE_FILENAME = "analysis_manifest.sync.json"
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def _write_atomic(path, content):
+    """Writes through a temp file in the same directory and renames it over `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        # mkstemp creates 0600 files; keep the mode of the file being replaced (0644 for a new one)
+        # so other users, like the MCP server, can still read it.
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777 if os.path.exists(path) else 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def sync_manifest_and_sql_files(
+    manifest_filename="analysis_manifest.json",
+    sql_directory="mortgage_sql_queries",
+    state_filename=SYNC_STATE_FILENAME,
+):
+    """
+    Incrementally syncs the JSON manifest and the .sql library with ClickHouse.
+
+    Each catalog row and the definition of the view it documents are hashed; only entries whose
+    hashes differ from the previous sync (kept in `state_filename`) are rewritten. Every write goes
+    through a temp file and a rename. A .sql file that an earlier sync generated and the catalog no
+    longer references is removed, unless it was edited since; other files in the directory
+    (hand-written templates) are never touched.
+
+    Returns:
+        dict: The change report (added / changed / removed / unchanged view names, SQL files
+        written, removed and kept because they were edited, and whether the manifest itself was rewritten).
+    """
+    client = create_clickhouse_client()
+    result = client.query("SELECT * FROM default.view_metadata_catalog;")
+    docs_from_db = [dict(zip(result.column_names, row)) for row in result.result_rows]
+    if not docs_from_db:
+        # An empty catalog is treated as an error rather than a reason to delete the whole library.
+        raise ValueError("No documentation was found in 'default.view_metadata_catalog'; nothing was changed.")
+
+    view_names = [doc.get("view_name") for doc in docs_from_db if doc.get("view_name")]
+    definitions = client.query(
+        "SELECT name, create_table_query FROM system.tables WHERE database = 'default' AND name IN {views:Array(String)}",
+        parameters={"views": view_names},
+    )
+    definition_by_view = dict(definitions.result_rows)
+
+    previous_state = _load_json(state_filename, {})
+    state = {}
+    report = {"added": [], "changed": [], "removed": [], "unchanged": [],
+              "sql_written": [], "sql_removed": [], "sql_kept": [], "manifest_rewritten": False}
+
+    # --- ACTION 1: Diff the catalog against the previous sync ---
+    for doc_item in docs_from_db:
+        view_name = doc_item.get("view_name")
+        state[view_name] = {
+            "entry_hash": _hash(doc_item),
+            "definition_hash": _hash(definition_by_view.get(view_name)),
+            "sql_template_path": doc_item.get("sql_template_path"),
+        }
+        if view_name not in previous_state:
+            report["added"].append(view_name)
+        elif state[view_name] != previous_state[view_name]:
+            report["changed"].append(view_name)
+        else:
+            report["unchanged"].append(view_name)
+    report["removed"] = sorted(set(previous_state) - set(state))
+
+    # --- ACTION 2: Rewrite the manifest only if its content changed ---
+    manifest_content = json.dumps(docs_from_db, indent=4, default=str)
+    if _load_json(manifest_filename, None) != json.loads(manifest_content):
+        _write_atomic(manifest_filename, manifest_content)
+        report["manifest_rewritten"] = True
+
+    # --- ACTION 3: Write changed .sql files, remove orphans ---
+    os.makedirs(sql_directory, exist_ok=True)
+    expected_files = set()
+    for doc_item in docs_from_db:
+        file_name = doc_item.get("sql_template_path")
+        view_name = doc_item.get("view_name")
+        if not (file_name and view_name):
+            continue
+        expected_files.add(file_name)
+        file_path = os.path.join(sql_directory, file_name)
+        # The content is the simple, direct query to the specific view
+        file_content = f"SELECT * FROM default.{view_name};"
+        try:
+            with open(file_path, 'r') as f:
+                if f.read() == file_content:
+                    continue
+        except OSError:
+            pass
+        _write_atomic(file_path, file_content)
+        report["sql_written"].append(file_name)
+
+    # Only files generated by an earlier sync are candidates, and only while they still hold the generated query.
+    generated = {entry.get("sql_template_path"): view_name for view_name, entry in previous_state.items()}
+    for file_name, view_name in sorted(generated.items(), key=lambda item: str(item[0])):
+        if not file_name or file_name in expected_files:
+            continue
+        file_path = os.path.join(sql_directory, file_name)
+        try:
+            with open(file_path, 'r') as f:
+                untouched = f.read() == f"SELECT * FROM default.{view_name};"
+        except OSError:
+            continue
+        if untouched:
+            os.remove(file_path)
+            report["sql_removed"].append(file_name)
+        else:
+            report["sql_kept"].append(file_name)
+
+    # The state is written last; running agents reload the manifest when it or this file changes.
+    _write_atomic(state_filename, json.dumps(state, indent=4, sort_keys=True))
+
+    print(f"\nManifest sync: {len(report['added'])} added, {len(report['changed'])} changed, "
+          f"{len(report['removed'])} removed, {len(report['unchanged'])} unchanged.")
+    for key in ("added", "changed", "removed", "sql_written", "sql_removed", "sql_kept"):
+        if report[key]:
+            print(f"  - {key}: {', '.join(report[key])}")
+    return report
+
+
 def generate_json_manifest_and_sql_files(
     manifest_filename="analysis_manifest.json",
     sql_directory="mortgage_sql_queries"
 ):
     """
     A DUAL-ACTION script:
-    1. Reads the analysis documentation from ClickHouse and generates a JSON manifest.
-    2. Dynamically creates a directory and populates it with the corresponding .sql files.
+    1. Reads the analysis documentation from ClickHouse and syncs the JSON manifest.
+    2. Syncs the directory of corresponding .sql files.
+    Only what changed since the last run is rewritten (see `sync_manifest_and_sql_files`).
     """
-    client = None
     try:
-        client = create_clickhouse_client()
-        
-        # Query our documentation table, focusing on the mortgage dataset
-        query = "SELECT * FROM default.view_metadata_catalog;"
-        
-        print("\nExecuting query to fetch analysis documentation for mortgage dataset...")
-        result = client.query(query)
-        
-        if result.result_rows:
-            docs_from_db = [dict(zip(result.column_names, row)) for row in result.result_rows]
-            
-            # --- ACTION 1: Generate the JSON Manifest ---
-            print(f"\nFound {len(docs_from_db)} documented views. Generating JSON manifest...")
-            final_manifest = docs_from_db
-            
-            with open(manifest_filename, 'w') as f:
-                json.dump(final_manifest, f, indent=4)
-            
-            print(f"  - Success! Agent manifest saved to: {os.path.abspath(manifest_filename)}")
-            # ---------------------------------------------
-            
-            # --- ACTION 2: Generate the SQL Files ---
-            print(f"\nNow generating the '{sql_directory}' library...")
-            
-            # Ensure the target directory exists, creating it if it doesn't
-            os.makedirs(sql_directory, exist_ok=True)
-            
-            files_created = 0
-            for doc_item in docs_from_db:
-                file_name = doc_item.get("sql_template_path")
-                view_name = doc_item.get("view_name")
-                
-                if file_name and view_name:
-                    file_path = os.path.join(sql_directory, file_name)
-                    # The content is the simple, direct query to the specific view
-                    file_content = f"SELECT * FROM default.{view_name};"
-                    
-                    with open(file_path, 'w') as f:
-                        f.write(file_content)
-                    files_created += 1
-            
-            print(f"  - Success! Created {files_created} .sql files in: {os.path.abspath(sql_directory)}")
-            # -----------------------------------------
-            
-        else:
-            print("No documentation was found in the 'analysis_view_documentation' table for the mortgage dataset.")
-
+        return sync_manifest_and_sql_files(manifest_filename, sql_directory)
     except Exception as e:
         print("\n--- An error occurred during processing ---")
         print(traceback.format_exc())
-        
+        return None
     finally:
-        if client:
-            print("\nProcessing complete.")
+        print("\nProcessing complete.")
 
 if __name__ == "__main__":
     generate_json_manifest_and_sql_files()
\ No newline at end of file
@@ -1,10 +1,17 @@
 # run_audit.py
 
 import os
+import time
+import random
+import asyncio
+import argparse
+import httpx
 import requests
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import json
+from connectors.answer_writer import BufferedAnswerWriter
+from connectors.question_intake import QuestionIntake
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -12,6 +19,14 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 AGENT_API_ENDPOINT = os.getenv("AGENT_API_ENDPOINT")
+# Questions in flight at once in concurrent mode (--concurrency overrides it; 1 = the sequential loop).
+RUN_AUDIT_CONCURRENCY = int(os.getenv("RUN_AUDIT_CONCURRENCY", "4"))
+# Per-request timeout in seconds; complex questions can take minutes.
+RUN_AUDIT_TIMEOUT = float(os.getenv("RUN_AUDIT_TIMEOUT", "300"))
+# Retries on timeouts, connection errors and 429/5xx (e.g. a 503 while the agent pool is busy).
+RUN_AUDIT_MAX_RETRIES = int(os.getenv("RUN_AUDIT_MAX_RETRIES", "3"))
+RUN_AUDIT_BACKOFF_BASE = float(os.getenv("RUN_AUDIT_BACKOFF_BASE", "1.0"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 # --- DATABASE CLIENT INITIALIZATION ---
 try:
@@ -21,22 +36,29 @@ except Exception as e:
     print(f"❌ ERROR: Could not connect to Supabase. Check your .env file. Error: {e}")
     exit()
 
+# Answers are buffered and written in multi-row batches (upserts keyed by (question_id, run_id) in "upsert" mode).
+answer_writer = BufferedAnswerWriter(supabase)
+# Questions are streamed page by page; answered ones are skipped, the rest are claimed.
+# Pages are small because this script answers them one at a time while their lease runs.
+question_intake = QuestionIntake(supabase, page_size=10)
+# One keep-alive session for the sequential loop instead of a new connection per question.
+http_session = requests.Session()
+
 
 def fetch_approved_questions():
-    """Fetches all questions with 'Approved' status from the questionnaire table."""
+    """
+    Yields approved questions that still need an answer, one page at a time (keyset
+    pagination on id). Already-answered questions are skipped and the rest are claimed
+    so that concurrent runs never process the same question.
+    """
+    print("\nFetching approved questions from Supabase...")
     try:
-        print("\nFetching approved questions from Supabase...")
-        response = supabase.table("t_auditor_questionaire").select("id, question").eq("status", "Approved").execute()
-        
-        if response.data:
-            print(f"  > Found {len(response.data)} approved questions.")
-            return response.data
-        else:
-            print("  > No approved questions found.")
-            return []
+        for page in question_intake.pages():
+            print(f"  > Claimed {len(page)} questions.")
+            yield from page
     except Exception as e:
         print(f"❌ ERROR: Failed to fetch questions from Supabase. Error: {e}")
-        return []
+    print(f"  > Intake summary: {question_intake.stats}")
 
 def call_agent_api(question: str):
     """Sends a single question to the agent's API endpoint and returns the JSON response."""
@@ -48,7 +70,7 @@ def call_agent_api(question: str):
     try:
         # The 'q' parameter must match what your FastAPI endpoint expects
         params = {"q": question}
-        response = requests.get(AGENT_API_ENDPOINT, params=params, timeout=300) # 5-minute timeout for complex queries
+        response = http_session.get(AGENT_API_ENDPOINT, params=params, timeout=RUN_AUDIT_TIMEOUT)
         
         response.raise_for_status()  # This will raise an exception for 4xx or 5xx status codes
         
@@ -60,41 +82,137 @@ def call_agent_api(question: str):
         return None
 
 def store_answer(question_id: int, question_text: str, answer_json: dict):
-    """Stores the agent's JSON response in the answers table."""
-    try:
-        print(f"  > Storing answer for question ID: {question_id}...")
-        
-        # We create a new record in the answers table
-        data_to_insert = {
-            "question_id": question_id,
-            "question": question_text,
-            "answer": answer_json, # The 'answer' column is of type JSONB
-            "status": "Approved" # Or you could set a 'Completed' status
-        }
-        
-        response = supabase.table("t_auditor_ques_answers").insert(data_to_insert).execute()
-        
-        if len(response.data) > 0:
-            print("  > Successfully stored the answer in Supabase.")
-        else:
-            print("  > FAILED to store the answer. Response from Supabase was empty.")
-            # You might want to inspect response.error here if it exists
+    """Queues the agent's JSON response for the answers table (written in batches by answer_writer)."""
+    print(f"  > Queueing answer for question ID: {question_id}...")
+    answer_writer.write({
+        "question_id": question_id,
+        "question": question_text,
+        "answer": answer_json, # The 'answer' column is of type JSONB
+        "status": "Approved" # Or you could set a 'Completed' status
+    })
 
-    except Exception as e:
-        print(f"❌ ERROR: Could not store answer in Supabase. Error: {e}")
+
+# --- CONCURRENT CLIENT MODE ---
+
+def latency_summary(latencies: list, elapsed: float, stats: dict) -> dict:
+    """Throughput and p50/p90/p95/p99 latency of the successful calls."""
+    ordered = sorted(latencies)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2) if ordered else None
+
+    return {**stats, "elapsed_seconds": round(elapsed, 1),
+            "questions_per_minute": round(stats["answered"] / elapsed * 60, 1) if elapsed else 0.0,
+            "p50_s": pick(0.5), "p90_s": pick(0.9), "p95_s": pick(0.95), "p99_s": pick(0.99),
+            "max_s": round(ordered[-1], 2) if ordered else None}
+
+
+async def call_agent_api_async(client: httpx.AsyncClient, question: str, stats: dict):
+    """
+    Async counterpart of call_agent_api on a shared, keep-alive client. Timeouts, connection
+    errors and 429/5xx responses are retried with exponential backoff and jitter.
+    """
+    for attempt in range(RUN_AUDIT_MAX_RETRIES + 1):
+        try:
+            response = await client.get(AGENT_API_ENDPOINT, params={"q": question})
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response.json()
+            error = f"HTTP {response.status_code}"
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            error = f"{type(e).__name__}: {e}"
+        except (httpx.HTTPStatusError, ValueError) as e:
+            print(f"❌ ERROR: Failed to call the agent API. Error: {e}")
+            return None
+
+        if attempt == RUN_AUDIT_MAX_RETRIES:
+            print(f"❌ ERROR: Agent API still failing after {attempt + 1} attempts. Error: {error}")
+            return None
+        delay = RUN_AUDIT_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+        stats["retries"] += 1
+        print(f"  > Agent API call failed ({error}), retrying in {delay:.1f}s...")
+        await asyncio.sleep(delay)
+
+
+async def run_concurrent(concurrency: int) -> dict:
+    """
+    Keeps `concurrency` questions in flight against the agent service over one pooled
+    connection set, while the next page of questions is fetched in the background.
+    """
+    stats = {"answered": 0, "failed": 0, "retries": 0}
+    latencies = []
+    question_queue = asyncio.Queue(maxsize=concurrency * 2)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    await answer_writer.start()
+
+    async def feed():
+        try:
+            async for page in question_intake.apages():
+                print(f"  > Claimed {len(page)} questions.")
+                for item in page:
+                    await question_queue.put(item)
+        except Exception as e:
+            print(f"❌ ERROR: Failed to fetch questions from Supabase. Error: {e}")
+        finally:
+            for _ in range(concurrency):
+                await question_queue.put(None)
+
+    async def worker(client: httpx.AsyncClient):
+        while (item := await question_queue.get()) is not None:
+            question_id, question_text = item.get("id"), item.get("question")
+            if not question_id or not question_text:
+                print("  > Skipping malformed question item from database.")
+                continue
+            print(f"\nProcessing Question #{question_id}: '{question_text[:50]}...'")
+            started = time.perf_counter()
+            agent_response = await call_agent_api_async(client, question_text, stats)
+            if agent_response:
+                latencies.append(time.perf_counter() - started)
+                stats["answered"] += 1
+                await answer_writer.put({
+                    "question_id": question_id,
+                    "question": question_text,
+                    "answer": agent_response,
+                    "status": "Approved"
+                })
+            else:
+                stats["failed"] += 1
+                await question_intake.arelease(question_id)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=RUN_AUDIT_TIMEOUT, limits=limits) as client:
+        await asyncio.gather(feed(), *(worker(client) for _ in range(concurrency)))
+    await answer_writer.close()
+    return latency_summary(latencies, time.perf_counter() - started, stats)
 
 
 def main():
     """Main orchestration function."""
-    print("\n--- 🚀 Starting Automated Auditor Run ---")
-    
-    questions_to_process = fetch_approved_questions()
-    
-    if not questions_to_process:
-        print("\n--- 🏁 No questions to process. Exiting. ---")
+    parser = argparse.ArgumentParser(description="Answer every open audit question through the agent API.")
+    parser.add_argument("--concurrency", type=int, default=RUN_AUDIT_CONCURRENCY,
+                        help="Questions in flight at once (1 = sequential).")
+    args = parser.parse_args()
+
+    if not AGENT_API_ENDPOINT:
+        print("❌ ERROR: AGENT_API_ENDPOINT is not set in the .env file.")
         return
+    if args.concurrency > 1:
+        print(f"\n--- 🚀 Starting Automated Auditor Run (run {answer_writer.run_id}, concurrency={args.concurrency}) ---")
+        # Pages are fetched ahead of the workers, so make each one cover a couple of rounds.
+        question_intake.page_size = max(question_intake.page_size, args.concurrency * 2)
+        summary = asyncio.run(run_concurrent(args.concurrency))
+        print(f"  > Intake summary: {question_intake.stats}")
+        print(f"\n--- ✅ Automated Auditor Run Complete: {json.dumps(summary)} ---")
+        return
+    run_sequential()
+
 
-    for item in questions_to_process:
+def run_sequential():
+    """The original one-question-at-a-time loop."""
+    print(f"\n--- 🚀 Starting Automated Auditor Run (run {answer_writer.run_id}) ---")
+    answer_writer.replay_spilled()
+    
+    for item in fetch_approved_questions():
         question_id = item.get("id")
         question_text = item.get("question")
         
@@ -110,7 +228,12 @@ def main():
         # Store the result if the API call was successful
         if agent_response:
             store_answer(question_id, question_text, agent_response)
-            
+        else:
+            # Give the question back so the next run retries it instead of waiting out the lease.
+            question_intake.release(question_id)
+
+    # Flush whatever is still buffered before exiting.
+    answer_writer.close_sync()
     print("\n--- ✅ Automated Auditor Run Complete ---")
 
 
@@ -0,0 +1,199 @@
+# snapshot_refresher.py
+
+import os
+import re
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+from connectors.clickhouse import run_command, run_query, run_raw_query
+from agents.manifest import manifest_store
+
+# --- CONFIGURATION ---
+SNAPSHOT_REFRESH_ENABLED = os.getenv("SNAPSHOT_REFRESH_ENABLED", "false").lower() == "true"
+# "clickhouse" materializes each analyzer into a snapshot table, "parquet" into a local file.
+SNAPSHOT_BACKEND = os.getenv("SNAPSHOT_BACKEND", "clickhouse")
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "900"))
+# A snapshot older than this is ignored and the live view is queried instead.
+SNAPSHOT_MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS", str(2 * SNAPSHOT_REFRESH_INTERVAL)))
+SNAPSHOT_DATABASE = os.getenv("SNAPSHOT_DATABASE", "default")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_LOG_TABLE = f"{SNAPSHOT_DATABASE}.analyzer_snapshot_log"
+
+def snapshot_table_name(view_name: str) -> str:
+    return f"{SNAPSHOT_DATABASE}.snapshot_{view_name}"
+
+
+class SnapshotRefresher:
+    """
+    Periodically materializes every analyzer view listed in analysis_manifest.json.
+
+    The `*_analyzer_mortgage_events` views are recomputed from the full event log on every
+    query. The refresher runs each one once per SNAPSHOT_REFRESH_INTERVAL into a snapshot table
+    (CREATE OR REPLACE TABLE ... AS SELECT, swapped atomically) or a local Parquet file, and
+    records when it did so, in `analyzer_snapshot_log` or next to the Parquet file. Readers call
+    `get_snapshot(view_name)` and fall back to the live view when no fresh snapshot exists.
+    """
+
+    def __init__(self, backend: str = SNAPSHOT_BACKEND, interval: float = SNAPSHOT_REFRESH_INTERVAL,
+                 max_staleness: float = SNAPSHOT_MAX_STALENESS):
+        self.backend = backend
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.snapshots = {}  # view_name -> {"location", "refreshed_at", "row_count", "duration_ms"}
+        self._task = None
+
+    # --- SCHEDULER ---
+
+    async def start(self):
+        if self._task is None:
+            await self._load_state()
+            self._task = asyncio.create_task(self._loop())
+            print(f"--- 📸 Snapshot refresher started ({self.backend}, every {self.interval:.0f}s) ---")
+
+    async def stop(self):
+        if self._task:
+            task, self._task = self._task, None
+            task.cancel()
+            # Wait for a refresh in progress to unwind before the app closes its connections.
+            await asyncio.gather(task, return_exceptions=True)
+            print("--- 📸 Snapshot refresher stopped. ---")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                print(f"❌ ERROR: Snapshot refresh cycle failed. Error: {e}")
+            await asyncio.sleep(self.interval)
+
+    # --- REFRESH ---
+
+    async def refresh_all(self):
+        """Refreshes every analyzer in the manifest, one after another to keep cluster load flat."""
+        for entry in manifest_store.get():
+            view_name = entry.get("view_name")
+            if not view_name or not re.fullmatch(r"[A-Za-z0-9_]+", view_name):
+                continue
+            try:
+                await self.refresh_one(view_name)
+            except Exception as e:
+                print(f"❌ ERROR: Could not snapshot '{view_name}'. Error: {e}")
+
+    async def refresh_one(self, view_name: str):
+        start = time.perf_counter()
+        source = f"SELECT * FROM default.{view_name}"
+        if self.backend == "parquet":
+            location = os.path.join(SNAPSHOT_DIR, f"{view_name}.parquet")
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            data = await run_raw_query(source, fmt="Parquet")
+            temp_path = location + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, location)
+            row_count = None
+        else:
+            location = snapshot_table_name(view_name)
+            await run_command(f"CREATE OR REPLACE TABLE {location} ENGINE = MergeTree ORDER BY tuple() AS {source}")
+            row_count = (await run_query(f"SELECT count() FROM {location}")).result_rows[0][0]
+
+        info = {
+            "location": location,
+            "refreshed_at": time.time(),
+            "row_count": row_count,
+            "duration_ms": int((time.perf_counter() - start) * 1000),
+        }
+        self.snapshots[view_name] = info
+        await self._record(view_name, info)
+        print(f"  > Snapshot: refreshed '{view_name}' -> {location} in {info['duration_ms']} ms.")
+        return info
+
+    # --- STATE ---
+
+    async def _record(self, view_name: str, info: dict):
+        if self.backend == "parquet":
+            path = info["location"] + ".json"
+            with open(path + ".tmp", 'w') as f:
+                json.dump(info, f)
+            os.replace(path + ".tmp", path)  # _load_state never reads a half-written file
+            return
+        await run_command(
+            f"CREATE TABLE IF NOT EXISTS {SNAPSHOT_LOG_TABLE} (view_name String, snapshot_table String, "
+            f"refreshed_at DateTime64(3), row_count UInt64, duration_ms UInt64) ENGINE = MergeTree ORDER BY (view_name, refreshed_at)"
+        )
+        await run_command(
+            f"INSERT INTO {SNAPSHOT_LOG_TABLE} VALUES ({{view:String}}, {{table:String}}, "
+            f"{{ts:DateTime64(3)}}, {{rows:UInt64}}, {{ms:UInt64}})",
+            parameters={"view": view_name, "table": info["location"],
+                        "ts": datetime.fromtimestamp(info["refreshed_at"], tz=timezone.utc),
+                        "rows": info["row_count"] or 0, "ms": info["duration_ms"]},
+        )
+
+    async def _load_state(self):
+        """Picks up snapshots taken before a restart so they can be served immediately."""
+        try:
+            if self.backend == "parquet":
+                for file_name in os.listdir(SNAPSHOT_DIR) if os.path.isdir(SNAPSHOT_DIR) else []:
+                    if file_name.endswith(".parquet.json"):
+                        with open(os.path.join(SNAPSHOT_DIR, file_name), 'r') as f:
+                            info = json.load(f)
+                        self.snapshots[file_name[:-len(".parquet.json")]] = info
+            else:
+                result = await run_query(
+                    f"SELECT view_name, argMax(snapshot_table, refreshed_at), toFloat64(max(refreshed_at)), "
+                    f"argMax(row_count, refreshed_at) FROM {SNAPSHOT_LOG_TABLE} GROUP BY view_name"
+                )
+                for view_name, location, refreshed_at, row_count in result.result_rows:
+                    self.snapshots[view_name] = {"location": location, "refreshed_at": refreshed_at,
+                                                 "row_count": row_count, "duration_ms": None}
+        except Exception as e:
+            print(f"  > Snapshot: no previous snapshot state loaded ({e}).")
+
+    def invalidate(self, entries: list, changes: dict):
+        """Manifest listener: snapshots of changed or removed views are no longer served."""
+        for view_name in changes["changed"] + changes["removed"]:
+            if self.snapshots.pop(view_name, None):
+                print(f"  > Snapshot: '{view_name}' changed in the manifest, serving the live view until the next refresh.")
+
+    def get_snapshot(self, view_name: str):
+        """Returns the snapshot info for a view if it exists and is fresh enough, else None."""
+        manifest_store.get()  # drops snapshots of views that a manifest re-sync changed
+        info = self.snapshots.get(view_name)
+        if info and time.time() - info["refreshed_at"] <= self.max_staleness:
+            return {**info, "backend": self.backend}
+        return None
+
+    def stats(self) -> dict:
+        return {view: {**info, "age_seconds": round(time.time() - info["refreshed_at"], 1)}
+                for view, info in self.snapshots.items()}
+
+
+def read_parquet_snapshot(path: str):
+    """Reads a Parquet snapshot into (column_names, columns). Needs the optional `pyarrow` package."""
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    return list(table.column_names), [table.column(name).to_pylist() for name in table.column_names]
+
+
+# The refresher shared by the service, the fast path and the tool middleware.
+snapshot_refresher = SnapshotRefresher()
+manifest_store.on_change(snapshot_refresher.invalidate)
+
+
+async def redirect_to_snapshot(server_name, tool_name, arguments, call_next):
+    """
+    Tool middleware: a plain `SELECT * FROM default.<analyzer view>` issued by an agent (the
+    shape of every manifest SQL template) is answered from the view's fresh snapshot table.
+    """
+    if tool_name == "run_select_query" and snapshot_refresher.backend == "clickhouse":
+        query = str(arguments.get("query", ""))
+        match = re.fullmatch(r"\s*SELECT\s+\*\s+FROM\s+default\.([A-Za-z0-9_]+)\s*;?\s*", query, flags=re.IGNORECASE)
+        snapshot = snapshot_refresher.get_snapshot(match.group(1)) if match else None
+        if snapshot:
+            arguments = {**arguments, "query": f"SELECT * FROM {snapshot['location']}"}
+    return await call_next(tool_name, arguments)
+
+
+if __name__ == "__main__":
+    # One-off refresh of every analyzer snapshot, e.g. from cron.
+    asyncio.run(snapshot_refresher.refresh_all())
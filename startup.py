@@ -0,0 +1,52 @@
+# startup.py
+
+import os
+import sys
+import time
+
+# "eager": build and warm the '/ask' agent pool before the first request is accepted.
+# "fast":  accept requests immediately and warm the pool in the background; provider SDKs and
+#          mcp_use are only imported when the first agent is built. '/ask' callers that arrive
+#          before an agent is ready wait for it (up to ASK_CHECKOUT_TIMEOUT).
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager").lower()
+# In "fast" mode these are imported in a worker thread before the first agent is built, so the
+# event loop keeps serving while the SDKs load.
+STARTUP_PRELOAD_MODULES = [m.strip() for m in os.getenv(
+    "STARTUP_PRELOAD_MODULES", "mcp_use,connectors.mcp_client,langchain_google_genai,langchain_openai").split(",") if m.strip()]
+
+
+class StartupProfile:
+    """
+    Timeline of process start-up: each `mark(phase)` records the seconds since the previous
+    mark and since this module was imported, and how many modules were loaded by then.
+    Served at GET /startup.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        entry = {"phase": phase, "seconds": round(now - self._last, 3),
+                 "since_start": round(now - self.started, 3), "modules_loaded": len(sys.modules)}
+        self.phases.append(entry)
+        self._last = now
+        print(f"--- ⏱️ Startup: {phase} took {entry['seconds']:.2f}s ({entry['since_start']:.2f}s since start). ---")
+
+    def snapshot(self) -> dict:
+        return {"mode": STARTUP_MODE, "phases": self.phases}
+
+
+def preload_modules(names: list = None):
+    """Imports the given modules, skipping any that are not installed."""
+    import importlib
+    for name in STARTUP_PRELOAD_MODULES if names is None else names:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"  > Startup: could not preload '{name}': {e}")
+
+
+startup_profile = StartupProfile()
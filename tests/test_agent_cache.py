@@ -0,0 +1,76 @@
+# tests/test_agent_cache.py
+
+import asyncio
+import anyio
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import ErrorData, CONNECTION_CLOSED
+from agents.cache import AgentCache, is_session_error
+
+
+class FakeClient:
+    def get_all_active_sessions(self):
+        return {}
+
+    async def close_all_sessions(self):
+        pass
+
+
+class FailingAgent:
+    """Fails its first run with `error`, then answers."""
+    runs = 0
+
+    def __init__(self, error):
+        self.error = error
+        self.client = FakeClient()
+        self.max_steps = 5
+
+    async def initialize(self):
+        pass
+
+    async def run(self, query):
+        FailingAgent.runs += 1
+        if FailingAgent.runs == 1:
+            raise self.error
+        return "answer"
+
+
+def run_once(error):
+    FailingAgent.runs = 0
+
+    async def scenario():
+        cache = AgentCache(pool_size=1)
+        try:
+            return await cache.run("test", lambda: FailingAgent(error), "question")
+        finally:
+            await cache.close_all()
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("error", [
+    anyio.ClosedResourceError(),
+    McpError(ErrorData(code=CONNECTION_CLOSED, message="Connection closed")),
+    RuntimeError("MCP client is not connected"),
+])
+def test_dropped_session_is_retried_once(error):
+    assert is_session_error(error)
+    assert run_once(error) == "answer"
+    assert FailingAgent.runs == 2
+
+
+@pytest.mark.parametrize("error", [ValueError("bad input"), RuntimeError("rate limited by the LLM provider")])
+def test_other_failures_are_not_retried(error):
+    assert not is_session_error(error)
+    with pytest.raises(type(error)):
+        run_once(error)
+    assert FailingAgent.runs == 1
+
+
+def test_session_error_is_found_through_the_cause():
+    try:
+        try:
+            raise anyio.BrokenResourceError()
+        except anyio.BrokenResourceError as e:
+            raise RuntimeError("tool call failed") from e
+    except RuntimeError as error:
+        assert is_session_error(error)
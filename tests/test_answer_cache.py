@@ -0,0 +1,27 @@
+# tests/test_answer_cache.py
+
+import asyncio
+from agents.answer_cache import AnswerCache
+
+
+def make_cache(tmp_path, monkeypatch, max_entries=2):
+    cache = AnswerCache(max_entries=max_entries, disk_path=str(tmp_path / "answers.db"), enabled=True)
+
+    async def data_version(force=False):
+        return "v1"
+
+    monkeypatch.setattr(cache, "get_data_version", data_version)
+    return cache
+
+
+def test_disk_hits_respect_max_entries(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch)
+
+    async def scenario():
+        for i in range(5):
+            await cache.put(f"question {i}", "test", "p1", f"answer {i}")
+        cache.clear()
+        return [await cache.get(f"question {i}", "test", "p1") for i in range(5)]
+
+    assert asyncio.run(scenario()) == [f"answer {i}" for i in range(5)]
+    assert list(cache._memory) == [cache.make_key(f"question {i}", "test", "p1") for i in (3, 4)]
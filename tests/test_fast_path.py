@@ -0,0 +1,29 @@
+# tests/test_fast_path.py
+
+import pytest
+from agents.fast_path import match_analysis, load_manifest, FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("query, analysis", [
+    ("Run the case complexity analysis", "Case Complexity Analysis"),
+    ("Show me the latest SOP deviation results", "SOP Deviation Analysis"),
+    ("case_complexity_analyzer_mortgage_events", "Case Complexity Analysis"),
+    ("Give me the resource performance analysis for mortgage_events", "Resource Performance Analysis"),
+])
+def test_plain_requests_take_the_fast_path(query, analysis):
+    entry, confidence = match_analysis(query, load_manifest())
+    assert entry["analysis_type"] == analysis
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", [
+    "List the incomplete cases where amount > 5000",
+    "Explain how the timing analysis is computed",
+    "Do not run the reworked activities analysis, instead count rows in mortgage_events",
+    "Which resources switch most often in incomplete cases",
+    "Run the case complexity analysis on default.some_other_table",
+    "Generate documentation for the timing analysis",
+])
+def test_requests_asking_for_more_go_to_the_agent(query):
+    _, confidence = match_analysis(query, load_manifest())
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
@@ -0,0 +1,158 @@
+# tests/test_jobs.py
+
+import asyncio
+import pytest
+import jobs
+from jobs import JobStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs, "_now", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def new_job(store, n=3, enumerated=True):
+    job_id, created = store.create_job({})
+    assert created
+    store.add_items(job_id, [{"id": i, "question": f"q{i}"} for i in range(1, n + 1)])
+    if enumerated:
+        store.finish_enumeration(job_id)
+    return job_id
+
+
+def statuses(store, job_id):
+    with store._connect() as conn:
+        return {row["question_id"]: (row["status"], row["attempts"])
+                for row in conn.execute("SELECT * FROM job_items WHERE job_id = ?", (job_id,))}
+
+
+def test_active_job_is_reused(store):
+    job_id = new_job(store)
+    assert store.create_job({}) == (job_id, False)
+
+
+def test_claims_are_exclusive_until_the_lease_expires(store, clock):
+    job_id = new_job(store, n=2)
+    first = store.claim("w1", limit=1, lease_seconds=10)
+    second = store.claim("w2", limit=5, lease_seconds=10)
+    assert [i["question_id"] for i in first] == [1]
+    assert [i["question_id"] for i in second] == [2]
+    assert store.claim("w3") == []
+    assert store.progress(job_id)["status"] == "running"
+
+    clock[0] += 11
+    reclaimed = store.claim("w3", limit=5, lease_seconds=10)
+    assert sorted(i["question_id"] for i in reclaimed) == [1, 2]
+    assert statuses(store, job_id) == {1: ("claimed", 2), 2: ("claimed", 2)}
+
+
+def test_failed_items_are_retried_until_max_attempts(store):
+    job_id = new_job(store, n=1)
+    for attempt in range(1, 3):
+        [item] = store.claim("w", max_attempts=3)
+        store.mark_failed(job_id, item["question_id"], "agent error", max_attempts=3)
+        assert statuses(store, job_id) == {1: ("pending", attempt)}
+    [item] = store.claim("w", max_attempts=3)
+    store.mark_failed(job_id, item["question_id"], "agent error", max_attempts=3)
+    assert statuses(store, job_id) == {1: ("failed", 3)}
+    assert store.progress(job_id)["status"] == "completed"
+
+
+def test_expired_leases_stop_after_max_attempts(store, clock):
+    job_id = new_job(store, n=1)
+    for _ in range(2):
+        assert store.claim("w", lease_seconds=10, max_attempts=2)
+        clock[0] += 11
+    assert not store.has_work(max_attempts=2)
+    assert store.claim("w", max_attempts=2) == []
+    assert statuses(store, job_id) == {1: ("failed", 2)}
+    assert store.progress(job_id)["status"] == "completed"
+
+
+def test_job_completes_only_after_enumeration(store):
+    job_id = new_job(store, n=1, enumerated=False)
+    [item] = store.claim("w")
+    store.mark_done(job_id, [item["question_id"]])
+    assert store.progress(job_id)["status"] == "running"
+    store.finish_enumeration(job_id)
+    assert store.progress(job_id)["status"] == "completed"
+
+
+class FakeIntake:
+    pages = [[{"id": 1, "question": "q1"}, {"id": 2, "question": "q2"}], [{"id": 3, "question": "q3"}]]
+
+    def __init__(self, supabase, claim=True):
+        self.stats = {"yielded": 0, "already_answered": 0}
+
+    async def apages(self):
+        for page in self.pages:
+            self.stats["yielded"] += len(page)
+            yield page
+
+
+def test_interrupted_enumeration_is_resumed(store, clock, monkeypatch):
+    monkeypatch.setattr(jobs, "QuestionIntake", FakeIntake)
+    job_id = new_job(store, n=1, enumerated=False)  # a page was queued, then the process died
+    store.claim_enumeration(job_id, lease_seconds=10)
+    asyncio.run(jobs.resume_enumerations(store, supabase=object()))
+    assert store.progress(job_id)["enumeration_complete"] is False  # the lease is still held
+
+    clock[0] += 11
+    asyncio.run(jobs.resume_enumerations(store, supabase=object()))
+    progress = store.progress(job_id)
+    assert progress["enumeration_complete"] is True
+    assert progress["total"] == 3
+
+
+def test_enumerate_job_skips_a_leased_job(store, monkeypatch):
+    monkeypatch.setattr(jobs, "QuestionIntake", FakeIntake)
+    job_id = new_job(store, n=0, enumerated=False)
+    assert store.claim_enumeration(job_id) == job_id
+    asyncio.run(jobs.enumerate_job(store, job_id, supabase=object()))
+    assert store.progress(job_id)["total"] == 0
+
+
+def test_job_params_are_kept(store):
+    job_id, _ = store.create_job({"concurrency": 2, "run_id": "run-1"})
+    assert store.job_params(job_id) == {"concurrency": 2, "run_id": "run-1"}
+
+
+class FailingAgent:
+    async def initialize(self):
+        pass
+
+    def set_system_message(self, prompt):
+        pass
+
+    async def run(self, query):
+        raise RuntimeError("session dropped")
+
+
+def test_worker_survives_an_agent_that_cannot_be_rebuilt(store, monkeypatch):
+    import batch_audit
+
+    async def no_cached_answer(*args):
+        return None
+
+    monkeypatch.setattr(batch_audit.answer_cache, "get", no_cached_answer)
+    built = []
+
+    def factory():
+        if built:
+            raise RuntimeError("factory down")
+        built.append(FailingAgent())
+        return built[-1]
+
+    job_id = new_job(store, n=2)
+    stats = asyncio.run(jobs.run_job_worker(store, concurrency=1, stop_when_idle=True, supabase=object(),
+                                            agent_factory=factory))
+    assert stats["failed"] == 2 * jobs.JOBS_MAX_ATTEMPTS
+    assert {status for status, _ in statuses(store, job_id).values()} == {"failed"}
+    assert store.progress(job_id)["status"] != "running"
@@ -0,0 +1,95 @@
+# tests/test_llm_router.py
+
+import asyncio
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from agents import llm_router
+from agents.llm_router import RoutedChatModel, available_providers
+
+
+def answering(text="hello there world"):
+    return GenericFakeChatModel(messages=iter([AIMessage(content=text)] * 5))
+
+
+class DownModel(GenericFakeChatModel):
+    def _stream(self, *args, **kwargs):
+        raise RuntimeError("provider down")
+        yield
+
+    async def _astream(self, *args, **kwargs):
+        raise RuntimeError("provider down")
+        yield
+
+
+class BreaksMidStream(GenericFakeChatModel):
+    async def _astream(self, *args, **kwargs):
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+            raise RuntimeError("connection reset")
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(llm_router, "provider_stats", llm_router.ProviderStats())
+    monkeypatch.setattr(llm_router, "LLM_ROUTER_EXPLORE", 0.0)
+
+
+def stream_events(model):
+    async def collect():
+        return [event async for event in model.astream_events("hi", version="v2")]
+    return asyncio.run(collect())
+
+
+def test_routing_is_off_by_default(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+    assert llm_router.LLM_ROUTER_PROVIDERS == []
+    assert available_providers("azure") == ["azure"]
+
+
+def test_streams_tokens_through_the_chosen_provider():
+    model = RoutedChatModel(agent_type="test", candidates={"a": answering(), "b": answering("other")})
+    events = stream_events(model)
+    tokens = "".join(e["data"]["chunk"].content for e in events if e["event"] == "on_chat_model_stream")
+    assert tokens == "hello there world"
+
+
+def test_stream_fails_over_before_the_first_token():
+    model = RoutedChatModel(agent_type="test", candidates={"a": DownModel(messages=iter([])), "b": answering()})
+    events = stream_events(model)
+    assert any(e["event"] == "on_chat_model_stream" for e in events)
+    assert llm_router.provider_stats.snapshot()["a"]["error_rate"] == 1.0
+
+
+def test_stream_error_after_the_first_token_is_raised():
+    model = RoutedChatModel(agent_type="test", candidates={
+        "a": BreaksMidStream(messages=iter([AIMessage(content="partial answer")])), "b": answering()})
+    with pytest.raises(RuntimeError, match="connection reset"):
+        stream_events(model)
+
+
+class Slow(GenericFakeChatModel):
+    delay: float = 1.0
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return await super()._agenerate(*args, **kwargs)
+
+
+def test_hedge_loser_is_recorded_as_a_slow_sample(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_ROUTER_HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(llm_router, "LLM_ROUTER_HEDGE_MIN_DELAY", 0.05)
+    model = RoutedChatModel(agent_type="test", hedge=True, candidates={
+        "a": Slow(messages=iter([AIMessage(content="late")])), "b": answering()})
+    assert asyncio.run(model.ainvoke("hi")).content == "hello there world"
+    stats = llm_router.provider_stats.snapshot()
+    assert stats["a"]["calls"] == 1 and stats["a"]["error_rate"] == 0.0 and stats["a"]["p50"] >= 0.05
+    assert stats["b"]["calls"] == 1
+
+
+def test_cancelled_caller_records_no_sample():
+    model = RoutedChatModel(agent_type="test", hedge=False, candidates={
+        "a": Slow(messages=iter([AIMessage(content="late")])), "b": answering()})
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(model.ainvoke("hi"), timeout=0.05))
+    assert llm_router.provider_stats.snapshot() == {}
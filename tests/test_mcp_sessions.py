@@ -0,0 +1,122 @@
+# tests/test_mcp_sessions.py
+
+import os
+import sys
+import asyncio
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import ErrorData, CONNECTION_CLOSED
+from connectors import mcp_client, tool_middleware
+from connectors.mcp_client import MCPSessionManager
+from benchmarks.fakes import FAKE_SERVER_SCRIPT
+
+
+def make_manager(sessions_per_server=1):
+    manager = MCPSessionManager(sessions_per_server)
+    manager.register("fake_server", {"command": sys.executable, "args": [FAKE_SERVER_SCRIPT],
+                                     "env": {**os.environ, "FAKE_MCP_LATENCY": "0", "FAKE_MCP_ROWS": "3"}})
+    return manager
+
+
+def test_call_on_a_dropped_session_reconnects_and_retries():
+    async def scenario():
+        manager = make_manager()
+        await manager.start(servers=[])
+        try:
+            assert not (await manager.call("fake_server", "call_tool", "list_databases", {})).isError
+            session = manager._sessions["fake_server"][0]
+            dropped = session.connector
+            await dropped.disconnect()
+
+            result = await manager.call("fake_server", "call_tool", "run_select_query", {"query": "SELECT 1"})
+            assert not result.isError
+            assert session.connector is not dropped and session.reconnects == 1
+        finally:
+            await manager.stop()
+        assert not manager.running and manager._sessions == {}
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_replaces_a_dead_idle_session(monkeypatch):
+    monkeypatch.setattr(mcp_client, "MCP_HEARTBEAT_INTERVAL", 0.05)
+
+    async def scenario():
+        manager = make_manager(sessions_per_server=2)
+        await manager.start(servers=["fake_server"])
+        try:
+            await manager.ready("fake_server")
+            dead, healthy = manager._sessions["fake_server"]
+            await dead.connector.disconnect()
+            for _ in range(100):
+                if dead.reconnects:
+                    break
+                await asyncio.sleep(0.05)
+            assert dead.reconnects == 1 and dead.connector.is_connected
+            assert healthy.reconnects == 0
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_server_errors_are_not_retried():
+    async def scenario():
+        manager = make_manager()
+        await manager.start(servers=[])
+        try:
+            await manager.ready("fake_server")
+            session = manager._sessions["fake_server"][0]
+            with pytest.raises(McpError):
+                await manager.call("fake_server", "read_resource", "fake://missing")
+            assert session.reconnects == 0 and session.connector.is_connected
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_connection_closed_error_is_retried_on_a_new_session():
+    async def scenario():
+        manager = make_manager()
+        await manager.start(servers=[])
+        try:
+            await manager.ready("fake_server")
+            session = manager._sessions["fake_server"][0]
+            dropped = session.connector
+
+            async def closed_stream(*args, **kwargs):
+                raise McpError(ErrorData(code=CONNECTION_CLOSED, message="Connection closed"))
+
+            dropped.call_tool = closed_stream
+            result = await manager.call("fake_server", "call_tool", "list_databases", {})
+            assert not result.isError
+            assert session.connector is not dropped and session.reconnects == 1
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_wrapped_connector_caps_parallel_tool_calls(monkeypatch):
+    monkeypatch.setattr(tool_middleware, "AGENT_MAX_PARALLEL_TOOL_CALLS", 2)
+    monkeypatch.setattr(tool_middleware, "_middlewares", [])
+
+    class FakeConnector:
+        in_flight = peak = 0
+
+        async def call_tool(self, name, arguments, read_timeout_seconds=None):
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            return name
+
+    async def scenario():
+        connector = tool_middleware.wrap_connector(FakeConnector(), "fake_server")
+        assert tool_middleware.wrap_connector(connector, "fake_server") is connector
+        results = await asyncio.gather(*(connector.call_tool(f"tool_{i}", {}) for i in range(6)))
+        assert results == [f"tool_{i}" for i in range(6)]
+        return connector.peak
+
+    assert asyncio.run(scenario()) == 2
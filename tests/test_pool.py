@@ -0,0 +1,125 @@
+# tests/test_pool.py
+
+import asyncio
+import pytest
+from agents.pool import AgentPool, AgentPoolTimeout
+
+
+class FakeSession:
+    def __init__(self):
+        self.is_connected = True
+
+
+class FakeClient:
+    def __init__(self):
+        self.sessions = {"clickhouse_server": FakeSession()}
+        self.closed = False
+
+    def get_all_active_sessions(self):
+        return {} if self.closed else self.sessions
+
+    async def close_all_sessions(self):
+        self.closed = True
+
+
+class FakeAgent:
+    def __init__(self, n):
+        self.n = n
+        self.client = FakeClient()
+
+    async def initialize(self):
+        pass
+
+
+class Factory:
+    def __init__(self):
+        self.built = 0
+        self.fail = False
+
+    def __call__(self):
+        if self.fail:
+            raise RuntimeError("LLM credentials missing")
+        self.built += 1
+        return FakeAgent(self.built)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_unhealthy_agent_is_replaced_on_checkout():
+    async def scenario():
+        factory = Factory()
+        pool = await AgentPool(factory, size=1, health_check_interval=0).start()
+        async with pool.checkout() as agent:
+            agent.client.sessions["clickhouse_server"].is_connected = False
+        async with pool.checkout() as agent:
+            assert agent.n == 2
+        assert pool.stats()["replaced"] == 1
+        await pool.close()
+    run(scenario())
+
+
+def test_agent_that_raised_is_replaced_on_return():
+    async def scenario():
+        factory = Factory()
+        pool = await AgentPool(factory, size=1, health_check_interval=0).start()
+        with pytest.raises(ValueError):
+            async with pool.checkout():
+                raise ValueError("bad run")
+        async with pool.checkout() as agent:
+            assert agent.n == 2
+        await pool.close()
+    run(scenario())
+
+
+def test_failed_rebuild_keeps_the_slot_and_is_retried():
+    async def scenario():
+        factory = Factory()
+        pool = await AgentPool(factory, size=1, health_check_interval=0).start()
+        factory.fail = True
+        with pytest.raises(ValueError):
+            async with pool.checkout():
+                raise ValueError("bad run")
+        # The rebuild on return failed, but the slot is still there.
+        assert pool.stats()["idle"] == 1
+
+        with pytest.raises(RuntimeError, match="credentials"):
+            async with pool.checkout(timeout=1):
+                pass
+        assert pool.stats()["idle"] == 1
+
+        factory.fail = False
+        async with pool.checkout(timeout=1) as agent:
+            assert agent.n == 2 and not agent.client.closed
+        assert pool.stats()["idle"] == 1 and pool.stats()["ready"] == 1
+        await pool.close()
+    run(scenario())
+
+
+def test_health_loop_retries_a_failed_rebuild():
+    async def scenario():
+        factory = Factory()
+        pool = await AgentPool(factory, size=1, health_check_interval=0.01).start()
+        factory.fail = True
+        async with pool.checkout() as agent:
+            pool.mark_broken(agent)
+        await asyncio.sleep(0.05)
+        assert pool.stats()["idle"] == 1
+        factory.fail = False
+        await asyncio.sleep(0.05)
+        async with pool.checkout(timeout=1) as agent:
+            assert agent.n == 2
+        await pool.close()
+    run(scenario())
+
+
+def test_checkout_timeout_is_distinct():
+    async def scenario():
+        pool = await AgentPool(Factory(), size=1, health_check_interval=0).start()
+        async with pool.checkout():
+            with pytest.raises(AgentPoolTimeout):
+                async with pool.checkout(timeout=0.01):
+                    pass
+        await pool.close()
+    run(scenario())
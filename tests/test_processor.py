@@ -0,0 +1,55 @@
+# tests/test_processor.py
+
+import os
+from types import SimpleNamespace
+import processor
+
+
+class FakeClickHouse:
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def query(self, sql, parameters=None):
+        if "view_metadata_catalog" in sql:
+            return SimpleNamespace(column_names=["view_name", "sql_template_path"], result_rows=list(self.catalog))
+        return SimpleNamespace(column_names=["name", "create_table_query"],
+                               result_rows=[(view, f"CREATE VIEW {view}") for view, _ in self.catalog])
+
+
+def sync(tmp_path, monkeypatch, catalog):
+    monkeypatch.setattr(processor, "create_clickhouse_client", lambda **options: FakeClickHouse(catalog))
+    return processor.sync_manifest_and_sql_files(
+        str(tmp_path / "manifest.json"), str(tmp_path / "sql"), str(tmp_path / "state.json"))
+
+
+def test_only_generated_untouched_files_are_removed(tmp_path, monkeypatch):
+    (tmp_path / "sql").mkdir()
+    (tmp_path / "sql" / "hand_written.sql").write_text("SELECT 1;")
+    report = sync(tmp_path, monkeypatch, [("a_view", "a.sql"), ("b_view", "b.sql"), ("c_view", "c.sql")])
+    assert report["sql_written"] == ["a.sql", "b.sql", "c.sql"]
+
+    (tmp_path / "sql" / "b.sql").write_text("SELECT * FROM default.b_view WHERE amount > 0;")
+    report = sync(tmp_path, monkeypatch, [("a_view", "a.sql")])
+    assert report["removed"] == ["b_view", "c_view"]
+    assert report["sql_removed"] == ["c.sql"]
+    assert report["sql_kept"] == ["b.sql"]
+    assert sorted(os.listdir(tmp_path / "sql")) == ["a.sql", "b.sql", "hand_written.sql"]
+
+
+def test_unchanged_catalog_writes_nothing(tmp_path, monkeypatch):
+    catalog = [("a_view", "a.sql")]
+    sync(tmp_path, monkeypatch, catalog)
+    report = sync(tmp_path, monkeypatch, catalog)
+    assert report["unchanged"] == ["a_view"]
+    assert not report["sql_written"] and not report["manifest_rewritten"]
+
+
+def test_rewritten_files_keep_a_readable_mode(tmp_path, monkeypatch):
+    (tmp_path / "sql").mkdir()
+    (tmp_path / "sql" / "a.sql").write_text("stale")
+    os.chmod(tmp_path / "sql" / "a.sql", 0o664)
+    sync(tmp_path, monkeypatch, [("a_view", "a.sql"), ("b_view", "b.sql")])
+    assert (tmp_path / "sql" / "a.sql").read_text() != "stale"
+    assert os.stat(tmp_path / "sql" / "a.sql").st_mode & 0o777 == 0o664
+    assert os.stat(tmp_path / "sql" / "b.sql").st_mode & 0o777 == 0o644
+    assert os.stat(tmp_path / "manifest.json").st_mode & 0o777 == 0o644
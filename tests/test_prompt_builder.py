@@ -0,0 +1,42 @@
+# tests/test_prompt_builder.py
+
+import pytest
+from agents.prompt_builder import ManifestIndex, build_prompt, count_tokens
+
+ENTRIES = [
+    {"analysis_type": f"Analysis {name}", "sql_template_path": f"{name}.sql", "dataset": "events",
+     "description": f"{name} " + "detail " * 40}
+    for name in ("alpha", "beta", "gamma", "delta", "epsilon")
+]
+FIXED = [("header", "You are an auditor."), ("manifest", None), ("procedure", "Answer in markdown.")]
+
+
+def build(query, budget, top_k=3):
+    index = ManifestIndex(ENTRIES)
+    return build_prompt(FIXED, "manifest", index.section, query, top_k=top_k, budget=budget)
+
+
+def test_default_prompt_inlines_every_entry_when_it_fits():
+    prompt, report = build("", budget=10_000)
+    assert report["k"] == "all"
+    assert all(f"Analysis {name}:" in prompt for name in ("alpha", "epsilon"))
+
+
+def test_default_prompt_is_held_to_the_budget():
+    _, full = build("", budget=10_000)
+    prompt, report = build("", budget=full["total"] - 1)
+    assert report["k"] == 3
+    assert count_tokens(prompt) <= report["budget"]
+    assert "Analysis epsilon -> `epsilon.sql`" in prompt  # named, not inlined
+
+
+def test_query_prompt_drops_entries_until_it_fits():
+    _, one = build("alpha beta gamma", budget=10_000, top_k=1)
+    prompt, report = build("alpha beta gamma", budget=one["total"])
+    assert report["k"] == 1
+    assert report["total"] <= report["budget"]
+
+
+def test_prompt_that_cannot_fit_raises():
+    with pytest.raises(ValueError, match="PROMPT_TOKEN_BUDGET"):
+        build("alpha", budget=5)
@@ -0,0 +1,163 @@
+# tests/test_query_guard.py
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from connectors import query_guard
+from connectors.tool_middleware import text_result
+
+
+def guard(sql, sample=None):
+    info = query_guard.parse_query(sql)
+    guarded, _ = query_guard.guard_query(sql, info, "qid", sample)
+    return guarded
+
+
+def settings(extra=""):
+    return (f"SETTINGS {extra}max_execution_time=60, max_result_rows=100000, result_overflow_mode='throw', "
+            f"max_memory_usage=4294967296, log_comment='qid'")
+
+
+@pytest.fixture(autouse=True)
+def defaults(monkeypatch):
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_DEFAULT_LIMIT", 10000)
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_MAX_EXECUTION_TIME", 60)
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_MAX_RESULT_ROWS", 100000)
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_MAX_MEMORY_USAGE", 4294967296)
+    monkeypatch.setattr(query_guard, "_estimates_paused_until", 0.0)
+    monkeypatch.setattr(query_guard, "_sampling_keys", {})
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_SETTINGS", "auto")
+    monkeypatch.setattr(query_guard, "_send_settings", True)
+    monkeypatch.setattr(query_guard.manifest_store, "get", lambda: [{"view_name": "case_events"}])
+
+
+# --- REWRITES ---
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT a FROM e", f"SELECT a FROM e LIMIT 10000 {settings()}"),
+    ("SELECT a FROM e LIMIT 50;", f"SELECT a FROM e LIMIT 50 {settings()}"),
+    ("SELECT a FROM e LIMIT 10, 20", f"SELECT a FROM e LIMIT 10, 20 {settings()}"),
+    ("SELECT a FROM e LIMIT 2 BY k", f"SELECT a FROM e LIMIT 2 BY k LIMIT 10000 {settings()}"),
+    ("SELECT a FROM e ORDER BY t LIMIT 5 SETTINGS max_threads=2 FORMAT JSON",
+     f"SELECT a FROM e ORDER BY t LIMIT 5 {settings('max_threads=2, ')} FORMAT JSON"),
+    ("SELECT a FROM e WHERE x = 'a;b -- LIMIT 3' -- LIMIT 4\n;",
+     f"SELECT a FROM e WHERE x = 'a;b -- LIMIT 3' LIMIT 10000 {settings()}"),
+    ("SELECT * FROM (SELECT a FROM e LIMIT 5) AS s", f"SELECT * FROM (SELECT a FROM e LIMIT 5) AS s LIMIT 10000 {settings()}"),
+    ("WITH t AS (SELECT 1) SELECT * FROM t LIMIT 3", f"WITH t AS (SELECT 1) SELECT * FROM t LIMIT 3 {settings()}"),
+])
+def test_limit_and_settings_rewrite(sql, expected):
+    assert guard(sql) == expected
+
+
+def test_set_operations_are_limited_as_a_whole():
+    for sql in ("SELECT a FROM e UNION ALL SELECT a FROM f", "SELECT a FROM e UNION ALL SELECT a FROM f LIMIT 5"):
+        assert query_guard.parse_query(sql)["limit"] is None
+        assert guard(sql) == f"SELECT * FROM ({sql}) LIMIT 10000 {settings()}"
+
+
+def test_sample_goes_after_the_table_and_final():
+    sql = "SELECT count() FROM default.e FINAL WHERE y > 1"
+    assert guard(sql, 0.05).startswith("SELECT count() FROM default.e FINAL SAMPLE 0.05 WHERE y > 1 LIMIT 10000 ")
+
+
+def test_parse_counts_statements_and_kind():
+    assert query_guard.parse_query("SELECT 1; DROP TABLE x")["statements"] == 2
+    assert query_guard.parse_query("SELECT ';' -- ;\n;")["statements"] == 1
+    assert query_guard.parse_query("show tables")["kind"] == "SHOW"
+
+
+def test_template_queries_are_recognized():
+    assert query_guard.is_template_query("SELECT * FROM default.case_events;")
+    assert query_guard.is_template_query(f"select * from {query_guard.snapshot_table_name('case_events')}")
+    assert not query_guard.is_template_query("SELECT * FROM default.other_view")
+    assert not query_guard.is_template_query("SELECT * FROM default.case_events LIMIT 5")
+
+
+# --- MIDDLEWARE ---
+
+def run_guarded(monkeypatch, sql, estimated_rows=10, sampling_key="", explain_fails=False, readonly=False):
+    executed = []
+
+    async def fake_run_query(sql, parameters=None):
+        if sql.startswith("EXPLAIN"):
+            if explain_fails:
+                raise RuntimeError("EXPLAIN ESTIMATE unavailable")
+            return SimpleNamespace(column_names=["database", "table", "parts", "rows", "marks"],
+                                   result_rows=[["default", "e", 1, estimated_rows, estimated_rows // 8192]])
+        return SimpleNamespace(column_names=["sampling_key"], result_rows=[[sampling_key]])
+
+    async def call_next(tool_name, arguments):
+        executed.append(arguments["query"])
+        if readonly and " SETTINGS " in arguments["query"]:
+            return text_result("Code: 164. DB::Exception: Cannot modify 'max_execution_time' setting in readonly mode. "
+                               "(READONLY)", is_error=True)
+        return text_result('{"columns": ["a"], "rows": [[1]]}')
+
+    monkeypatch.setattr(query_guard, "run_query", fake_run_query)
+    result = asyncio.run(query_guard.guard_select_queries("clickhouse_server", "run_select_query", {"query": sql}, call_next))
+    return result, executed
+
+
+def test_multiple_statements_and_guard_setting_overrides_are_rejected(monkeypatch):
+    for sql in ("SELECT 1; SELECT 2", "SELECT a FROM e SETTINGS max_execution_time=999"):
+        result, executed = run_guarded(monkeypatch, sql)
+        assert result.isError and not executed
+
+
+def test_template_query_is_not_limited_or_estimated(monkeypatch):
+    result, executed = run_guarded(monkeypatch, "SELECT * FROM default.case_events;", estimated_rows=10 ** 12)
+    assert not result.isError
+    assert executed == ["SELECT * FROM default.case_events SETTINGS max_execution_time=60, "
+                        "max_memory_usage=4294967296, log_comment='" + executed[0].split("log_comment='")[1]]
+    assert "LIMIT" not in executed[0] and "max_result_rows" not in executed[0]
+
+
+def test_failed_estimate_runs_the_query_guarded(monkeypatch):
+    result, executed = run_guarded(monkeypatch, "SELECT a FROM e", explain_fails=True)
+    assert not result.isError
+    assert "LIMIT 10000" in executed[0] and "result_overflow_mode='throw'" in executed[0]
+
+
+def test_over_budget_query_is_sampled_or_rejected(monkeypatch):
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_ACTION", "rewrite")
+    result, executed = run_guarded(monkeypatch, "SELECT count() FROM default.e", estimated_rows=10 ** 10)
+    assert result.isError and not executed  # no sampling key
+
+    query_guard._sampling_keys.clear()
+    result, executed = run_guarded(monkeypatch, "SELECT count() FROM default.e", estimated_rows=10 ** 10,
+                                   sampling_key="intHash32(case_id)")
+    assert not result.isError and " SAMPLE " in executed[0]
+    assert "SAMPLE" in result.content[-1].text
+
+
+def test_small_limit_scan_is_allowed_over_budget(monkeypatch):
+    result, executed = run_guarded(monkeypatch, "SELECT * FROM default.e LIMIT 50", estimated_rows=10 ** 10)
+    assert not result.isError and " SAMPLE " not in executed[0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM default.e WHERE user_id = 'x' LIMIT 100",
+    "SELECT * FROM default.e PREWHERE user_id = 'x' LIMIT 100",
+    "SELECT sum(bytes) FROM default.e LIMIT 1",
+    "SELECT user_id, countIf(bytes > 0) FROM default.e LIMIT 1",
+    "SELECT * FROM (SELECT count() FROM default.e) LIMIT 1",
+])
+def test_filtered_or_aggregated_limit_query_is_held_to_the_budget(monkeypatch, sql):
+    result, executed = run_guarded(monkeypatch, sql, estimated_rows=5 * 10 ** 9)
+    assert result.isError and not executed
+
+
+def test_readonly_server_falls_back_to_no_settings(monkeypatch):
+    result, executed = run_guarded(monkeypatch, "SELECT a FROM e LIMIT 5", readonly=True)
+    assert not result.isError
+    assert " SETTINGS " in executed[0] and executed[1] == "SELECT a FROM e LIMIT 5"
+    assert query_guard._send_settings is False
+
+    result, executed = run_guarded(monkeypatch, "SELECT a FROM e LIMIT 5", readonly=True)
+    assert not result.isError and executed == ["SELECT a FROM e LIMIT 5"]
+
+
+def test_query_mode_never_drops_the_settings(monkeypatch):
+    monkeypatch.setattr(query_guard, "QUERY_GUARD_SETTINGS", "query")
+    result, executed = run_guarded(monkeypatch, "SELECT a FROM e LIMIT 5", readonly=True)
+    assert result.isError and len(executed) == 1 and query_guard._send_settings is True
@@ -0,0 +1,26 @@
+# tests/test_question_intake.py
+
+from benchmarks.fakes import FakeSupabase, make_questions
+from connectors.question_intake import QuestionIntake
+
+
+def intake_with_answers(total, answered, page_size):
+    supabase = FakeSupabase(make_questions(total))
+    supabase.tables["t_auditor_ques_answers"] = [
+        {"question_id": item["id"], "question": item["question"]} for item in make_questions(answered)]
+    return QuestionIntake(supabase, page_size=page_size, claim=False)
+
+
+def test_mostly_answered_first_page_is_not_the_whole_backlog():
+    intake = intake_with_answers(total=250, answered=95, page_size=100)
+    pages = intake.pages()
+    assert len(next(pages)) == 5
+    assert intake.exhausted is False
+    assert sum(len(page) for page in pages) == 150
+    assert intake.exhausted is True
+
+
+def test_short_table_is_exhausted_after_its_only_page():
+    intake = intake_with_answers(total=30, answered=0, page_size=100)
+    assert len(next(intake.pages())) == 30
+    assert intake.exhausted is True
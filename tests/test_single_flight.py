@@ -0,0 +1,110 @@
+# tests/test_single_flight.py
+
+import asyncio
+import pytest
+import batch_audit
+from agents.single_flight import SingleFlight
+from agents.pool import AgentPoolTimeout
+
+
+def test_leader_exception_reaches_every_caller_and_is_not_kept():
+    async def scenario():
+        flight, started = SingleFlight(), asyncio.Event()
+
+        async def failing():
+            started.set()
+            await asyncio.sleep(0.01)
+            raise AgentPoolTimeout("no agent")
+
+        leader = asyncio.create_task(flight.do("k", "test", failing))
+        await started.wait()
+        follower = asyncio.create_task(flight.do("k", "test", failing))
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        assert all(isinstance(result, AgentPoolTimeout) for result in results)
+        assert flight.stats()["in_flight"] == 0
+
+        async def succeeding():
+            return "answer"
+
+        assert await flight.do("k", "test", succeeding) == ("answer", False)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_run():
+    async def scenario():
+        flight, started = SingleFlight(), asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        leader = asyncio.create_task(flight.do("k", "test", work))
+        await started.wait()
+        follower = asyncio.create_task(flight.do("k", "test", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == ("answer", True)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_run_cancels_its_callers():
+    async def scenario():
+        flight = SingleFlight()
+        work_task = []
+
+        async def work():
+            work_task.append(asyncio.current_task())
+            await asyncio.sleep(10)
+
+        callers = [asyncio.create_task(flight.do("k", "test", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        work_task[0].cancel()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_batch_caller_retries_a_failed_shared_run_on_its_own_pool(monkeypatch):
+    flight = SingleFlight()
+    monkeypatch.setattr(batch_audit, "single_flight", flight)
+
+    async def no_cached_answer(*args):
+        return None
+
+    async def no_put(*args):
+        pass
+
+    async def own_pool_run(pool, question_id, question_text, question_timeout, stats):
+        return "answer from the batch pool"
+
+    monkeypatch.setattr(batch_audit.answer_cache, "get", no_cached_answer)
+    monkeypatch.setattr(batch_audit.answer_cache, "put", no_put)
+    monkeypatch.setattr(batch_audit, "_run_on_pool", own_pool_run)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def ask_run():  # an '/ask' run that times out waiting for the '/ask' pool
+            started.set()
+            await asyncio.sleep(0.01)
+            raise AgentPoolTimeout("No ask agent became free within 30s.")
+
+        key = batch_audit.answer_cache.make_key("q", "clickhouse_audit", batch_audit.AUDIT_PROMPT_VERSION)
+        ask = asyncio.create_task(flight.do(key, "clickhouse_audit", ask_run))
+        await started.wait()
+        stats = {"answered": 0, "cached": 0, "coalesced": 0, "failed": 0, "timed_out": 0}
+        response = await batch_audit.answer_question(None, 1, "q", 10, stats)
+        with pytest.raises(AgentPoolTimeout):
+            await ask
+        return response, stats
+
+    response, stats = asyncio.run(scenario())
+    assert response == "answer from the batch pool"
+    assert stats["answered"] == 1 and stats["failed"] == 0
@@ -0,0 +1,50 @@
+# tests/test_snapshot_refresher.py
+
+import os
+import json
+import asyncio
+import snapshot_refresher
+from snapshot_refresher import SnapshotRefresher
+
+
+def test_stop_waits_for_the_refresh_in_progress(monkeypatch):
+    events = []
+
+    async def refresh_all(self):
+        events.append("refresh started")
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.01)  # e.g. closing a half-written snapshot
+            events.append("refresh unwound")
+
+    monkeypatch.setattr(SnapshotRefresher, "refresh_all", refresh_all)
+
+    async def scenario():
+        refresher = SnapshotRefresher(backend="clickhouse")
+
+        async def no_state():
+            pass
+
+        refresher._load_state = no_state
+        await refresher.start()
+        await asyncio.sleep(0.01)
+        await refresher.stop()
+        events.append("stopped")
+
+    asyncio.run(scenario())
+    assert events == ["refresh started", "refresh unwound", "stopped"]
+
+
+def test_parquet_metadata_is_replaced_atomically(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_refresher, "SNAPSHOT_DIR", str(tmp_path))
+    refresher = SnapshotRefresher(backend="parquet")
+    info = {"location": str(tmp_path / "case_events.parquet"), "refreshed_at": 1.0, "row_count": None,
+            "duration_ms": 5}
+    asyncio.run(refresher._record("case_events", info))
+    assert os.listdir(tmp_path) == ["case_events.parquet.json"]
+    assert json.loads((tmp_path / "case_events.parquet.json").read_text()) == info
+
+    reloaded = SnapshotRefresher(backend="parquet")
+    asyncio.run(reloaded._load_state())
+    assert reloaded.snapshots == {"case_events": info}
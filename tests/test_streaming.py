@@ -0,0 +1,86 @@
+# tests/test_streaming.py
+
+import asyncio
+from types import SimpleNamespace
+from agents import streaming
+from agents.streaming import stream_agent_run, translate_event
+
+
+class FakeAgent:
+    def __init__(self, events, error=None):
+        self.events, self.error = events, error
+
+    async def stream_events(self, query):
+        for event in self.events:
+            yield event
+        if self.error:
+            raise self.error
+
+
+EVENTS = [
+    {"event": "on_chat_model_start", "data": {}},
+    {"event": "on_chat_model_stream", "data": {"chunk": SimpleNamespace(content=[{"text": "Look"}, "ing"])}},
+    {"event": "on_chat_model_stream", "data": {"chunk": SimpleNamespace(content="")}},
+    {"event": "on_tool_start", "name": "run_select_query", "data": {"input": {"query": "SELECT 1"}}},
+    {"event": "on_tool_end", "name": "run_select_query", "data": {"output": [SimpleNamespace(text="x" * 30)]}},
+    {"event": "on_chain_end", "parent_ids": ["run"], "data": {"output": {"output": "inner"}}},
+    {"event": "on_chain_end", "parent_ids": [], "data": {"output": {"output": "final answer"}}},
+]
+
+
+def collect(agent):
+    async def scenario():
+        return [item async for item in stream_agent_run(agent, "q", "test")]
+    return asyncio.run(scenario())
+
+
+def test_translate_event(monkeypatch):
+    monkeypatch.setattr(streaming, "SSE_TOOL_PREVIEW_CHARS", 10)
+    state = {"steps": 0, "answer": None, "started": 0.0}
+    translated = [translate_event(event, state) for event in EVENTS]
+    assert [item[0] if item else None for item in translated] == [
+        "step", "token", None, "tool_start", "tool_result", None, None]
+    assert translated[1][1] == {"text": "Looking"}
+    assert translated[4][1] == {"tool": "run_select_query", "preview": "x" * 10, "chars": 30, "truncated": True}
+    assert state == {"steps": 1, "answer": "final answer", "started": 0.0}
+
+
+def test_stream_ends_with_the_answer():
+    items = collect(FakeAgent(EVENTS))
+    assert [event for event, _ in items] == ["step", "token", "tool_start", "tool_result", "answer"]
+    assert items[-1][1]["answer"] == "final answer" and items[-1][1]["steps"] == 1
+
+
+def test_failed_run_ends_with_an_error_and_no_answer():
+    items = collect(FakeAgent(EVENTS[:2], error=RuntimeError("MCP client is not connected")))
+    assert items[-1] == ("error", {"error": "MCP client is not connected"})
+    assert "answer" not in [event for event, _ in items]
+
+
+def test_ask_stream_replaces_an_agent_whose_run_failed(monkeypatch):
+    import main
+    from agents.pool import AgentPool
+
+    class FailingAgent(FakeAgent):
+        def __init__(self):
+            super().__init__(EVENTS[:1], error=RuntimeError("MCP client is not connected"))
+
+        def set_system_message(self, prompt):
+            pass
+
+    async def no_cached_answer(*args):
+        return None
+
+    monkeypatch.setattr(main.answer_cache, "get", no_cached_answer)
+
+    async def scenario():
+        pool = await AgentPool(FailingAgent, size=1, name="ask", health_check_interval=0).start(warm=False)
+        monkeypatch.setattr(main, "interactive_agent_pool", pool)
+        response = await main.ask_agent_stream("q")
+        body = "".join([chunk async for chunk in response.body_iterator])
+        await pool.close()
+        return body, pool.replaced_count
+
+    body, replaced = asyncio.run(scenario())
+    assert "event: error" in body and "event: answer" not in body
+    assert replaced == 1